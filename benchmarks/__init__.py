@@ -0,0 +1,10 @@
+"""
+benchmarks
+
+Collector benchmarks that run against generated /proc and /sys trees.
+
+OVERVIEW:
+Every path merrin reads lives in merrin/config.py, so pointing those constants at a fake
+tree lets the collectors be measured at any size (hundreds of CPUs, hwmon chips and GPUs)
+on any Linux machine. See run.py for usage.
+"""
@@ -0,0 +1,130 @@
+"""
+agents.py
+
+Many simulated agents for testing an aggregator on one machine.
+
+USAGE:
+python -m benchmarks.agents ADDR:PORT [OPTIONS]
+
+--agents N          Simulated hosts (default 100)
+--cpus N            cpuN lines in each host's /proc/stat (default 16)
+--interval X        Seconds between snapshots (default 1)
+--duration X        Seconds to run for, 0 to run until interrupted (default 0)
+
+Start an aggregator first (merrin --aggregate ADDR:PORT), then point this at it.
+
+SIMULATION:
+Every host gets its own generated /proc and /sys tree (see fixtures.py) with its own random
+seed, so temperatures and load differ between rows of the grid, and its own collectors and
+connection, exactly as merrin --agent would have. All of them run in this one process: each
+interval, every tree is advanced, merrin's configuration is pointed at it and its collectors
+run. Hosts are named node000, node001 and so on.
+
+When it stops, it prints how many bytes the agents sent: the first snapshot of each host
+(HELLO and FULL frames) and the average DELTA frame after that.
+"""
+
+import getopt
+import resource
+import sys
+import time
+
+import merrin.reader
+from benchmarks.fixtures import FakeTree
+from merrin.agent import AgentConnection
+from merrin.scheduler import build_scheduler
+
+"""
+SimulatedHost - One fake machine: its tree, collectors and connection
+@index: Number of the host, used for its name and random seed
+@address: (host, port) of the aggregator
+@options: Parsed command line options
+"""
+class SimulatedHost:
+    def __init__(self, index, address, options):
+        self.tree = FakeTree(cpus=options["cpus"], processes=1, cgroups=1, seed=index)
+        self.tree.apply()
+        self.scheduler = build_scheduler(options["interval"], tables=False)
+        self.connection = AgentConnection(address, options["interval"], name=f"node{index:03}")
+        # Bytes sent for the first snapshot, and how many snapshots were sent
+        self.first = None
+        self.snapshots = 0
+
+    """
+    tick - Advance the tree, collect a snapshot and send it
+    @seconds: Time that passed since the last tick
+    """
+    def tick(self, seconds):
+        self.tree.advance(seconds)
+        self.tree.apply()
+        if self.scheduler.run_due():
+            self.connection.send(self.scheduler.values)
+            if self.connection.sock is not None:
+                self.snapshots += 1
+                if self.first is None:
+                    self.first = self.connection.sent
+
+    """
+    close - Disconnect and delete the tree
+    """
+    def close(self):
+        self.connection.close()
+        self.tree.remove()
+
+"""
+main - Parse options, run the hosts and report what they sent
+"""
+def main():
+    options = {"agents": 100, "cpus": 16, "interval": 1.0, "duration": 0.0}
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "h", ["agents=", "cpus=", "interval=", "duration="])
+        for opt, arg in opts:
+            if opt == "-h":
+                print(__doc__)
+                sys.exit(0)
+            name = opt[2:]
+            options[name] = float(arg) if name in ("interval", "duration") else int(arg)
+        if len(args) != 1:
+            raise ValueError("the aggregator's ADDR:PORT is needed")
+        host, _, port = args[0].rpartition(":")
+        address = (host.strip("[]"), int(port))
+    except (getopt.GetoptError, ValueError) as err:
+        print(err)
+        sys.exit(2)
+
+    # Every host keeps a dozen files and a socket open
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    hosts = [SimulatedHost(index, address, options) for index in range(options["agents"])]
+    start = time.monotonic()
+    deadline = start
+    try:
+        while not options["duration"] or time.monotonic() - start < options["duration"]:
+            for host in hosts:
+                host.tick(options["interval"])
+            deadline += options["interval"]
+            time.sleep(max(0.0, deadline - time.monotonic()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for host in hosts:
+            host.close()
+        for pseudo_file in merrin.reader.FILES.values():
+            pseudo_file.close()
+        merrin.reader.FILES.clear()
+
+    sent = [host for host in hosts if host.first is not None]
+    if not sent:
+        print("Nothing was sent, is the aggregator running?")
+        sys.exit(1)
+    first = sum(host.first for host in sent) / len(sent)
+    deltas = sum(host.snapshots - 1 for host in sent)
+    delta_bytes = sum(host.connection.sent - host.first for host in sent)
+    print(f"{len(sent)} of {len(hosts)} hosts connected")
+    print(f"first snapshot  {first:>8.0f} bytes per host")
+    if deltas:
+        print(f"DELTA frames    {delta_bytes / deltas:>8.0f} bytes on average, {deltas} sent")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+fixtures.py
+
+Generator for synthetic /proc and /sys trees.
+
+OVERVIEW:
+Builds the files merrin's collectors read, at a configurable size, under a temporary
+directory. The contents follow the kernel's formats closely enough for the parsers, but the
+numbers are made up. advance() moves the counters forward so delta-based collectors (the CPU
+sampler, the process table) have something to compute between samples.
+
+LAYOUT:
+<root>/proc/stat, meminfo, uptime
+<root>/proc/<pid>/stat, cmdline
+<root>/proc/diskstats, net/dev, pressure/cpu, memory, io
+<root>/sys/block/<disk>/
+<root>/sys/fs/cgroup/<slice>.slice/<service>.service/cpu.stat, memory.current, io.stat
+<root>/sys/class/hwmon/hwmonN/name, tempX_label, tempX_input
+<root>/sys/class/drm/cardN/device/mem_info_vis_vram_used, mem_info_vis_vram_total, mem_info_gtt_used,
+    mem_info_gtt_total, gpu_busy_percent, pp_dpm_sclk, pp_dpm_mclk, hwmon/hwmonN/power1_average
+<root>/sys/class/drm/cardN-<connector>/ and renderD<128+N>/ (entries without VRAM files)
+"""
+
+import os
+import random
+import shutil
+import tempfile
+
+import merrin.config
+
+# Chip names used for the hwmon entries that aren't the CPU or GPU sensors
+OTHER_CHIPS = ("nvme", "acpitz", "iwlwifi_1", "nct6775", "spd5118", "mt7921_phy0")
+
+# Command names given to the generated processes
+COMMANDS = ("bash", "python3", "postgres", "nginx", "kworker/3:1", "systemd", "node", "cc1plus")
+
+# Processes whose CPU time moves on each advance(), the rest stay idle
+BUSY_PROCESSES = 10
+
+# Display connectors created for every card
+CONNECTORS = ("DP-1", "DP-2", "DP-3", "HDMI-A-1", "HDMI-A-2", "eDP-1", "Writeback-1", "DVI-D-1")
+
+"""
+write - Create a file and any missing parent directories
+@path: Path to the file
+@content: Text to write
+"""
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+"""
+FakeTree - A generated /proc and /sys tree
+@cpus: Number of cpuN lines in /proc/stat
+@hwmon_chips: Number of hwmonN directories, including one k10temp and one amdgpu per card
+@cards: Number of DRM cards with VRAM files
+@connectors: Display connector entries per card
+@temps_per_chip: Temperature channels on each chip
+@processes: Number of /proc/<pid> directories
+@disks: Number of disks in /proc/diskstats, each with a few partitions and loop devices alongside
+@interfaces: Number of network interfaces in /proc/net/dev
+@cgroups: Number of service cgroups, spread over a few slices
+@seed: Seed for the random numbers, so runs are repeatable
+"""
+class FakeTree:
+    def __init__(self, cpus=16, hwmon_chips=8, cards=1, connectors=3, temps_per_chip=4, processes=100, disks=4, interfaces=4, cgroups=50, seed=0):
+        self.cpus = cpus
+        self.hwmon_chips = max(hwmon_chips, 1 + cards)
+        self.cards = cards
+        self.connectors = min(connectors, len(CONNECTORS))
+        self.temps_per_chip = temps_per_chip
+        # Cumulative utime of each process, by PID
+        self.process_ticks = {pid: 0 for pid in range(1, processes + 1)}
+        # Cumulative counters of each block device and interface, by name
+        self.disk_counters = {}
+        for disk in range(disks):
+            for name in [f"nvme{disk}n1"] + [f"nvme{disk}n1p{part}" for part in range(1, 4)] + [f"loop{disk}"]:
+                self.disk_counters[name] = [0] * 11
+        self.disks = [f"nvme{disk}n1" for disk in range(disks)]
+        self.net_counters = {name: [0] * 16 for name in ["lo"] + [f"eth{index}" for index in range(interfaces)]}
+        self.cgroups = [f"slice{index % 4}.slice/service{index}.service" for index in range(cgroups)]
+        self.random = random.Random(seed)
+        self.root = tempfile.mkdtemp(prefix="merrin-bench-")
+        # Cumulative cpu counters, one row of 10 per line of /proc/stat (aggregate first)
+        self.counters = [[1000 * (column + 1) for column in range(10)] for _ in range(cpus + 1)]
+        self.uptime = 12345.67
+        self.build()
+
+    """
+    path - Absolute path of a file inside the tree
+    """
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    """
+    build - Write every file of the tree
+    """
+    def build(self):
+        self.write_stat()
+        self.write_uptime()
+        self.write_io()
+        for disk in self.disks:
+            os.makedirs(self.path("sys", "block", disk))
+        for resource in ("cpu", "memory", "io"):
+            write(self.path("proc", "pressure", resource), "some avg10=1.50 avg60=1.20 avg300=0.80 total=123456\n"
+                                                           "full avg10=0.25 avg60=0.10 avg300=0.05 total=23456\n")
+        cgroup_root = self.path("sys", "fs", "cgroup")
+        write(os.path.join(cgroup_root, "cgroup.controllers"), "cpuset cpu io memory pids\n")
+        for group in sorted({os.path.dirname(group) for group in self.cgroups}) + self.cgroups:
+            write(os.path.join(cgroup_root, group, "cpu.stat"), f"usage_usec {self.random.randint(0, 10 ** 9)}\nuser_usec 0\nsystem_usec 0\n")
+            write(os.path.join(cgroup_root, group, "memory.current"), f"{self.random.randint(0, 2 ** 32)}\n")
+            write(os.path.join(cgroup_root, group, "io.stat"), "259:0 rbytes=1000 wbytes=2000 rios=1 wios=2 dbytes=0 dios=0\n")
+        meminfo = ["MemTotal:       65536000 kB", "MemFree:        12000000 kB", "MemAvailable:   40000000 kB"]
+        # The rest of the real file, which the collector should skip over
+        meminfo += [f"Filler{index}:        {index * 1000} kB" for index in range(50)]
+        write(self.path("proc", "meminfo"), "\n".join(meminfo) + "\n")
+
+        hwmon_root = self.path("sys", "class", "hwmon")
+        names = ["k10temp"] + ["amdgpu"] * self.cards
+        names += [OTHER_CHIPS[index % len(OTHER_CHIPS)] for index in range(self.hwmon_chips - len(names))]
+        for index, name in enumerate(names):
+            chip = os.path.join(hwmon_root, f"hwmon{index}")
+            write(os.path.join(chip, "name"), name + "\n")
+            labels = {"k10temp": ["Tctl"] + [f"Tccd{n}" for n in range(1, self.temps_per_chip)],
+                      "amdgpu": ["edge", "junction", "mem"]}.get(name, [f"Sensor {n}" for n in range(1, self.temps_per_chip + 1)])
+            for channel, label in enumerate(labels, start=1):
+                write(os.path.join(chip, f"temp{channel}_label"), label + "\n")
+                write(os.path.join(chip, f"temp{channel}_input"), f"{self.random.randint(30000, 90000)}\n")
+
+        drm_root = self.path("sys", "class", "drm")
+        for card in range(self.cards):
+            device = os.path.join(drm_root, f"card{card}", "device")
+            write(os.path.join(device, "mem_info_vis_vram_used"), f"{self.random.randint(1, 16) * 1024 ** 3}\n")
+            write(os.path.join(device, "mem_info_vis_vram_total"), f"{24 * 1024 ** 3}\n")
+            write(os.path.join(device, "mem_info_gtt_used"), f"{self.random.randint(1, 512) * 1024 ** 2}\n")
+            write(os.path.join(device, "mem_info_gtt_total"), f"{32 * 1024 ** 3}\n")
+            write(os.path.join(device, "gpu_busy_percent"), f"{self.random.randint(0, 100)}\n")
+            current = self.random.randint(0, 2)
+            write(os.path.join(device, "pp_dpm_sclk"), "".join(f"{level}: {mhz}Mhz {'*' if level == current else ''}\n" for level, mhz in enumerate((500, 1800, 2500))))
+            write(os.path.join(device, "pp_dpm_mclk"), "".join(f"{level}: {mhz}Mhz {'*' if level == current else ''}\n" for level, mhz in enumerate((96, 456, 1249))))
+            write(os.path.join(device, "hwmon", f"hwmon{1 + card}", "power1_average"), f"{self.random.randint(20, 300) * 10 ** 6}\n")
+            for connector in CONNECTORS[:self.connectors]:
+                os.makedirs(os.path.join(drm_root, f"card{card}-{connector}"))
+            os.makedirs(os.path.join(drm_root, f"renderD{128 + card}"))
+        os.makedirs(drm_root, exist_ok=True)
+
+        for pid in self.process_ticks:
+            self.write_process(pid)
+            command = COMMANDS[pid % len(COMMANDS)]
+            write(self.path("proc", str(pid), "cmdline"), f"/usr/bin/{command}\0--option\0{pid}\0")
+
+    """
+    write_stat - Write /proc/stat from the current counters
+    """
+    def write_stat(self):
+        lines = ["cpu  " + " ".join(map(str, self.counters[0]))]
+        lines += [f"cpu{index} " + " ".join(map(str, row)) for index, row in enumerate(self.counters[1:])]
+        # The real file continues with a very long interrupt line and a few counters
+        lines.append("intr 123456 " + " ".join("0" for _ in range(512)))
+        lines += ["ctxt 987654", "btime 1700000000", "processes 4321", "procs_running 2", "procs_blocked 0"]
+        write(self.path("proc", "stat"), "\n".join(lines) + "\n")
+
+    """
+    write_process - Write /proc/<pid>/stat from the process's counters
+    @pid: Process ID
+    """
+    def write_process(self, pid):
+        command = COMMANDS[pid % len(COMMANDS)]
+        ticks = self.process_ticks[pid]
+        # state ppid pgrp session tty tpgid flags minflt cminflt majflt cmajflt utime stime
+        # cutime cstime priority nice threads itrealvalue starttime vsize rss, then more we don't read
+        fields = f"S 1 {pid} {pid} 0 -1 4194560 1200 0 3 0 {ticks} {ticks // 4} 0 0 20 0 1 0 {pid * 10} 123456789 {pid % 5000 + 100}"
+        write(self.path("proc", str(pid), "stat"), f"{pid} ({command}) {fields} 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0\n")
+
+    """
+    write_io - Write /proc/diskstats and /proc/net/dev from the current counters
+    """
+    def write_io(self):
+        lines = [f"{259:>4} {index:>7} {name} " + " ".join(map(str, counters)) + " 0 0 0 0 0 0"
+                 for index, (name, counters) in enumerate(self.disk_counters.items())]
+        write(self.path("proc", "diskstats"), "\n".join(lines) + "\n")
+        lines = ["Inter-|   Receive                                                |  Transmit",
+                 " face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed"]
+        lines += [f"{name:>6}: " + " ".join(map(str, counters)) for name, counters in self.net_counters.items()]
+        write(self.path("proc", "net", "dev"), "\n".join(lines) + "\n")
+
+    """
+    write_uptime - Write /proc/uptime
+    """
+    def write_uptime(self):
+        write(self.path("proc", "uptime"), f"{self.uptime:.2f} {self.uptime * self.cpus:.2f}\n")
+
+    """
+    advance - Move the tree forward in time
+    @seconds: How much time passes
+
+    CPU counters grow by a random busy/idle split and uptime increases, so collectors that
+    compare against their previous sample see realistic deltas.
+    """
+    def advance(self, seconds=1.0):
+        ticks = int(100 * seconds)
+        total = [0] * 10
+        for row in self.counters[1:]:
+            busy = self.random.randint(0, ticks)
+            row[0] += busy
+            row[3] += ticks - busy
+        for row in self.counters[1:]:
+            total = [a + b for a, b in zip(total, row)]
+        self.counters[0] = total
+        self.uptime += seconds
+        self.write_stat()
+        self.write_uptime()
+        # reads, sectors read, writes, sectors written and ms doing I/O all move forward
+        for counters in self.disk_counters.values():
+            for field in (0, 2, 4, 6, 9):
+                counters[field] += self.random.randint(0, 1000)
+        for counters in self.net_counters.values():
+            counters[0] += self.random.randint(0, 10 ** 7)
+            counters[8] += self.random.randint(0, 10 ** 7)
+        self.write_io()
+        # Rewriting every process would dominate the benchmarks, so only a few are busy
+        for pid in self.random.sample(sorted(self.process_ticks), min(BUSY_PROCESSES, len(self.process_ticks))):
+            self.process_ticks[pid] += self.random.randint(0, ticks)
+            self.write_process(pid)
+
+    """
+    apply - Point merrin's configuration at this tree
+    """
+    def apply(self):
+        merrin.config.PROC_ROOT = self.path("proc")
+        merrin.config.PROC_DISKSTATS_PATH = self.path("proc", "diskstats")
+        merrin.config.PROC_NET_DEV_PATH = self.path("proc", "net", "dev")
+        merrin.config.SYS_BLOCK_ROOT = self.path("sys", "block")
+        merrin.config.SYS_NET_ROOT = self.path("sys", "class", "net")
+        merrin.config.PROC_PRESSURE_ROOT = self.path("proc", "pressure")
+        merrin.config.CGROUP_ROOT = self.path("sys", "fs", "cgroup")
+        merrin.config.PROC_STAT_PATH = self.path("proc", "stat")
+        merrin.config.PROC_MEMINFO_PATH = self.path("proc", "meminfo")
+        merrin.config.PROC_UPTIME_PATH = self.path("proc", "uptime")
+        merrin.config.HWMON_ROOT = self.path("sys", "class", "hwmon")
+        merrin.config.DRM_ROOT = self.path("sys", "class", "drm")
+
+    """
+    remove - Delete the tree
+    """
+    def remove(self):
+        shutil.rmtree(self.root, ignore_errors=True)
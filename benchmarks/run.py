@@ -0,0 +1,295 @@
+"""
+run.py
+
+Per-collector benchmarks against a generated /proc and /sys tree.
+
+USAGE:
+python -m benchmarks.run [OPTIONS]
+
+--cpus N            cpuN lines in /proc/stat (default 512)
+--hwmon N           hwmon chips (default 200)
+--cards N           DRM cards with VRAM files (default 16)
+--connectors N      Display connectors per card (default 4)
+--processes N       /proc/<pid> directories (default 2000)
+--cgroups N         Service cgroups under /sys/fs/cgroup (default 500)
+--iterations N      Measured calls per collector (default 200)
+--save FILE         Write the results as JSON, to compare against later
+--compare FILE      Compare against saved results, exit with status 1 on a regression
+--threshold X       Allowed relative slowdown or allocation growth (default 0.25)
+
+MEASUREMENTS:
+latency      Median, p99 and max wall time per call, from perf_counter_ns
+syscalls     File opens and directory listings (counted with an audit hook) plus read
+             syscalls (the syscr counter in /proc/self/io), per call
+allocations  Peak bytes allocated by Python during a call, from tracemalloc
+
+Syscall counts don't depend on the machine, so any increase counts as a regression. Latency
+and allocations may grow by up to the threshold before they do.
+"""
+
+import getopt
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import merrin.config
+import merrin.reader
+from benchmarks.fixtures import FakeTree
+from merrin.cgroups import CgroupTree
+from merrin.codec import Snapshot, SnapshotCodec, schema_of
+from merrin.gpu import GpuTopology
+from merrin.metrics import CpuSampler, DiskSampler, NetSampler, SensorRegistry, get_meminfo, get_pressure, get_uptime
+from merrin.processes import ProcessTable
+from merrin.scheduler import build_scheduler
+from merrin.temps import TempMatrix
+
+# Audit events that correspond to one syscall each
+COUNTED_EVENTS = {"open": "open", "os.listdir": "listdir", "os.scandir": "listdir"}
+
+"""
+SyscallCounter - Counts the file syscalls made while enabled
+"""
+class SyscallCounter:
+    def __init__(self):
+        self.enabled = False
+        self.counts = {"open": 0, "listdir": 0}
+        # /proc/self/io is read through a kept-open descriptor so measuring costs one read
+        self.io_fd = os.open("/proc/self/io", os.O_RDONLY)
+        sys.addaudithook(self.audit)
+
+    """
+    audit - Audit hook, called by the interpreter for every audited operation
+    """
+    def audit(self, event, args):
+        if self.enabled and event in COUNTED_EVENTS:
+            self.counts[COUNTED_EVENTS[event]] += 1
+
+    """
+    reads - Read syscalls made by this process so far
+    """
+    def reads(self):
+        for line in os.pread(self.io_fd, 512, 0).split(b"\n"):
+            if line.startswith(b"syscr:"):
+                return int(line.split()[1])
+        return 0
+
+    """
+    measure - Count the syscalls made by a number of calls
+    @function: Function to call
+    @iterations: How many times to call it
+    @between: Called between iterations without being counted
+
+    Return: dict: Average {'open', 'listdir', 'read'} per call
+    """
+    def measure(self, function, iterations, between):
+        # Reading /proc/self/io is itself a read, measure that overhead first
+        overhead = -self.reads() + self.reads()
+        totals = {"open": 0, "listdir": 0, "read": 0}
+        for _ in range(iterations):
+            between()
+            self.counts = {"open": 0, "listdir": 0}
+            self.enabled = True
+            before = self.reads()
+            function()
+            after = self.reads()
+            self.enabled = False
+            totals["open"] += self.counts["open"]
+            totals["listdir"] += self.counts["listdir"]
+            totals["read"] += after - before - overhead
+        return {name: round(count / iterations, 2) for name, count in totals.items()}
+
+"""
+benchmarks - The collectors to measure, each set up fresh against the current tree
+
+Return: dict: {name: function to call}
+"""
+def benchmarks():
+    sampler = CpuSampler()
+    sensors = SensorRegistry()
+    processes = ProcessTable()
+    scheduler = build_scheduler(1)
+
+    def frame():
+        # Everything the main loop collects, as if every collector were due at once
+        for _, _, task in scheduler.heap:
+            task.run(scheduler.values)
+
+    def sensor_scan():
+        SensorRegistry().close()
+
+    # What the daemon does with each frame, and what its viewers do with each record
+    frame()
+    snapshot = Snapshot(SnapshotCodec(schema_of(scheduler.values)))
+    record = snapshot.store(scheduler.values).pack()
+
+    return {
+        "cpu": sampler.collect,
+        "cpu_temp": lambda: sensors.read(merrin.config.CPU_SENSOR_NAME, merrin.config.CPU_TEMP_LABEL),
+        "gpu_temp": lambda: sensors.read(merrin.config.GPU_SENSOR_NAME, merrin.config.GPU_TEMP_LABEL),
+        "gpu_usage": GpuTopology().collect,
+        "temps": TempMatrix(sensors).collect,
+        "memory": get_meminfo,
+        "uptime": get_uptime,
+        "processes": processes.collect,
+        "disk": DiskSampler().collect,
+        "net": NetSampler().collect,
+        "pressure": get_pressure,
+        "cgroups": CgroupTree().collect,
+        "sensor_scan": sensor_scan,
+        "snapshot_store": lambda: snapshot.store(scheduler.values),
+        # Into the Snapshot's own dictionary, against a new one every time
+        "snapshot_load": lambda: snapshot.load(record).dict(),
+        "snapshot_decode": lambda: snapshot.codec.unpack_from(record),
+        "frame": frame,
+    }
+
+"""
+measure_latency - Time a number of calls
+@function: Function to call
+@iterations: How many times to call it
+@between: Called between iterations without being timed
+
+Return: dict: Median, p99 and max in microseconds
+"""
+def measure_latency(function, iterations, between):
+    samples = []
+    for _ in range(iterations):
+        between()
+        start = time.perf_counter_ns()
+        function()
+        samples.append(time.perf_counter_ns() - start)
+    samples.sort()
+    return {
+        "p50_us": round(samples[len(samples) // 2] / 1000, 1),
+        "p99_us": round(samples[min(len(samples) - 1, len(samples) * 99 // 100)] / 1000, 1),
+        "max_us": round(samples[-1] / 1000, 1),
+    }
+
+"""
+measure_allocations - Peak Python memory allocated by a call
+@function: Function to call
+@iterations: How many times to call it
+@between: Called between iterations without being traced
+
+Return: int: Largest peak over the calls, in bytes
+"""
+def measure_allocations(function, iterations, between):
+    peak = 0
+    tracemalloc.start()
+    try:
+        for _ in range(iterations):
+            between()
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            function()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+    return peak
+
+"""
+run - Generate a tree and measure every collector against it
+@options: Parsed command line options
+
+Return: dict: {name: {measurement: value}}
+"""
+def run(options):
+    tree = FakeTree(cpus=options["cpus"], hwmon_chips=options["hwmon"], cards=options["cards"], connectors=options["connectors"], processes=options["processes"], cgroups=options["cgroups"])
+    tree.apply()
+    counter = SyscallCounter()
+    iterations = options["iterations"]
+    results = {}
+    try:
+        for name, function in benchmarks().items():
+            # Warm up: fill the reader pool and give the CPU sampler a baseline
+            for _ in range(3):
+                tree.advance()
+                function()
+            result = measure_latency(function, iterations, tree.advance)
+            result.update(counter.measure(function, max(1, iterations // 4), tree.advance))
+            result["alloc_bytes"] = measure_allocations(function, max(1, iterations // 10), tree.advance)
+            results[name] = result
+    finally:
+        for pseudo_file in merrin.reader.FILES.values():
+            pseudo_file.close()
+        merrin.reader.FILES.clear()
+        tree.remove()
+    return results
+
+"""
+print_table - Show results as an aligned table
+"""
+def print_table(results):
+    columns = ("p50_us", "p99_us", "max_us", "open", "listdir", "read", "alloc_bytes")
+    print(f"{'collector':<12}" + "".join(f"{column:>12}" for column in columns))
+    for name, result in results.items():
+        print(f"{name:<12}" + "".join(f"{result[column]:>12}" for column in columns))
+
+"""
+compare - Find regressions against saved results
+@results: Results of this run
+@baseline: Results loaded from --compare
+@threshold: Allowed relative growth for latency and allocations
+
+Return: list: Descriptions of each regression
+"""
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["p50_us"] > base["p50_us"] * (1 + threshold):
+            regressions.append(f"{name}: median latency {base['p50_us']} -> {result['p50_us']} us")
+        for syscall in ("open", "listdir", "read"):
+            if result[syscall] > base[syscall]:
+                regressions.append(f"{name}: {syscall} syscalls per call {base[syscall]} -> {result[syscall]}")
+        # Small absolute changes are noise from the interpreter, not the collector
+        if result["alloc_bytes"] > base["alloc_bytes"] * (1 + threshold) + 256:
+            regressions.append(f"{name}: peak allocation {base['alloc_bytes']} -> {result['alloc_bytes']} bytes")
+    return regressions
+
+"""
+main - Parse options, run the benchmarks and report
+"""
+def main():
+    options = {"cpus": 512, "hwmon": 200, "cards": 16, "connectors": 4, "processes": 2000, "cgroups": 500, "iterations": 200, "save": None, "compare": None, "threshold": 0.25}
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], "h", ["cpus=", "hwmon=", "cards=", "connectors=", "processes=", "cgroups=", "iterations=", "save=", "compare=", "threshold="])
+        for opt, arg in opts:
+            if opt == "-h":
+                print(__doc__)
+                sys.exit(0)
+            name = opt[2:]
+            if name in ("save", "compare"):
+                options[name] = arg
+            elif name == "threshold":
+                options[name] = float(arg)
+            else:
+                options[name] = int(arg)
+    except (getopt.GetoptError, ValueError) as err:
+        print(err)
+        sys.exit(2)
+
+    results = run(options)
+    print(f"{options['cpus']} CPUs, {options['hwmon']} hwmon chips, {options['cards']} cards with {options['connectors']} connectors each, {options['processes']} processes, {options['cgroups']} cgroups")
+    print_table(results)
+
+    if options["save"]:
+        with open(options["save"], "w") as f:
+            json.dump(results, f, indent=2)
+
+    if options["compare"]:
+        with open(options["compare"]) as f:
+            regressions = compare(results, json.load(f), options["threshold"])
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
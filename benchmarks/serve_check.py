@@ -0,0 +1,176 @@
+"""
+serve_check.py
+
+End-to-end check of the OpenMetrics exporter (merrin --serve).
+
+USAGE:
+python -m benchmarks.serve_check [OPTIONS]
+
+--scrapers N        Scrapers hitting the server at the same time (default 16)
+--requests N        Scrapes each of them makes over its own connection (default 50)
+
+CHECKS:
+run_server is started in this process on an ephemeral port of 127.0.0.1, collecting from this
+machine. Its source is held back until the first check is done, so the server is seen both
+before and after the first snapshot:
+unavailable  GET /metrics before anything was collected answers 503
+metrics      GET /metrics answers 200 with the OpenMetrics content type, an ETag and a
+             payload ending in # EOF
+head         HEAD /metrics answers 200 with the headers only
+etag         GET /metrics with a matching If-None-Match answers 304 without a body
+not_found    Any other path answers 404
+concurrent   Every scraper gets 200 and the same payload on every request
+
+Each check prints ok or FAIL, and the exit status is 1 if any failed.
+"""
+
+import contextlib
+import getopt
+import http.client
+import io
+import sys
+import threading
+import time
+
+from merrin.scheduler import build_scheduler
+from merrin.serve import CONTENT_TYPE, run_server
+
+# Long enough that nothing is collected again while the checks run, so the ETag stays put
+UPDATE_INTERVAL = 60
+
+# How long to wait for the server to start and for the first snapshot, in seconds
+STARTUP_TIMEOUT = 10
+
+"""
+HeldSource - A Scheduler that collects nothing until released
+"""
+class HeldSource:
+    def __init__(self):
+        self.scheduler = build_scheduler(UPDATE_INTERVAL, tables=False)
+        self.values = self.scheduler.values
+        self.released = threading.Event()
+
+    def run_due(self):
+        return self.released.is_set() and self.scheduler.run_due()
+
+    def time_until_due(self):
+        return min(0.05, self.scheduler.time_until_due())
+
+"""
+start_server - Run run_server in a background thread on an ephemeral port
+@source: Where the server's snapshots come from
+
+Return: int: The port the server listens on
+"""
+def start_server(source):
+    output = io.StringIO()
+    # run_server announces its address on stdout, which is where we learn the port
+    with contextlib.redirect_stdout(output):
+        threading.Thread(target=run_server, args=(("127.0.0.1", 0), source), daemon=True).start()
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while "/metrics" not in output.getvalue():
+            if time.monotonic() > deadline:
+                raise RuntimeError("the server didn't start")
+            time.sleep(0.01)
+    return int(output.getvalue().rsplit(":", 1)[1].split("/")[0])
+
+"""
+request - Make one request and read the whole response
+@connection: http.client.HTTPConnection, kept open between requests
+@method: "GET" or "HEAD"
+@path: Request path
+@headers: Extra request headers
+
+Return: tuple: (status, headers, body)
+"""
+def request(connection, method="GET", path="/metrics", headers=None):
+    connection.request(method, path, headers=headers or {})
+    response = connection.getresponse()
+    return response.status, response.headers, response.read()
+
+"""
+scrape - One scraper's share of the concurrent check
+@port: Port of the server
+@requests: How many scrapes to make
+@results: List the (status, body) of every scrape is appended to
+"""
+def scrape(port, requests, results):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=STARTUP_TIMEOUT)
+    try:
+        for _ in range(requests):
+            status, _, body = request(connection)
+            results.append((status, body))
+    finally:
+        connection.close()
+
+"""
+run - Start the server and make every check
+
+Return: list: [(check, passed, detail)]
+"""
+def run(scrapers, requests):
+    source = HeldSource()
+    port = start_server(source)
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=STARTUP_TIMEOUT)
+    checks = []
+
+    status, _, _ = request(connection)
+    checks.append(("unavailable", status == 503, f"status {status}"))
+
+    source.released.set()
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while status == 503 and time.monotonic() < deadline:
+        time.sleep(0.05)
+        status, headers, payload = request(connection)
+    etag = headers.get("ETag")
+    content_type = headers.get("Content-Type")
+    checks.append(("metrics", status == 200 and content_type == CONTENT_TYPE and etag is not None and payload.endswith(b"# EOF\n"),
+                   f"status {status}, {content_type}, ETag {etag}, {len(payload)} bytes"))
+
+    status, headers, body = request(connection, "HEAD")
+    checks.append(("head", status == 200 and not body and headers.get("Content-Length") == str(len(payload)),
+                   f"status {status}, {len(body)} bytes of body"))
+
+    status, headers, body = request(connection, headers={"If-None-Match": etag})
+    checks.append(("etag", status == 304 and not body and headers.get("ETag") == etag, f"status {status}, {len(body)} bytes of body"))
+
+    status, _, _ = request(connection, path="/other")
+    checks.append(("not_found", status == 404, f"status {status}"))
+    connection.close()
+
+    results = []
+    threads = [threading.Thread(target=scrape, args=(port, requests, results)) for _ in range(scrapers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    good = sum(1 for status, body in results if status == 200 and body == payload)
+    checks.append(("concurrent", good == scrapers * requests,
+                   f"{good} of {scrapers * requests} scrapes matched, {len(results) / elapsed:.0f} a second"))
+    return checks
+
+def main():
+    options = {"scrapers": 16, "requests": 50}
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "h", ["scrapers=", "requests="])
+        for opt, arg in opts:
+            if opt == "-h":
+                print(__doc__)
+                sys.exit(0)
+            options[opt[2:]] = int(arg)
+        if args:
+            raise ValueError(f"unexpected argument {args[0]}")
+    except (getopt.GetoptError, ValueError) as err:
+        print(err)
+        sys.exit(2)
+
+    checks = run(options["scrapers"], options["requests"])
+    for name, passed, detail in checks:
+        print(f"{name:<12} {'ok' if passed else 'FAIL':<5} {detail}")
+    if not all(passed for _, passed, _ in checks):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+startup.py
+
+Cold-start benchmarks for merrin --once.
+
+USAGE:
+python -m benchmarks.startup [OPTIONS]
+
+--runs N            Fresh interpreters started per measurement (default 20)
+--save FILE         Write the results as JSON, to compare against later
+--compare FILE      Compare against saved results, exit with status 1 on a regression
+--threshold X       Allowed relative slowdown (default 0.25)
+
+MEASUREMENTS:
+Every measurement starts a new interpreter, since a warm one has everything imported already.
+interpreter  python -c pass, what any Python program costs before importing anything
+import       Importing merrin.__main__ and merrin.once, timed inside the interpreter
+scheduler    Building the --once scheduler after that: probing backends, finding plugins
+             and whatever they import, timed inside the interpreter
+once         Wall time of python -m merrin --once -u 0, which doesn't wait for CPU usage
+window       Wall time of python -m merrin --once with the default CPU window
+modules      Modules merrin --once imports on top of the interpreter's own, including
+             those only imported while building the scheduler
+
+Times are the median over the runs, in milliseconds. The module count doesn't depend on the
+machine, so any increase counts as a regression, like syscall counts in run.py.
+"""
+
+import getopt
+import json
+import subprocess
+import sys
+import time
+
+# Imports what --once imports and builds its scheduler, then reports how long each took and
+# how many modules were loaded
+IMPORT_SCRIPT = """
+import sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+import merrin.__main__, merrin.once
+imported = time.perf_counter()
+merrin.once.build_scheduler(0, tables=False)
+print(imported - start, time.perf_counter() - imported, len(set(sys.modules) - before))
+"""
+
+"""
+wall_time - Median wall time of running a command in a fresh process
+@command: Arguments for subprocess
+@runs: How many times to run it
+
+Return: float: Median in milliseconds
+"""
+def wall_time(command, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return round(samples[len(samples) // 2] * 1000, 1)
+
+"""
+import_cost - Median import and scheduler build times and module count of the --once path
+@runs: How many interpreters to start
+
+Return: tuple: (median import milliseconds, median scheduler milliseconds, modules imported)
+"""
+def import_cost(runs):
+    imports = []
+    builds = []
+    modules = 0
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], capture_output=True, check=True, text=True).stdout.split()
+        imports.append(float(output[0]))
+        builds.append(float(output[1]))
+        modules = int(output[2])
+    imports.sort()
+    builds.sort()
+    return round(imports[len(imports) // 2] * 1000, 1), round(builds[len(builds) // 2] * 1000, 1), modules
+
+"""
+run - Take every measurement
+
+Return: dict: {measurement: value}
+"""
+def run(runs):
+    import_ms, scheduler_ms, modules = import_cost(runs)
+    return {
+        "interpreter": wall_time([sys.executable, "-c", "pass"], runs),
+        "import": import_ms,
+        "scheduler": scheduler_ms,
+        "once": wall_time([sys.executable, "-m", "merrin", "--once", "-u", "0"], runs),
+        "window": wall_time([sys.executable, "-m", "merrin", "--once"], runs),
+        "modules": modules,
+    }
+
+"""
+compare - Find regressions against saved results
+@results: Results of this run
+@baseline: Results loaded from --compare
+@threshold: Allowed relative growth for times
+
+Return: list: Descriptions of each regression
+"""
+def compare(results, baseline, threshold):
+    regressions = []
+    for name in ("import", "scheduler", "once", "window"):
+        # Results saved before a measurement was added have nothing to compare it with
+        if name not in baseline:
+            continue
+        # Measured against the interpreter's own start, so a slower machine isn't a regression
+        scale = results["interpreter"] / baseline["interpreter"]
+        if results[name] > baseline[name] * scale * (1 + threshold):
+            regressions.append(f"{name}: {baseline[name]} -> {results[name]} ms")
+    if results["modules"] > baseline["modules"]:
+        regressions.append(f"modules: {baseline['modules']} -> {results['modules']} imported")
+    return regressions
+
+"""
+main - Parse options, run the benchmarks and report
+"""
+def main():
+    options = {"runs": 20, "save": None, "compare": None, "threshold": 0.25}
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], "h", ["runs=", "save=", "compare=", "threshold="])
+        for opt, arg in opts:
+            if opt == "-h":
+                print(__doc__)
+                sys.exit(0)
+            name = opt[2:]
+            if name in ("save", "compare"):
+                options[name] = arg
+            elif name == "threshold":
+                options[name] = float(arg)
+            else:
+                options[name] = int(arg)
+    except (getopt.GetoptError, ValueError) as err:
+        print(err)
+        sys.exit(2)
+
+    results = run(options["runs"])
+    print(f"Median of {options['runs']} runs")
+    for name, value in results.items():
+        unit = "" if name == "modules" else " ms"
+        print(f"{name:<12}{value:>10}{unit}")
+
+    if options["save"]:
+        with open(options["save"], "w") as f:
+            json.dump(results, f, indent=2)
+
+    if options["compare"]:
+        with open(options["compare"]) as f:
+            regressions = compare(results, json.load(f), options["threshold"])
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
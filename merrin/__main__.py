@@ -14,19 +14,17 @@ This library lets us create terminal-based UI that can be updated in-place witho
 scrolling, allowing us a dashboard-like experience similar to htop or top.
 """
 
-import datetime
 import getopt
-import os
 import signal
 import sys
-import time
-import curses
-from curses import wrapper
 from sys import platform
 
 from merrin import config
-from merrin.display import print_metrics
-from merrin.metrics import get_uptime, get_cpu_usage, get_gpu_usage, get_meminfo, get_temp
+
+# DEFERRED IMPORTS
+# Each mode imports what it needs in the branch that runs it, rather than at the top here.
+# Loading curses, the daemon's shared memory support and the recording codec takes longer
+# than a whole --once run, and most of it would go unused by any one mode.
 
 """
 signal_handler - Interrupt signal (Ctrl+C) handler for graceful shutdown
@@ -36,71 +34,231 @@ signal_handler - Interrupt signal (Ctrl+C) handler for graceful shutdown
 def signal_handler(sig, frame):
     sys.exit(0)
 
+# Printed for -h and when the arguments can't be parsed
+USAGE = """-h\t\tDisplay this message
+-u\t\tSpecify update interval in seconds (fractions allowed)
+--adaptive\tSample faster near the warning thresholds and slower while the machine is idle
+--daemon\tCollect in the background and share snapshots with other merrin instances
+--record FILE\tAlso save every snapshot to a recording file
+--alert KIND:TARGET\tSend alerts from the dashboard or --daemon to log:FILE, exec:COMMAND or
+\t\tunix:SOCKET, can be given more than once
+--replay FILE\tPlay a recording back (space pauses, arrow keys seek)
+--speed N\tPlayback speed multiplier for --replay
+--start TIME\tStart --replay at a local time, e.g. '2025-06-01 14:30'
+--format FMT\tWrite snapshots to stdout as ndjson or csv instead of displaying them
+--interval X\tSeconds between snapshots, the same as -u
+--sort KEY\tSort the process table by cpu or rss
+--burst RATE:DURATION\tSample CPU usage and temperatures RATE times a second for DURATION seconds
+\t\tand print their percentiles
+--profile N\tRun N frames without a display and print how long each collector took
+--serve ADDR:PORT\tServe the latest snapshot to Prometheus-compatible scrapers at /metrics
+--agent ADDR:PORT\tSend snapshots to a merrin --aggregate instead of displaying them
+--aggregate ADDR:PORT\tListen for agents and show every host in one grid
+--once\t\tPrint a single snapshot and exit, -u sets how long CPU usage is measured over
+\t\t(0 skips the wait and shows the load average instead)"""
+
+"""
+parse_address - Split an ADDR:PORT argument
+@text: e.g. "127.0.0.1:9100", ":9100" for every interface, or "[::1]:9100"
+@option: The option it was given for, for the error message
+
+Return: tuple: (host, port). Raises ValueError if it isn't ADDR:PORT.
+"""
+def parse_address(text, option):
+    host, colon, port = text.rpartition(":")
+    if not colon or not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(f"{option} needs ADDR:PORT, e.g. 127.0.0.1:9100")
+    # IPv6 addresses are written in brackets so their colons aren't mistaken for the port's
+    if host.startswith("[") and host.endswith("]"):
+        host = host[1:-1]
+    return host, int(port)
+
+"""
+open_alerts - Set up the alert rules and the sinks given with --alert
+@targets: KIND:TARGET arguments
+
+Exits with an error message if a sink can't be opened or a rule in config.py is malformed.
+
+Return: AlertEngine: The engine, see alerts.py
+"""
+def open_alerts(targets):
+    from merrin.alerts import AlertEngine, open_sink
+    sinks = []
+    try:
+        for target in targets:
+            sinks.append(open_sink(target))
+        return AlertEngine(config.ALERT_RULES, sinks)
+    except (OSError, ValueError) as err:
+        for sink in sinks:
+            sink.close()
+        print(f"Can't set up alerts: {err}")
+        sys.exit(1)
+
 """
 handle_args - Parse command line arguments to configure program behavior
 
 We use the getopt module for UNIX-style argument parsing similar to how getopt() works
-in C. Putting a colon after a flag tells getopt that it requires an argument.
+in C. Putting a colon after a flag tells getopt that it requires an argument, and long
+options are listed separately (an equals sign after one means it takes an argument).
 
-Return: Update interval in seconds, or None if help was displayed
+Return: dict: Options for the run
 """
 def handle_args():
-    update_interval = config.DEFAULT_UPDATE_INTERVAL
+    options = {
+        # None until -u is given, the default depends on the mode
+        'update_interval': None,
+        'daemon': False,
+        'record': None,
+        'replay': None,
+        'speed': 1.0,
+        'start': None,
+        'profile': None,
+        'sort': config.PROCESS_SORT,
+        'burst': None,
+        'format': None,
+        'once': False,
+        'serve': None,
+        'agent': None,
+        'aggregate': None,
+        'adaptive': False,
+        'alert': [],
+    }
     argv = sys.argv[1:] # Skip the program name
     try:
-        opts, args = getopt.getopt(argv, "hu:")
-    except:
-        print("Error")
-    # Process each option that was found
-    for opt, arg in opts:
-        if opt == '-h':
-            print(f"-h\tDisplay this message\n-u\tSpecify update interval in seconds")            
-            sys.exit(0)
-        elif opt == '-u':
-            update_interval = int(arg)
-    return update_interval
+        opts, args = getopt.getopt(argv, "hu:", ["daemon", "record=", "replay=", "speed=", "start=", "profile=", "sort=", "burst=", "format=", "interval=", "once", "serve=", "agent=", "aggregate=", "adaptive", "alert="])
+        # Process each option that was found
+        for opt, arg in opts:
+            if opt == '-h':
+                print(USAGE)
+                sys.exit(0)
+            elif opt in ('-u', '--interval'):
+                # Fractions of a second are allowed for high resolution history
+                options['update_interval'] = float(arg)
+                if options['update_interval'] < 0:
+                    raise ValueError("update interval can't be negative")
+            elif opt == '--format':
+                # The same names as export.WRITERS, spelled out so parsing doesn't import export.py
+                if arg not in ("ndjson", "csv"):
+                    raise ValueError("format must be one of ndjson, csv")
+                options['format'] = arg
+            elif opt == '--daemon':
+                options['daemon'] = True
+            elif opt == '--once':
+                options['once'] = True
+            elif opt == '--adaptive':
+                options['adaptive'] = True
+            elif opt in ('--serve', '--agent', '--aggregate'):
+                options[opt[2:]] = parse_address(arg, opt)
+            elif opt == '--alert':
+                # Opened in main(), once the arguments are known to be valid
+                options['alert'].append(arg)
+            elif opt == '--record':
+                options['record'] = arg
+            elif opt == '--replay':
+                options['replay'] = arg
+            elif opt == '--speed':
+                options['speed'] = float(arg)
+                if options['speed'] <= 0:
+                    raise ValueError("speed must be positive")
+            elif opt == '--start':
+                from merrin.recording import parse_start
+                options['start'] = parse_start(arg)
+            elif opt == '--sort':
+                if arg not in ("cpu", "rss"):
+                    raise ValueError("process table can be sorted by cpu or rss")
+                options['sort'] = arg
+            elif opt == '--burst':
+                # One argument, so getopt carries on with the options after it
+                rate, separator, duration = arg.partition(":")
+                if not separator:
+                    raise ValueError("--burst takes RATE:DURATION, e.g. 200:10")
+                rate = float(rate)
+                if not 0 < rate <= config.BURST_MAX_RATE:
+                    raise ValueError(f"burst rate must be between 0 and {config.BURST_MAX_RATE} Hz")
+                duration = float(duration)
+                if not 0 < duration <= config.BURST_MAX_DURATION:
+                    raise ValueError(f"burst duration must be between 0 and {config.BURST_MAX_DURATION} seconds")
+                options['burst'] = (rate, duration)
+            elif opt == '--profile':
+                options['profile'] = int(arg)
+                if options['profile'] <= 0:
+                    raise ValueError("number of frames to profile must be positive")
+        # getopt stops at the first argument that isn't an option, anything after it was ignored
+        if args:
+            raise ValueError(f"unexpected argument {args[0]}")
+        if options['update_interval'] is None:
+            # A single snapshot only waits long enough to measure CPU usage
+            options['update_interval'] = config.ONCE_CPU_WINDOW if options['once'] else config.DEFAULT_UPDATE_INTERVAL
+        elif options['update_interval'] == 0 and not options['once']:
+            raise ValueError("update interval must be positive")
+    except (getopt.GetoptError, ValueError) as err:
+        print(f"{err}\n{USAGE}")
+        sys.exit(1)
+    return options
 
 """
 main_curses - Main application loop running inside the curses environment
 @stdscr: The curses standard screen object
-@update_interval: How many seconds to wait between metric updates
+@scheduler: Where snapshots come from: a Scheduler, a daemon's SharedSource or a ReplaySource
+@recorder: Recorder to save every snapshot to, or None
+@history: History that keeps the recent values for sparklines
+@adaptive: AdaptiveRate adjusting the scheduler's update interval, or None for a fixed one
+@alerts: AlertEngine evaluating the alert rules over every snapshot, or None
 """
-def main_curses(stdscr, update_interval):
+def main_curses(stdscr, scheduler, recorder, history, adaptive=None, alerts=None):
+    import curses
+    from merrin.display import handle_resize, print_metrics
+    from merrin.profiler import Profiler
+
     # Initialize color support
     curses.start_color() 
     # Use terminal's default colors
     curses.use_default_colors()
     stdscr.clear()
-    # Make getch() non-blocking so we don't wait for input
-    stdscr.nodelay(True)
+    # Created the first time 'p' is pressed, see profiler.py
+    profiler = None
     while (True):
-        # Gather all metrics into a single dictionary
-        # This gives us a snapshot of the system state at this moment
-        data = {
-            'cpu_usage': get_cpu_usage(),
-            'cpu_temp': get_temp(config.CPU_SENSOR_NAME, config.CPU_TEMP_LABEL),
-            'gpu_usage': get_gpu_usage(),
-            'gpu_temp': get_temp(config.GPU_SENSOR_NAME, config.GPU_TEMP_LABEL),
-            'memory': get_meminfo(),
-            'uptime': get_uptime(),
-            'user': os.environ.get('USER'),
-            'hostname': os.uname()[1],
-            'current_datetime': datetime.datetime.now()
-        }
-
-        # Render the metrics to the screen
-        print_metrics(stdscr, data)
-
-        # Check if user pressed 'q' to quit (non-blocking)
+        if profiler is not None and scheduler.profiler is profiler:
+            profiler.begin_frame()
+        # Run whichever collectors are due
+        # The cached values give us a snapshot of the system state at this moment
+        ran = scheduler.run_due()
+        if ran:
+            # Picks the interval for the next snapshot, see adaptive.py
+            repeat = 1 if adaptive is None else adaptive.update(scheduler)
+            history.record(scheduler.values, repeat)
+            # Before rendering, so firing alerts are shown with the snapshot that fired them
+            if alerts is not None:
+                alerts.evaluate(scheduler.values)
+            # Render the metrics, only values that changed are repainted
+            if profiler is not None and scheduler.profiler is profiler:
+                profiler.time("render", print_metrics, stdscr, scheduler.values, history, profiler)
+            else:
+                print_metrics(stdscr, scheduler.values, history)
+            if recorder is not None:
+                recorder.write(scheduler.values)
+        if profiler is not None:
+            profiler.end_frame(ran)
+
+        # Wait for a key press until the next collector is due, so 'q' is handled
+        # immediately instead of after the rest of the interval
+        stdscr.timeout(int(scheduler.time_until_due() * 1000))
         key = stdscr.getch()
         if key == ord('q'):
             break
-
-        # Wait before next update
-        time.sleep(update_interval)
-        
-        # Clear screen for next frame
-        stdscr.erase()
+        elif key == ord('p'):
+            # Toggle the profile panel, keeping what was measured so far
+            if profiler is None:
+                profiler = Profiler()
+            scheduler.profiler = None if scheduler.profiler is profiler else profiler
+            print_metrics(stdscr, scheduler.values, history, scheduler.profiler)
+        elif key == curses.KEY_RESIZE:
+            # Lay the display out again for the new size without waiting for a collector
+            handle_resize(stdscr)
+            print_metrics(stdscr, scheduler.values, history, scheduler.profiler)
+        elif key != -1 and hasattr(scheduler, 'handle_key'):
+            # Sources with their own controls (replay seeking)
+            scheduler.handle_key(key)
 
 """
 main - Program entry point that sets up signal handling and starts curses interface
@@ -120,12 +278,100 @@ def main():
         sys.exit(1)
 
     # Parse command-line arguments
-    update_interval = handle_args()
-    if update_interval is None:
+    options = handle_args()
+
+    # Nothing else to set up for a single snapshot, so it is handled before anything else
+    if options['once']:
+        from merrin.once import run_once
+        run_once(options['update_interval'], options['format'])
         sys.exit(0)
-    
-    # Start the curses interface (wrapper handles cleanup automatically)
-    wrapper(main_curses, update_interval)
+
+    # Read by the process table when it is created
+    config.PROCESS_SORT = options['sort']
+
+    recorder = None
+    if options['record']:
+        from merrin.recording import Recorder
+        try:
+            recorder = Recorder(options['record'])
+        except (OSError, ValueError) as err:
+            print(f"Can't record to {options['record']}: {err}")
+            sys.exit(1)
+    alerts = None
+    try:
+        # Headless mode, no terminal interface at all
+        if options['aggregate']:
+            from merrin.aggregator import run_aggregator
+            run_aggregator(options['aggregate'])
+            sys.exit(0)
+        if options['daemon']:
+            from merrin.daemon import run_daemon
+            # Without sinks there is no one to tell about alerts in the background
+            if options['alert']:
+                alerts = open_alerts(options['alert'])
+            run_daemon(options['update_interval'], recorder, alerts)
+            sys.exit(0)
+        if options['burst']:
+            from merrin.burst import run_burst
+            run_burst(*options['burst'])
+            sys.exit(0)
+        if options['profile']:
+            from merrin.profiler import run_profile
+            from merrin.scheduler import build_scheduler
+            run_profile(options['profile'], build_scheduler(options['update_interval']))
+            sys.exit(0)
+
+        if options['replay']:
+            from merrin.recording import Recording, ReplaySource
+            try:
+                source = ReplaySource(Recording(options['replay']), options['speed'], options['start'])
+            except (OSError, ValueError) as err:
+                print(f"Can't replay {options['replay']}: {err}")
+                sys.exit(1)
+        else:
+            from merrin.daemon import open_source
+            # Collectors run on their own intervals, the display draws from the latest values
+            # If a merrin daemon is running we draw from its snapshots instead of collecting ourselves
+            # The tables aren't exported or sent, so there's no need to collect them for --serve or --agent
+            source = open_source(options['update_interval'], tables=options['serve'] is None and options['agent'] is None)
+
+        adaptive = None
+        # A daemon or a recording sets its own pace, only our own collectors can change rate
+        if options['adaptive'] and hasattr(source, 'set_update_interval'):
+            from merrin.adaptive import AdaptiveRate
+            adaptive = AdaptiveRate(options['update_interval'])
+
+        # Pipeline mode, snapshots go to stdout and curses is never started
+        if options['format']:
+            from merrin.export import run_export
+            run_export(source, options['format'], recorder)
+            sys.exit(0)
+        if options['serve']:
+            from merrin.serve import run_server
+            run_server(options['serve'], source, recorder)
+            sys.exit(0)
+        if options['agent']:
+            from merrin.agent import run_agent
+            run_agent(options['agent'], source, options['update_interval'], recorder, adaptive)
+            sys.exit(0)
+
+        import locale
+        from curses import wrapper
+        from merrin.history import History
+
+        # Use the terminal's locale so curses can draw the heatmap's block characters
+        locale.setlocale(locale.LC_ALL, "")
+
+        # The rules run whether or not there are sinks, firing alerts are shown either way
+        alerts = open_alerts(options['alert'])
+
+        # Start the curses interface (wrapper handles cleanup automatically)
+        wrapper(main_curses, source, recorder, History(options['update_interval']), adaptive, alerts)
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if alerts is not None:
+            alerts.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,151 @@
+"""
+adaptive.py
+
+An update interval that follows how close the machine is to trouble.
+
+OVERVIEW:
+With --adaptive the update interval isn't fixed. The dashboard's warning thresholds (see
+display.py) say which values matter, and after every snapshot each watched metric (CPU
+usage, CPU and GPU temperature, RAM and the VRAM of each GPU) falls in one of three bands:
+
+near    At ADAPTIVE_NEAR_FRACTION of its threshold or above, or above the idle band and rising
+        fast enough to reach the threshold within ADAPTIVE_HORIZON seconds
+idle    Below ADAPTIVE_IDLE_FRACTION of its threshold, and moved by less than
+        ADAPTIVE_STABLE_FRACTION of the threshold since the previous snapshot
+normal  Anything in between
+
+If any metric is near, sampling switches to ADAPTIVE_MIN_INTERVAL straight away, so the run
+up to a threshold is seen in detail. If every metric is idle, the interval doubles with each
+snapshot up to ADAPTIVE_MAX_INTERVAL, so an idle lab machine wakes merrin a few times a
+minute instead of every second. Otherwise it goes back to the update interval. The normal
+band between the other two keeps the rate from flapping around a single value.
+
+Only collectors that follow the update interval change rate. Those with their own interval
+(the process table, uptime) keep it, so sampling faster never means scanning every process
+four times a second.
+
+HISTORY:
+Sparklines keep one sample per update interval (see history.py). While sampling faster, one
+snapshot per interval is kept, and a snapshot after a longer interval is repeated for every
+interval it covers, so the sparklines still span HISTORY_SECONDS at the same scale.
+"""
+
+import time
+
+import merrin.config
+from merrin.display import CPU_TEMP_WARNING, CPU_USAGE_WARNING, GPU_TEMP_WARNING, MEMORY_WARNING, VRAM_WARNING
+
+"""
+watched_metrics - The metrics of a snapshot that drive the rate
+@data: Snapshot dictionary
+
+Return: list: (name, value, threshold) for every available metric
+"""
+def watched_metrics(data):
+    metrics = [
+        ("CPU", data.get('cpu_usage'), CPU_USAGE_WARNING),
+        ("CPU temp", data.get('cpu_temp'), CPU_TEMP_WARNING),
+        ("GPU temp", data.get('gpu_temp'), GPU_TEMP_WARNING),
+    ]
+    memory = data.get('memory')
+    if memory is not None and memory['total']:
+        metrics.append(("RAM", memory['used'] / memory['total'] * 100, MEMORY_WARNING))
+    for card, usage in (data.get('gpu_usage') or {}).items():
+        if usage['total']:
+            metrics.append((f"{card} VRAM", usage['used'] / usage['total'] * 100, VRAM_WARNING))
+    return [metric for metric in metrics if metric[1] is not None]
+
+"""
+AdaptiveRate - Picks the update interval from each snapshot
+@update_interval: The interval given with -u, used while metrics are neither idle nor near
+"""
+class AdaptiveRate:
+    def __init__(self, update_interval):
+        self.base = update_interval
+        # An interval given with -u outside the adaptive range widens it
+        self.fastest = min(merrin.config.ADAPTIVE_MIN_INTERVAL, update_interval)
+        self.slowest = max(merrin.config.ADAPTIVE_MAX_INTERVAL, update_interval)
+        self.interval = update_interval
+        # Why the interval isn't the update interval, for the header
+        self.reason = None
+        # {name: (monotonic time, value)} at the previous snapshot
+        self.previous = {}
+        # The snapshot last looked at, so one that didn't change isn't counted twice
+        self.last_sample = None
+        # History is kept in slots of one update interval from the first snapshot
+        self.start = None
+        self.last_slot = -1
+
+    """
+    choose - Pick the interval for the next snapshot
+    @data: Snapshot dictionary
+    @now: Monotonic time the snapshot was taken
+
+    Return: tuple: (interval in seconds, reason or None at the update interval)
+    """
+    def choose(self, data, now):
+        near = None
+        idle = True
+        for name, value, threshold in watched_metrics(data):
+            previous = self.previous.get(name)
+            self.previous[name] = (now, value)
+            if value >= threshold * merrin.config.ADAPTIVE_NEAR_FRACTION:
+                idle = False
+                near = near or f"{name} near limit"
+                continue
+            change = None if previous is None else value - previous[1]
+            if value > threshold * merrin.config.ADAPTIVE_IDLE_FRACTION:
+                idle = False
+                # Seconds until the threshold at the current rate of change
+                if change is not None and change > 0 and now > previous[0]:
+                    if (threshold - value) / (change / (now - previous[0])) <= merrin.config.ADAPTIVE_HORIZON:
+                        near = near or f"{name} rising"
+            elif change is None or abs(change) > threshold * merrin.config.ADAPTIVE_STABLE_FRACTION:
+                idle = False
+
+        if near is not None:
+            return self.fastest, near
+        if idle:
+            return min(max(self.interval, self.base) * 2, self.slowest), "idle"
+        return self.base, None
+
+    """
+    history_samples - How many history samples a snapshot stands for
+
+    Return: int: 0 if one was already kept for this update interval, otherwise 1 plus the
+    number of intervals skipped since the last one
+    """
+    def history_samples(self, now):
+        if self.start is None:
+            self.start = now
+        slot = round((now - self.start) / self.base)
+        if slot <= self.last_slot:
+            return 0
+        samples = slot - self.last_slot
+        self.last_slot = slot
+        return samples
+
+    """
+    update - Adjust a scheduler's rate after it collected a snapshot
+    @scheduler: Scheduler that just ran, its values are the snapshot
+
+    Also adds a 'sampling' entry to the snapshot with the interval and reason, which the
+    dashboard shows in its header.
+
+    Return: int: How many history samples the snapshot stands for, see history_samples
+    """
+    def update(self, scheduler):
+        data = scheduler.values
+        sample = data.get('current_datetime')
+        # Only a collector with its own interval ran, there is no new snapshot to judge
+        if sample is not None and sample == self.last_sample:
+            return 0
+        self.last_sample = sample
+
+        now = time.monotonic()
+        self.interval, self.reason = self.choose(data, now)
+        if self.interval != scheduler.update_interval:
+            scheduler.set_update_interval(self.interval)
+        data['sampling'] = {"interval": self.interval, "reason": self.reason}
+        return self.history_samples(now)
+
@@ -0,0 +1,132 @@
+"""
+agent.py
+
+Sends snapshots to a central aggregator.
+
+OVERVIEW:
+merrin --agent ADDR:PORT collects snapshots as usual and streams them to an aggregator
+(merrin --aggregate, see aggregator.py) instead of drawing them, so one dashboard can show a
+whole rack of machines. If a daemon is running on the machine, the agent sends its snapshots
+rather than collecting its own. Only the slots that changed since the previous snapshot
+are sent (see protocol.py).
+
+CONNECTION:
+The agent keeps collecting whether or not the aggregator is reachable, so the CPU sampler
+and the I/O counters always have a recent baseline. Snapshots collected while disconnected
+are dropped, and every AGENT_RECONNECT_INTERVAL seconds the agent tries to connect again,
+starting over with a HELLO. Connecting happens on the collection thread, so an attempt gives
+up after AGENT_CONNECT_TIMEOUT rather than holding up the next snapshot while an unreachable
+host times out. A send that blocks for longer than AGENT_RECONNECT_INTERVAL (the aggregator
+stopped reading) counts as a lost connection too, so a stuck aggregator never stalls
+collection for long.
+
+The aggregator judges whether a host went quiet by the interval in its HELLO. With
+--adaptive the interval changes while running, and each change is announced with a new
+HELLO before the next snapshot.
+
+Like the recorder, the agent waits for the first snapshot with per-core CPU usage before
+sending anything, so the layout doesn't change right after the first frame.
+"""
+
+import socket
+import time
+
+import merrin.config
+from merrin.protocol import DeltaEncoder
+
+"""
+AgentConnection - The agent's connection to the aggregator, reconnected when lost
+@address: (host, port) of the aggregator
+@interval: Collection interval, for the first HELLO
+@name: Hostname to report instead of the machine's own, or None
+"""
+class AgentConnection:
+    def __init__(self, address, interval, name=None):
+        self.address = address
+        self.interval = interval
+        self.name = name
+        self.sock = None
+        self.encoder = None
+        # When to next try connecting, monotonic time
+        self.retry_at = 0.0
+        # Bytes sent since the agent started, for benchmarks
+        self.sent = 0
+        # Snapshots dropped while waiting for a complete one
+        self.skipped = 0
+
+    """
+    connect - Try to connect, if it's time to
+
+    Return: bool: True if connected
+    """
+    def connect(self):
+        if self.sock is not None:
+            return True
+        now = time.monotonic()
+        if now < self.retry_at:
+            return False
+        self.retry_at = now + merrin.config.AGENT_RECONNECT_INTERVAL
+        try:
+            self.sock = socket.create_connection(self.address, timeout=merrin.config.AGENT_CONNECT_TIMEOUT)
+        except OSError:
+            return False
+        self.sock.settimeout(merrin.config.AGENT_RECONNECT_INTERVAL)
+        # Frames are small and sent once per snapshot, there is nothing to gain from batching
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # The aggregator has no state for this connection yet, so start with a HELLO
+        self.encoder = DeltaEncoder(self.interval, self.name)
+        return True
+
+    """
+    send - Send a snapshot, dropping it if the aggregator can't be reached
+    @data: Snapshot dictionary
+    @interval: Current collection interval, None if it hasn't changed
+    """
+    def send(self, data, interval=None):
+        # The CPU sampler needs two runs, skip a few snapshots if CPU metrics never show up
+        if data.get("cpu_cores") is None and self.skipped < 2:
+            self.skipped += 1
+            return
+        if interval is not None and interval != self.interval:
+            self.interval = interval
+            if self.encoder is not None:
+                self.encoder.set_interval(interval)
+        if not self.connect():
+            return
+        frames = self.encoder.encode(data)
+        try:
+            self.sock.sendall(frames)
+        except OSError:
+            self.close()
+            return
+        self.sent += len(frames)
+
+    """
+    close - Drop the connection, the next send tries to reconnect
+    """
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+"""
+run_agent - Collect snapshots and send them to an aggregator until interrupted
+@address: (host, port) of the aggregator
+@source: Where snapshots come from, anything with run_due, time_until_due and values
+@interval: Collection interval in seconds
+@recorder: Recorder to also save every snapshot to, or None
+@adaptive: AdaptiveRate adjusting the source's update interval, or None for a fixed one
+"""
+def run_agent(address, source, interval, recorder=None, adaptive=None):
+    connection = AgentConnection(address, interval)
+    try:
+        while True:
+            if source.run_due():
+                if adaptive is not None:
+                    adaptive.update(source)
+                connection.send(source.values, getattr(source, "update_interval", interval))
+                if recorder is not None:
+                    recorder.write(source.values)
+            time.sleep(source.time_until_due())
+    finally:
+        connection.close()
@@ -0,0 +1,289 @@
+"""
+aggregator.py
+
+One dashboard for many machines.
+
+OVERVIEW:
+merrin --aggregate ADDR:PORT listens for agents (merrin --agent, see agent.py) and draws a
+grid with one row per host: CPU usage and temperature, GPU temperature, RAM and VRAM use,
+the busiest disk, network throughput, the worst pressure stall and how long ago the host last
+reported. Cells are colored with the dashboard's own warning thresholds (see display.py), so
+a hot or saturated machine stands out in a rack of hundreds.
+
+ASYNCIO:
+Hundreds of agents each send a few hundred bytes a second. A thread per connection would
+spend more on switching between threads than on the data, so every connection is a
+coroutine on one asyncio event loop instead, and curses is driven from the same loop: keys
+are read when standard input becomes readable, and the grid is redrawn every
+AGGREGATOR_REFRESH_INTERVAL seconds. Each connection only applies its frames to that host's
+slots (see protocol.py), snapshots are only decoded for the redraw, and the retained-mode
+Dashboard only repaints the cells that changed.
+
+HOSTS:
+Hosts are identified by the hostname their agent reports, so an agent that reconnects
+picks up its old row. A host that disconnects stays in the grid as offline, and one that
+stays connected but stops sending for AGGREGATOR_STALE_INTERVALS of its intervals has its
+age shown as a warning.
+"""
+
+import asyncio
+import curses
+import socket
+import sys
+import time
+
+import merrin.config
+from merrin.display import CPU_TEMP_WARNING, CPU_USAGE_WARNING, DISK_UTIL_WARNING, GPU_TEMP_WARNING, MEMORY_WARNING, NET_WARNING, NORMAL_PAIR, PRESSURE_WARNING, VRAM_WARNING, WARNING_PAIR, Dashboard, threshold_color
+from merrin.protocol import FRAME_HEADER, HELLO, MAX_FRAME_SIZE, DeltaDecoder
+
+# Column headings and widths of the grid, after the HOST_WIDTH wide host name
+COLUMNS = (("CPU%", 7), ("CPU C", 7), ("GPU C", 7), ("RAM%", 7), ("VRAM%", 7), ("DISK%", 7), ("NET MB/s", 14), ("PSI%", 7), ("AGE", 8))
+HOST_WIDTH = 24
+
+# Connections the kernel queues before the aggregator accepts them, a whole rack may
+# (re)connect at once when the aggregator starts
+LISTEN_BACKLOG = 1024
+
+"""
+Host - What the aggregator knows about one machine
+@name: Hostname reported by its agent
+"""
+class Host:
+    def __init__(self, name):
+        self.name = name
+        # Decoder of the connection currently reporting for this host
+        self.decoder = None
+        self.connected = False
+        # Monotonic time of the last frame
+        self.updated = None
+
+"""
+cell - Format one grid cell
+@value: The value, or None if unavailable
+@fmt: Format spec for the value
+@width: Column width
+@threshold: Values at or above this are drawn as warnings, or None to never warn
+
+Return: tuple: (text, curses attribute)
+"""
+def cell(value, fmt, width, threshold=None):
+    if value is None:
+        return (f"{'-':>{width}}", curses.color_pair(NORMAL_PAIR))
+    attr = curses.color_pair(NORMAL_PAIR) if threshold is None else threshold_color(value, threshold)
+    return (f"{value:>{width}{fmt}}", attr)
+
+"""
+host_cells - The grid cells for one host's snapshot
+@data: Snapshot dictionary
+
+Return: list: (text, attr) for every column but the host name and age
+"""
+def host_cells(data):
+    widths = [width for _, width in COLUMNS]
+
+    memory = data['memory']
+    ram = None if memory is None or not memory['total'] else memory['used'] / memory['total'] * 100
+    vram = None
+    if data['gpu_usage'] is not None:
+        vram = max((usage['used'] / usage['total'] * 100 for usage in data['gpu_usage'].values() if usage['total']), default=None)
+    disk = None
+    if data['disk_io']:
+        disk = max(io['util'] for io in data['disk_io'].values())
+    psi = None
+    if data['pressure'] is not None:
+        psi = max(stall['some'] for stall in data['pressure'].values())
+
+    cells = [
+        cell(data['cpu_usage'], ".1f", widths[0], CPU_USAGE_WARNING),
+        cell(data['cpu_temp'], ".1f", widths[1], CPU_TEMP_WARNING),
+        cell(data['gpu_temp'], ".1f", widths[2], GPU_TEMP_WARNING),
+        cell(ram, ".1f", widths[3], MEMORY_WARNING),
+        cell(vram, ".1f", widths[4], VRAM_WARNING),
+        cell(disk, ".0f", widths[5], DISK_UTIL_WARNING),
+    ]
+
+    # Received and sent over every interface, warning if any one of them is near its link speed
+    if data['net_io']:
+        interfaces = data['net_io'].values()
+        rx = sum(io['rx'] for io in interfaces)
+        tx = sum(io['tx'] for io in interfaces)
+        # Link speeds are in megabits (10^6 bits), our MB are 1024 * 1024 bytes
+        busiest = max((max(io['rx'], io['tx']) * 8 * 1.048576 / io['speed'] * 100 for io in interfaces if io['speed']), default=0)
+        cells.append((f"{f'{rx:.1f}/{tx:.1f}':>{widths[6]}}", threshold_color(busiest, NET_WARNING)))
+    else:
+        cells.append(cell(None, "", widths[6]))
+
+    cells.append(cell(psi, ".1f", widths[7], PRESSURE_WARNING))
+    return cells
+
+"""
+Aggregator - Accepts agent connections and draws their hosts as a grid
+@stdscr: The curses standard screen object
+"""
+class Aggregator:
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+        self.dashboard = Dashboard(stdscr)
+        # {hostname: Host}
+        self.hosts = {}
+        # Bytes received from all agents, and the count and time at the last redraw
+        self.received = 0
+        self.last_received = 0
+        self.last_render = time.monotonic()
+        # First host shown, changed with the arrow keys when there are more hosts than rows
+        self.offset = 0
+        self.stop = None
+
+    """
+    handle - Read one agent's frames until it disconnects
+    @reader: asyncio StreamReader of the connection
+    @writer: asyncio StreamWriter of the connection
+
+    A connection that breaks the protocol is closed, its agent reconnects and starts over.
+    """
+    async def handle(self, reader, writer):
+        decoder = DeltaDecoder()
+        host = None
+        try:
+            while True:
+                kind, length = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                if length > MAX_FRAME_SIZE:
+                    break
+                decoder.apply(kind, await reader.readexactly(length))
+                self.received += FRAME_HEADER.size + length
+                if kind == HELLO:
+                    name = decoder.hostname() or "{}:{}".format(*writer.get_extra_info("peername")[:2])
+                    host = self.hosts.get(name)
+                    if host is None:
+                        host = self.hosts[name] = Host(name)
+                    # If two agents report the same hostname, the latest one to connect is shown
+                    host.decoder = decoder
+                    host.connected = True
+                if host.decoder is decoder:
+                    host.updated = time.monotonic()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            if host is not None and host.decoder is decoder:
+                host.connected = False
+            writer.close()
+
+    """
+    host_row - The grid row for one host
+    @host: Host to draw
+    @now: Current monotonic time
+
+    Return: tuple: Segments of the row
+    """
+    def host_row(self, host, now):
+        normal = curses.color_pair(NORMAL_PAIR)
+        name = (f"{host.name[:HOST_WIDTH - 1]:<{HOST_WIDTH}}", curses.A_BOLD if host.connected else curses.A_DIM)
+        data = host.decoder.snapshot()
+        if data is None:
+            return (name, ("waiting for the first snapshot", normal))
+
+        age = now - host.updated
+        width = COLUMNS[-1][1]
+        if not host.connected:
+            age_cell = (f"{'offline':>{width}}", curses.color_pair(WARNING_PAIR))
+        else:
+            stale = age >= merrin.config.AGGREGATOR_STALE_INTERVALS * host.decoder.interval
+            age_cell = (f"{f'{age:.0f}s':>{width}}", curses.color_pair(WARNING_PAIR) if stale else normal)
+        return (name, *host_cells(data), age_cell)
+
+    """
+    render - Redraw the grid, only cells that changed are repainted
+    """
+    def render(self):
+        height, width = self.stdscr.getmaxyx()
+        now = time.monotonic()
+        rate = (self.received - self.last_received) / max(now - self.last_render, 1e-3) / 1024
+        self.last_received = self.received
+        self.last_render = now
+
+        connected = sum(host.connected for host in self.hosts.values())
+        names = sorted(self.hosts)
+        # Two rows for the summary and the column headings
+        visible = max(1, height - 2)
+        self.offset = max(0, min(self.offset, len(names) - visible))
+
+        heading = f"{'HOST':<{HOST_WIDTH}}" + "".join(f"{title:>{column_width}}" for title, column_width in COLUMNS)
+        rows = [
+            (None, ((f"{len(names)} hosts, {connected} connected | {rate:.1f} KB/s from agents | q quits, arrows scroll", curses.A_BOLD),)),
+            (None, ((heading, curses.A_BOLD),)),
+        ]
+        for name in names[self.offset:self.offset + visible]:
+            rows.append((None, self.host_row(self.hosts[name], now)))
+        self.dashboard.render_rows(rows)
+
+    """
+    read_keys - Handle every key press waiting in the curses input queue
+    """
+    def read_keys(self):
+        page = max(1, self.stdscr.getmaxyx()[0] - 2)
+        while True:
+            key = self.stdscr.getch()
+            if key == -1:
+                return
+            if key == ord('q'):
+                self.stop.set()
+            elif key == curses.KEY_DOWN:
+                self.offset += 1
+            elif key == curses.KEY_UP:
+                self.offset = max(0, self.offset - 1)
+            elif key == curses.KEY_NPAGE:
+                self.offset += page
+            elif key == curses.KEY_PPAGE:
+                self.offset = max(0, self.offset - page)
+            elif key == curses.KEY_RESIZE:
+                curses.update_lines_cols()
+                self.dashboard.invalidate()
+            else:
+                continue
+            self.render()
+
+    """
+    run - Serve agents and redraw the grid until 'q' is pressed
+    @sock: Listening socket
+    """
+    async def run(self, sock):
+        self.stop = asyncio.Event()
+        server = await asyncio.start_server(self.handle, sock=sock)
+        loop = asyncio.get_running_loop()
+        loop.add_reader(sys.stdin.fileno(), self.read_keys)
+        async with server:
+            while not self.stop.is_set():
+                # A resize doesn't make standard input readable, so the queue is also checked here
+                self.read_keys()
+                self.render()
+                try:
+                    await asyncio.wait_for(self.stop.wait(), merrin.config.AGGREGATOR_REFRESH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        loop.remove_reader(sys.stdin.fileno())
+
+"""
+main_aggregator - Set up curses and run the aggregator's event loop
+@stdscr: The curses standard screen object
+@sock: Listening socket
+"""
+def main_aggregator(stdscr, sock):
+    curses.start_color()
+    curses.use_default_colors()
+    # Keys are read whenever standard input is readable, getch must never block the loop
+    stdscr.nodelay(True)
+    asyncio.run(Aggregator(stdscr).run(sock))
+
+"""
+run_aggregator - Listen for agents and show them until 'q' is pressed
+@address: (host, port) to listen on
+"""
+def run_aggregator(address):
+    host, port = address
+    # Bound before curses starts, so an address already in use is reported normally
+    try:
+        sock = socket.create_server(address, family=socket.AF_INET6 if ":" in host else socket.AF_INET, backlog=LISTEN_BACKLOG)
+    except OSError as err:
+        print(f"Can't listen on {host}:{port}: {err}")
+        sys.exit(1)
+    curses.wrapper(main_aggregator, sock)
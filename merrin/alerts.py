@@ -0,0 +1,465 @@
+"""
+alerts.py
+
+Alert rules evaluated over every snapshot, and the sinks that are told about them.
+
+OVERVIEW:
+The dashboard's warning colors (see display.py) only compare the latest value against a
+threshold. A temperature hovering around 85 C flips between red and normal every frame, a
+one-second spike looks the same as an hour of load, and nobody who isn't looking at the
+terminal finds out. Alert rules fix all three:
+
+- A rule looks at a statistic of a metric rather than its latest value: a moving average
+  (EWMA), the maximum over a window, or the rate of change over a window
+- It fires once the statistic has stayed at or above `above` for `sustain` seconds
+- It only resolves once the statistic falls below `clear`, which is set lower than `above`
+  so a value hovering around the threshold doesn't fire and resolve over and over (hysteresis)
+
+The rules are ALERT_RULES in config.py. While the dashboard runs, firing alerts are listed in
+an Alerts row and the rows of their metrics stay red until they resolve. merrin --daemon
+evaluates them headlessly.
+
+ROLLING STATISTICS:
+Each statistic is updated in O(1) per snapshot (amortized for the windowed ones) instead of
+being recomputed over a buffer of past values:
+
+ewma    value += alpha * (sample - value), with alpha = 1 - exp(-dt / window). Weighting by
+        the time since the previous snapshot keeps `window` meaning seconds when the
+        interval changes (--adaptive) or snapshots are skipped
+max     A deque of (time, value) kept in decreasing order of value. A new sample removes
+        every smaller one from the back, since they can never be the maximum again, and
+        samples older than the window fall off the front. The maximum is the front.
+rate    Change per second between the newest sample and the oldest one within the window
+
+Time comes from the snapshot's own timestamp, so a recording replayed at 100x speed fires
+the same alerts it would have live.
+
+SINKS:
+Firing and resolving are events, sent to each sink given with --alert KIND:TARGET:
+
+log:PATH      Appends the event to a file as a line of JSON
+exec:COMMAND  Runs a command with the event on stdin as JSON and in MERRIN_ALERT_* variables
+unix:PATH     Sends the event as a JSON datagram to a Unix socket
+
+Other packages can add kinds through the "merrin.alert_sinks" entry point group, the same
+way as collector backends (see collectors.py). A sink is a class taking the TARGET string,
+with a send(event) method and a close() method.
+
+Sinks can be slow (a command that posts to a chat server) or stuck (a socket nobody reads).
+Events are handed to a worker thread through a bounded queue, so collection never waits for
+them. If the queue fills up, new events are dropped and counted rather than blocking.
+"""
+
+import collections
+import json
+import math
+import os
+import queue
+import time
+
+import merrin.config
+
+"""
+memory_percent - Share of RAM in use
+@data: Snapshot dictionary
+
+Return: float: Percent, or None if unavailable
+"""
+def memory_percent(data):
+    memory = data.get('memory')
+    if memory is None or not memory['total']:
+        return None
+    return memory['used'] / memory['total'] * 100
+
+"""
+vram_percent - Share of VRAM in use on the fullest GPU
+@data: Snapshot dictionary
+
+Return: float: Percent, or None if there are no GPUs
+"""
+def vram_percent(data):
+    usage = [card['used'] / card['total'] * 100 for card in (data.get('gpu_usage') or {}).values() if card['total']]
+    return max(usage) if usage else None
+
+"""
+disk_percent - Utilization of the busiest disk
+@data: Snapshot dictionary
+
+Return: float: Percent of the time busy, or None if unavailable
+"""
+def disk_percent(data):
+    util = [io['util'] for io in (data.get('disk_io') or {}).values()]
+    return max(util) if util else None
+
+"""
+pressure_percent - The worst "some" pressure stall of CPU, memory and I/O
+@data: Snapshot dictionary
+
+Return: float: Percent of the last 10 seconds, or None if unavailable
+"""
+def pressure_percent(data):
+    pressure = data.get('pressure')
+    if pressure is None:
+        return None
+    return max(stall['some'] for stall in pressure.values())
+
+# The metrics a rule can watch, each a function from a snapshot to a number or None
+METRICS = {
+    "cpu_usage": lambda data: data.get('cpu_usage'),
+    "cpu_temp": lambda data: data.get('cpu_temp'),
+    "gpu_temp": lambda data: data.get('gpu_temp'),
+    "memory": memory_percent,
+    "vram": vram_percent,
+    "disk": disk_percent,
+    "pressure": pressure_percent,
+}
+
+"""
+Latest - The latest value itself, for rules that need no smoothing
+"""
+class Latest:
+    def __init__(self, window):
+        pass
+
+    """
+    update - Add a sample
+    @now: Snapshot time in seconds
+    @value: The metric's value
+
+    Return: float: The statistic, or None until there is enough to compute it
+    """
+    def update(self, now, value):
+        return value
+
+"""
+Ewma - Exponentially weighted moving average
+@window: Time constant in seconds, a step change is 63% reflected after this long
+"""
+class Ewma:
+    def __init__(self, window):
+        self.window = window
+        self.value = None
+        self.last = None
+
+    def update(self, now, value):
+        if self.value is None or self.window <= 0:
+            self.value = value
+        else:
+            alpha = 1 - math.exp(-max(now - self.last, 0) / self.window)
+            self.value += alpha * (value - self.value)
+        self.last = now
+        return self.value
+
+"""
+WindowMax - Largest value over the last `window` seconds
+@window: Window in seconds
+"""
+class WindowMax:
+    def __init__(self, window):
+        self.window = window
+        # (time, value), values decreasing from front to back
+        self.samples = collections.deque()
+
+    def update(self, now, value):
+        samples = self.samples
+        while samples and samples[-1][1] <= value:
+            samples.pop()
+        samples.append((now, value))
+        while now - samples[0][0] > self.window:
+            samples.popleft()
+        return samples[0][1]
+
+"""
+Rate - Change per second over the last `window` seconds
+@window: Window in seconds
+"""
+class Rate:
+    def __init__(self, window):
+        self.window = window
+        self.samples = collections.deque()
+
+    def update(self, now, value):
+        samples = self.samples
+        samples.append((now, value))
+        # Keep the oldest sample at least `window` old, so the rate spans the whole window
+        while len(samples) > 2 and now - samples[1][0] >= self.window:
+            samples.popleft()
+        then, previous = samples[0]
+        if now <= then:
+            return None
+        return (value - previous) / (now - then)
+
+# The statistics a rule can compare, by the name used in ALERT_RULES
+STATISTICS = {
+    "value": Latest,
+    "ewma": Ewma,
+    "max": WindowMax,
+    "rate": Rate,
+}
+
+"""
+Rule - One alert rule and its state
+@spec: Dictionary from ALERT_RULES
+
+Raises ValueError if the rule is malformed.
+"""
+class Rule:
+    def __init__(self, spec):
+        try:
+            self.name = spec['name']
+            self.metric = spec['metric']
+            self.above = float(spec['above'])
+        except KeyError as err:
+            raise ValueError(f"alert rule {spec} has no {err}") from None
+        self.stat = spec.get('stat', "value")
+        if self.metric not in METRICS:
+            raise ValueError(f"alert rule {self.name}: metric must be one of {', '.join(METRICS)}")
+        if self.stat not in STATISTICS:
+            raise ValueError(f"alert rule {self.name}: stat must be one of {', '.join(STATISTICS)}")
+        self.clear = float(spec.get('clear', self.above))
+        if self.clear > self.above:
+            raise ValueError(f"alert rule {self.name}: clear can't be above the threshold")
+        self.sustain = float(spec.get('sustain', 0))
+        self.window = float(spec.get('window', 0))
+        self.statistic = STATISTICS[self.stat](self.window)
+        self.value = None
+        self.firing = False
+        # When the statistic first reached the threshold, while waiting out `sustain`
+        self.pending_since = None
+
+    """
+    evaluate - Update the rule with a snapshot
+    @data: Snapshot dictionary
+    @now: Snapshot time in seconds
+
+    Return: str: "firing" or "resolved" if the rule changed state, otherwise None
+    """
+    def evaluate(self, data, now):
+        sample = METRICS[self.metric](data)
+        # A metric that is unavailable leaves the rule as it was
+        if sample is None:
+            return None
+        value = self.statistic.update(now, sample)
+        if value is None:
+            return None
+        self.value = value
+
+        if self.firing:
+            if value < self.clear:
+                self.firing = False
+                return "resolved"
+            return None
+        if value < self.above:
+            self.pending_since = None
+            return None
+        if self.pending_since is None:
+            self.pending_since = now
+        if now - self.pending_since >= self.sustain:
+            self.firing = True
+            self.pending_since = None
+            return "firing"
+        return None
+
+    """
+    event - Describe the rule's current state for the sinks
+    @state: "firing" or "resolved"
+    @now: Snapshot time in seconds
+
+    Return: dict: JSON-serializable event
+    """
+    def event(self, state, now):
+        return {
+            "alert": self.name,
+            "state": state,
+            "metric": self.metric,
+            "stat": self.stat,
+            "value": round(self.value, 2),
+            "threshold": self.above if state == "firing" else self.clear,
+            "time": now,
+        }
+
+"""
+LogSink - Appends events to a file, one line of JSON each
+@target: Path of the file
+"""
+class LogSink:
+    def __init__(self, target):
+        # Line buffered, so each event is on disk as soon as it is written
+        self.out = open(target, "a", buffering=1)
+
+    def send(self, event):
+        self.out.write(json.dumps(event) + "\n")
+
+    def close(self):
+        self.out.close()
+
+"""
+CommandSink - Runs a command for every event
+@target: Command line, split like a shell would but without running one
+
+The event is written to the command's stdin as JSON, and also set in the environment as
+MERRIN_ALERT, MERRIN_ALERT_STATE, MERRIN_ALERT_METRIC and MERRIN_ALERT_VALUE for scripts
+that would rather not parse it. Commands still running after ALERT_COMMAND_TIMEOUT seconds
+are killed.
+"""
+class CommandSink:
+    def __init__(self, target):
+        import shlex
+        self.argv = shlex.split(target)
+        if not self.argv:
+            raise ValueError("exec: needs a command")
+
+    def send(self, event):
+        import subprocess
+        env = dict(os.environ)
+        env.update({
+            "MERRIN_ALERT": event['alert'],
+            "MERRIN_ALERT_STATE": event['state'],
+            "MERRIN_ALERT_METRIC": event['metric'],
+            "MERRIN_ALERT_VALUE": str(event['value']),
+        })
+        subprocess.run(self.argv, input=json.dumps(event).encode(), env=env, timeout=merrin.config.ALERT_COMMAND_TIMEOUT,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def close(self):
+        pass
+
+"""
+SocketSink - Sends events as JSON datagrams to a Unix socket
+@target: Path of the socket
+
+Nothing is sent while no one is listening on the socket, the events are lost.
+"""
+class SocketSink:
+    def __init__(self, target):
+        import socket
+        self.path = target
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+
+    def send(self, event):
+        self.sock.sendto(json.dumps(event).encode(), self.path)
+
+    def close(self):
+        self.sock.close()
+
+# Sinks by the KIND of --alert KIND:TARGET
+SINKS = {
+    "log": LogSink,
+    "exec": CommandSink,
+    "unix": SocketSink,
+}
+
+"""
+open_sink - Create the sink an --alert argument describes
+@text: KIND:TARGET, e.g. "log:/var/log/merrin-alerts.log"
+
+Kinds other than SINKS are looked up in the ALERT_SINK_PLUGIN_GROUP entry points.
+
+Return: The sink. Raises ValueError if the kind is unknown, OSError if it can't be opened.
+"""
+def open_sink(text):
+    kind, colon, target = text.partition(":")
+    if not colon or not target:
+        raise ValueError("--alert needs KIND:TARGET, e.g. log:/tmp/merrin-alerts.log")
+    if kind in SINKS:
+        return SINKS[kind](target)
+    from merrin.collectors import find_plugins, load_plugin
+    for name, plugin in find_plugins(merrin.config.ALERT_SINK_PLUGIN_GROUP):
+        if name == kind:
+            return load_plugin(plugin)(target)
+    raise ValueError(f"unknown alert sink {kind}, expected one of {', '.join(SINKS)}")
+
+"""
+AlertEngine - Evaluates the rules over every snapshot and dispatches events
+@rules: Rule specifications, see ALERT_RULES
+@sinks: Opened sinks to send events to, may be empty
+
+Raises ValueError if a rule is malformed.
+"""
+class AlertEngine:
+    def __init__(self, rules, sinks=()):
+        self.rules = [Rule(spec) for spec in rules]
+        self.sinks = list(sinks)
+        # The snapshot last evaluated, so one that didn't change isn't counted twice
+        self.last_sample = None
+        # Events that didn't fit in the queue, and sends that raised
+        self.dropped = 0
+        self.errors = 0
+        self.queue = None
+        self.worker = None
+        # Set by close() when the queue is too full to take the stop marker
+        self.stopping = False
+        if self.sinks:
+            # Only needed when events go somewhere
+            import threading
+            self.queue = queue.Queue(merrin.config.ALERT_QUEUE_SIZE)
+            self.worker = threading.Thread(target=self.dispatch, name="merrin-alerts", daemon=True)
+            self.worker.start()
+
+    """
+    evaluate - Update every rule with a snapshot and queue the events it causes
+    @data: Snapshot dictionary
+
+    Adds an 'alerts' entry to the snapshot listing the firing alerts, which the dashboard
+    shows in its Alerts row.
+
+    Return: list: The firing alerts, {'alert', 'metric', 'stat', 'value'} each
+    """
+    def evaluate(self, data):
+        sample = data.get('current_datetime')
+        if sample is None or sample != self.last_sample:
+            self.last_sample = sample
+            now = time.time() if sample is None else sample.timestamp()
+            for rule in self.rules:
+                state = rule.evaluate(data, now)
+                if state is not None and self.queue is not None:
+                    try:
+                        self.queue.put_nowait(rule.event(state, now))
+                    except queue.Full:
+                        self.dropped += 1
+
+        firing = [{"alert": rule.name, "metric": rule.metric, "stat": rule.stat, "value": rule.value} for rule in self.rules if rule.firing]
+        data['alerts'] = firing
+        return firing
+
+    """
+    dispatch - Send queued events to every sink, run by the worker thread
+
+    The worker owns the sinks: it closes them itself once it stops, so a sink is never
+    closed while it is still sending.
+    """
+    def dispatch(self):
+        try:
+            while True:
+                event = self.queue.get()
+                # close() queues None, or sets stopping if the queue was too full for it
+                if event is None or self.stopping:
+                    return
+                for sink in self.sinks:
+                    try:
+                        sink.send(event)
+                    except Exception:
+                        # A sink that is gone or broken mustn't stop the others
+                        self.errors += 1
+        finally:
+            for sink in self.sinks:
+                try:
+                    sink.close()
+                except OSError:
+                    pass
+
+    """
+    close - Send the events still queued, then stop the worker, which closes the sinks
+
+    Waits up to ALERT_COMMAND_TIMEOUT for the worker. One still stuck in a send after that
+    closes the sinks when the send returns, or is stopped with the process.
+    """
+    def close(self):
+        if self.worker is not None:
+            try:
+                self.queue.put(None, timeout=1)
+            except queue.Full:
+                # Events are still arriving faster than they are sent, skip the rest
+                self.stopping = True
+            self.worker.join(timeout=merrin.config.ALERT_COMMAND_TIMEOUT)
+            self.worker = None
@@ -0,0 +1,172 @@
+"""
+burst.py
+
+High-frequency burst sampling.
+
+OVERVIEW:
+The display measures CPU usage over the whole update interval, which averages a 50 ms spike
+into a barely visible bump. merrin --burst RATE:DURATION samples CPU usage and the CPU and
+GPU temperatures RATE times a second for DURATION seconds, then prints the distribution of
+each: p50, p90, p99 and the maximum.
+
+SAMPLE LOOP:
+At 200 Hz there are 5 ms per sample, so the loop is kept as lean as the main loop's
+collectors and leaner:
+- /proc/stat and the temperature inputs are opened once, and each sample is a pread() into
+  the same buffer (see reader.py)
+- Only the aggregate cpu line is parsed, with one precompiled regex, and numbers are read
+  straight out of the buffer
+- Samples go into fixed-size histograms (see histogram.py), so nothing grows while sampling
+  and no list of samples is kept or sorted
+- Temperatures are recorded in the millidegrees the kernel reports and CPU usage in
+  hundredths of a percent, so recording is integer work
+- Each sample is scheduled against a deadline rather than by sleeping for the interval, so
+  time spent sampling doesn't stretch the period
+
+RESOLUTION:
+The kernel counts CPU time in ticks of 1/100th of a second (USER_HZ) per core, so a 10 ms
+window on one core can only be 0% or 100% busy. The aggregate line sums every core, which
+helps on machines with many cores, but at high rates on small machines CPU usage comes out in
+coarse steps. Temperatures don't have this problem, though many sensors only update every few
+milliseconds.
+"""
+
+import re
+import time
+
+import merrin.config
+import merrin.reader
+from merrin.collectors import AmdCpuBackend, CoretempBackend
+from merrin.histogram import Histogram
+from merrin.metrics import SensorRegistry
+
+# The aggregate cpu line: user nice system idle iowait irq softirq steal
+CPU_LINE = re.compile(rb"cpu +(\d+) (\d+) (\d+) (\d+) (\d+) (\d+) (\d+) (\d+)")
+
+# Positions of idle and iowait among the groups of CPU_LINE
+IDLE_GROUPS = (4, 5)
+
+"""
+read_cpu_times - Read the aggregate busy and total time from a kept-open /proc/stat
+@stat: PseudoFile for /proc/stat
+
+Return: tuple: (busy ticks, total ticks), or None if the line can't be parsed
+"""
+def read_cpu_times(stat):
+    stat.read(until=b"\ncpu0")
+    match = CPU_LINE.match(stat.buf)
+    if match is None:
+        return None
+    total = 0
+    idle = 0
+    view = stat.view
+    for group in range(1, 9):
+        value = int(view[match.start(group):match.end(group)])
+        total += value
+        if group in IDLE_GROUPS:
+            idle += value
+    return total - idle, total
+
+"""
+BurstSampler - Samples CPU usage and temperatures into histograms
+"""
+class BurstSampler:
+    def __init__(self):
+        self.stat = merrin.reader.PseudoFile(merrin.config.PROC_STAT_PATH)
+        self.sensors = SensorRegistry()
+        # AMD or Intel, whichever hwmon chip this machine has
+        cpu = next((backend for backend in (AmdCpuBackend, CoretempBackend) if self.sensors.lookup(backend.chip, backend.label) is not None), AmdCpuBackend)
+        self.temperatures = (
+            ("cpu_temp", cpu.chip, cpu.label),
+            ("gpu_temp", merrin.config.GPU_SENSOR_NAME, merrin.config.GPU_TEMP_LABEL),
+        )
+        self.histograms = {name: Histogram() for name in ("cpu_usage", "cpu_temp", "gpu_temp", "sample_cost")}
+        self.prev = read_cpu_times(self.stat)
+        # Deadlines that had already passed by the time the previous sample finished
+        self.missed = 0
+
+    """
+    sample - Take one sample of every metric
+    """
+    def sample(self):
+        start = time.perf_counter_ns()
+        histograms = self.histograms
+
+        current = read_cpu_times(self.stat)
+        if current is not None and self.prev is not None:
+            busy = current[0] - self.prev[0]
+            total = current[1] - self.prev[1]
+            # No tick has elapsed on any core since the last sample, so there is nothing to measure
+            if total > 0:
+                histograms["cpu_usage"].record(busy * 10000 // total)
+        self.prev = current
+
+        for name, sensor, label in self.temperatures:
+            temp_md = self.sensors.read_input(sensor, label)
+            if temp_md is not None:
+                histograms[name].record(max(0, temp_md))
+
+        histograms["sample_cost"].record(time.perf_counter_ns() - start)
+
+    """
+    run - Sample at a fixed rate for a while
+    @rate: Samples per second
+    @duration: Seconds to sample for
+    """
+    def run(self, rate, duration):
+        interval = 1 / rate
+        deadline = time.monotonic() + interval
+        for _ in range(int(rate * duration)):
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.missed += 1
+            deadline += interval
+            self.sample()
+
+    """
+    report - The distribution of every metric as text lines
+
+    Return: list: A header and one line per metric that has samples
+    """
+    def report(self):
+        # (name, divisor to get display units, unit)
+        metrics = (
+            ("cpu_usage", 100, "%"),
+            ("cpu_temp", 1000, "C"),
+            ("gpu_temp", 1000, "C"),
+            ("sample_cost", 1000, "us"),
+        )
+        lines = [f"{'metric':<14}{'samples':>9}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  unit"]
+        for name, divisor, unit in metrics:
+            histogram = self.histograms[name]
+            if histogram.count == 0:
+                continue
+            values = [histogram.percentile(fraction) / divisor for fraction in (0.5, 0.9, 0.99)] + [histogram.max / divisor]
+            lines.append(f"{name:<14}{histogram.count:>9}" + "".join(f"{value:>10.2f}" for value in values) + f"  {unit}")
+        return lines
+
+    """
+    close - Close the kept-open files
+    """
+    def close(self):
+        self.stat.close()
+        self.sensors.close()
+
+"""
+run_burst - Sample at a high rate for a bounded time and print the distributions
+@rate: Samples per second
+@duration: Seconds to sample for
+"""
+def run_burst(rate, duration):
+    sampler = BurstSampler()
+    try:
+        print(f"Sampling at {rate:g} Hz for {duration:g} seconds...", flush=True)
+        sampler.run(rate, duration)
+    finally:
+        sampler.close()
+    for line in sampler.report():
+        print(line)
+    if sampler.missed:
+        print(f"\n{sampler.missed} samples were late, the machine couldn't keep up with {rate:g} Hz")
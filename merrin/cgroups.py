@@ -0,0 +1,352 @@
+"""
+cgroups.py
+
+Per-cgroup resource usage for the cgroup v2 hierarchy.
+
+OVERVIEW:
+On a container host, the useful question is usually which container or systemd slice is
+busy rather than which process. Every container and slice is a cgroup, a directory under
+/sys/fs/cgroup whose files account for everything its processes use:
+
+cpu.stat        usage_usec, CPU time used in microseconds
+memory.current  Memory in use, in bytes
+io.stat         One line per disk with rbytes= and wbytes= counters
+
+CPU% and I/O rates are computed from the difference against the previous frame, the same way
+as the CPU sampler does for /proc/stat.
+
+CACHED HIERARCHY:
+A busy host can have thousands of cgroups, and listing every directory each frame would cost
+more than reading the counters. The tree is walked once, down to CGROUP_DEPTH levels (slices
+and the containers or services inside them), and the three files of every cgroup found are
+kept open as PseudoFiles. After that the tree is kept current with inotify: the kernel
+reports directories being created or removed in the watched cgroups, so a frame only reads
+the kept-open files plus whatever events arrived.
+
+The standard library has no inotify binding, so the three system calls are made through
+ctypes, which is only imported once the tree is first scanned. Where that isn't possible (no
+watches left, or a libc without inotify) the tree is rescanned every CGROUP_RESCAN_INTERVAL
+seconds instead.
+"""
+
+import os
+import struct
+import time
+
+import merrin.config
+import merrin.reader
+from merrin.metrics import refresh_interval
+
+# INOTIFY
+# Event flags from <sys/inotify.h>
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# Header of each event: watch descriptor, mask, cookie, length of the name that follows
+EVENT = struct.Struct("iIII")
+
+"""
+Inotify - Minimal inotify binding through ctypes
+
+Raises OSError if inotify isn't available.
+"""
+class Inotify:
+    def __init__(self):
+        # ctypes takes a while to import, so it's only loaded when cgroups are actually shown
+        import ctypes
+        self.ctypes = ctypes
+        try:
+            self.libc = ctypes.CDLL(None, use_errno=True)
+            init = self.libc.inotify_init1
+        except (OSError, AttributeError) as err:
+            raise OSError(f"inotify is unavailable: {err}")
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    """
+    add_watch - Watch a directory for subdirectories being created or removed
+    @path: Directory to watch
+
+    Return: int: Watch descriptor. Raises OSError if the watch can't be added.
+    """
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CREATE | IN_DELETE | IN_ONLYDIR)
+        if wd < 0:
+            raise OSError(self.ctypes.get_errno(), f"can't watch {path}")
+        return wd
+
+    """
+    read_events - Collect the events queued since the last call, without blocking
+
+    Return: list: (watch descriptor, mask, name) for each event
+    """
+    def read_events(self):
+        events = []
+        while True:
+            try:
+                raw = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(raw):
+                wd, mask, _, length = EVENT.unpack_from(raw, offset)
+                offset += EVENT.size
+                name = raw[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+                offset += length
+                events.append((wd, mask, name))
+
+    """
+    close - Close the inotify descriptor, removing every watch
+    """
+    def close(self):
+        os.close(self.fd)
+
+"""
+Cgroup - The kept-open accounting files of one cgroup
+@path: Path relative to CGROUP_ROOT, e.g. "system.slice/nginx.service"
+
+Files for controllers that aren't enabled in this cgroup are left as None.
+"""
+class Cgroup:
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        for name in ("cpu.stat", "memory.current", "io.stat"):
+            try:
+                self.files[name] = merrin.reader.PseudoFile(os.path.join(merrin.config.CGROUP_ROOT, path, name), 1024)
+            except OSError:
+                self.files[name] = None
+        # Counters from the previous read, None until the first one
+        self.prev_usage = None
+        self.prev_io = None
+
+    """
+    read_file - Re-read one of the kept-open files
+
+    Return: PseudoFile: The file with fresh content, or None if it isn't available
+    """
+    def read_file(self, name):
+        pseudo_file = self.files[name]
+        if pseudo_file is None:
+            return None
+        try:
+            pseudo_file.read()
+        except OSError:
+            # The cgroup was removed before we heard about it
+            return None
+        return pseudo_file
+
+    """
+    read - Read the cgroup's counters and compute rates since the previous read
+    @elapsed: Seconds since the previous read, or None on the first
+
+    Return: dict: {'cpu': percent, 'memory': MB, 'io': MB/s}, any of them None if unavailable
+    """
+    def read(self, elapsed):
+        cpu = None
+        cpu_stat = self.read_file("cpu.stat")
+        usage = None if cpu_stat is None else cpu_stat.int_after(b"usage_usec ")
+        if usage is not None and self.prev_usage is not None and elapsed:
+            cpu = round((usage - self.prev_usage) / (elapsed * 1e6) * 100, 1)
+        self.prev_usage = usage
+
+        memory_current = self.read_file("memory.current")
+        memory = None if memory_current is None else memory_current.int_at(0)
+
+        io = None
+        io_stat = self.read_file("io.stat")
+        if io_stat is not None:
+            # Sum the read and written bytes over every disk line
+            total = 0
+            for key in (b"rbytes=", b"wbytes="):
+                pos = io_stat.find(key)
+                while pos != -1:
+                    total += io_stat.int_at(pos + len(key)) or 0
+                    pos = io_stat.find(key, pos + len(key))
+            if self.prev_io is not None and elapsed:
+                io = round((total - self.prev_io) / (1024 ** 2) / elapsed, 2)
+            self.prev_io = total
+
+        return {
+            "cpu": cpu,
+            "memory": None if memory is None else memory // (1024 ** 2),
+            "io": io,
+        }
+
+    """
+    close - Close the kept-open files
+    """
+    def close(self):
+        for pseudo_file in self.files.values():
+            if pseudo_file is not None:
+                pseudo_file.close()
+
+"""
+CgroupTree - The cgroups down to CGROUP_DEPTH, kept current with inotify
+@limit: How many cgroups collect() returns, CGROUP_LIMIT if not given
+"""
+class CgroupTree:
+    def __init__(self, limit=None):
+        self.limit = merrin.config.CGROUP_LIMIT if limit is None else limit
+        # {relative path: Cgroup}
+        self.groups = {}
+        # {watch descriptor: relative path of the watched directory}
+        self.watches = {}
+        self.inotify = None
+        self.last_scan = None
+        self.last_read = None
+
+    """
+    depth - How many levels below the root a cgroup is
+    """
+    def depth(self, path):
+        return path.count("/") + 1
+
+    """
+    watch - Start watching a cgroup directory, if its children are within CGROUP_DEPTH
+    @path: Relative path, "" for the root
+
+    If the watch can't be added (usually because the user's inotify watch limit is used up),
+    inotify is given up on and the tree falls back to periodic rescans.
+    """
+    def watch(self, path):
+        if self.inotify is None or (path and self.depth(path) >= merrin.config.CGROUP_DEPTH):
+            return
+        try:
+            self.watches[self.inotify.add_watch(os.path.join(merrin.config.CGROUP_ROOT, path))] = path
+        except OSError:
+            self.inotify.close()
+            self.inotify = None
+            self.watches = {}
+
+    """
+    add - Track a newly found cgroup
+    @path: Relative path
+    """
+    def add(self, path):
+        if path in self.groups:
+            return
+        self.groups[path] = Cgroup(path)
+        self.watch(path)
+
+    """
+    remove - Stop tracking a cgroup and any cgroups below it
+    @path: Relative path
+    """
+    def remove(self, path):
+        for child in [child for child in self.groups if child == path or child.startswith(path + "/")]:
+            self.groups.pop(child).close()
+
+    """
+    scan - Walk the hierarchy down to CGROUP_DEPTH and bring the tracked set in line with it
+
+    Called once at startup, after inotify reports lost events, and on every rescan interval
+    when inotify isn't available.
+    """
+    def scan(self):
+        self.last_scan = time.monotonic()
+        if self.inotify is not None:
+            # Watches are added again for every directory found below
+            self.inotify.close()
+        try:
+            self.inotify = Inotify()
+        except OSError:
+            self.inotify = None
+        self.watches = {}
+        self.watch("")
+
+        found = set()
+        pending = [""]
+        while pending:
+            parent = pending.pop()
+            try:
+                entries = os.scandir(os.path.join(merrin.config.CGROUP_ROOT, parent))
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False):
+                        continue
+                    path = os.path.join(parent, entry.name)
+                    found.add(path)
+                    if self.depth(path) < merrin.config.CGROUP_DEPTH:
+                        pending.append(path)
+
+        for path in [path for path in self.groups if path not in found]:
+            self.groups.pop(path).close()
+        for path in sorted(found):
+            if path in self.groups:
+                self.watch(path)
+            else:
+                self.add(path)
+
+    """
+    update - Apply the hierarchy changes reported since the last frame
+    """
+    def update(self):
+        if self.inotify is None:
+            if self.last_scan is None or time.monotonic() - self.last_scan >= merrin.config.CGROUP_RESCAN_INTERVAL:
+                self.scan()
+            return
+
+        for wd, mask, name in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, so the only way to be sure is to look again
+                self.scan()
+                return
+            if mask & IN_IGNORED:
+                # The watched directory was removed
+                self.watches.pop(wd, None)
+                continue
+            parent = self.watches.get(wd)
+            if parent is None or not mask & IN_ISDIR:
+                continue
+            path = os.path.join(parent, name)
+            if mask & IN_CREATE:
+                self.add(path)
+            elif mask & IN_DELETE:
+                self.remove(path)
+
+    """
+    collect - Read every tracked cgroup and report the busiest
+
+    Return: dict: {'count': int, 'top': list of {'path', 'cpu', 'memory', 'io'}} sorted by CPU,
+    or None if there is no cgroup v2 hierarchy
+    """
+    @refresh_interval(merrin.config.CGROUP_REFRESH_INTERVAL)
+    def collect(self):
+        # cgroup v1 (or no cgroups at all) has no cgroup.controllers file at the root
+        if not os.path.exists(os.path.join(merrin.config.CGROUP_ROOT, "cgroup.controllers")):
+            return None
+        if self.last_scan is None:
+            self.scan()
+        else:
+            self.update()
+
+        now = time.monotonic()
+        elapsed = None if self.last_read is None else now - self.last_read
+        self.last_read = now
+
+        usage = []
+        for path, group in self.groups.items():
+            values = group.read(elapsed)
+            values["path"] = path
+            usage.append(values)
+        usage.sort(key=lambda values: values["cpu"] or 0.0, reverse=True)
+        return {"count": len(self.groups), "top": usage[:self.limit]}
+
+    """
+    close - Close every kept-open file and the inotify descriptor
+    """
+    def close(self):
+        for group in self.groups.values():
+            group.close()
+        self.groups = {}
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
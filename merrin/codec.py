@@ -0,0 +1,467 @@
+"""
+codec.py
+
+Fixed-layout binary encoding of metrics snapshots.
+
+OVERVIEW:
+The shared memory daemon and the recorder both need to store snapshots somewhere other than
+a Python dictionary. A snapshot is flattened into a fixed sequence of 64-bit floats, so every
+record for the same machine has the same size and each value sits at a known offset.
+
+SCHEMA:
+The parts of a snapshot that vary between machines (how many cores, which GPUs, disks and
+network interfaces) or that
+never change while running (user and hostname) are described by a schema instead of being
+stored in every record. The schema is a small dictionary serialized as JSON next to the
+records, and both sides build the same SnapshotCodec from it.
+
+Records use the machine's native byte order, which is little-endian on every platform
+merrin supports (x86-64 and ARM64 Linux).
+
+MISSING VALUES:
+Metrics that are unavailable are stored as NaN and come back as None. Integer metrics
+(memory, VRAM, uptime) are stored as floats, which represent them exactly, and are
+converted back to int when decoding.
+
+Disks, network interfaces and pressure stall information were added to the layout after the
+first recordings were made. Their slots come last and schemas without them describe none of
+them, so older recordings still decode. The load, power, clocks and GTT of each GPU were
+added the same way, after pressure, and then the channels of the temperature matrix.
+"""
+
+import array
+import datetime
+import json
+import math
+
+NAN = float("nan")
+
+# The order CpuSampler.mode_split reports modes in
+CPU_MODES = ("user", "system", "iowait", "irq", "steal")
+
+# Values stored for each disk and each network interface
+DISK_FIELDS = ("read", "write", "iops", "util")
+NET_FIELDS = ("rx", "tx", "speed")
+
+# Pressure stall averages, in the order they are stored
+PRESSURE_RESOURCES = ("cpu", "memory", "io")
+PRESSURE_KINDS = ("some", "full")
+
+# Values stored for each GPU besides its VRAM, power is in watts and the rest are integers
+GPU_FIELDS = ("busy", "power", "sclk", "mclk", "gtt_used", "gtt_total")
+
+"""
+schema_of - Describe the variable parts of a snapshot
+@data: Snapshot dictionary
+
+Return: dict: {'cores': int, 'gpus': [str], 'disks': [str], 'interfaces': [str],
+'pressure': bool, 'gpu_stats': bool, 'temps': [[chip, label]], 'user': str, 'hostname': str}
+"""
+def schema_of(data):
+    return {
+        "cores": len(data.get("cpu_cores") or ()),
+        "gpus": sorted(data.get("gpu_usage") or ()),
+        "disks": sorted(data.get("disk_io") or ()),
+        "interfaces": sorted(data.get("net_io") or ()),
+        "pressure": data.get("pressure") is not None,
+        "gpu_stats": bool(data.get("gpu_usage")),
+        # In the order the matrix shows them
+        "temps": [[chip, label] for chip, channels in (data.get("temps") or {}).items() for label in channels],
+        "user": data.get("user"),
+        "hostname": data.get("hostname"),
+    }
+
+"""
+encode_schema - Serialize a schema for storage alongside the records
+
+Return: bytes: UTF-8 JSON
+"""
+def encode_schema(schema):
+    return json.dumps(schema, separators=(",", ":")).encode()
+
+"""
+decode_schema - Parse a schema written by encode_schema
+
+Return: dict: The schema
+"""
+def decode_schema(raw):
+    return json.loads(bytes(raw).decode())
+
+"""
+number - Convert an optional metric to a float slot value
+
+Return: float: The value, or NaN for None
+"""
+def number(value):
+    return NAN if value is None else float(value)
+
+"""
+optional - Convert a float slot value back to an optional metric
+@value: Stored value
+@cast: Type to convert to (float or int)
+
+Return: The value as cast, or None for NaN
+"""
+def optional(value, cast=float):
+    return None if math.isnan(value) else cast(value)
+
+"""
+SnapshotCodec - Packs snapshots matching a schema into fixed-size records
+@schema: Schema from schema_of
+"""
+class SnapshotCodec:
+    def __init__(self, schema):
+        self.schema = schema
+        self.cores = schema["cores"]
+        self.gpus = schema["gpus"]
+        self.disks = schema.get("disks", [])
+        self.interfaces = schema.get("interfaces", [])
+        self.pressure = schema.get("pressure", False)
+        self.gpu_stats = schema.get("gpu_stats", False)
+        self.temps = [tuple(channel) for channel in schema.get("temps", [])]
+
+        # Slot layout: timestamp, cpu usage, cpu modes, per-core usage, cpu temperature,
+        # gpu temperature, memory used/total, uptime hours/minutes, used/total per GPU,
+        # the DISK_FIELDS of each disk, the NET_FIELDS of each interface, pressure if present,
+        # then the GPU_FIELDS of each GPU if present, then each temperature matrix channel
+        self.slots = (1 + 1 + len(CPU_MODES) + self.cores + 2 + 2 + 2 + 2 * len(self.gpus)
+                      + len(DISK_FIELDS) * len(self.disks) + len(NET_FIELDS) * len(self.interfaces)
+                      + (len(PRESSURE_RESOURCES) * len(PRESSURE_KINDS) if self.pressure else 0)
+                      + (len(GPU_FIELDS) * len(self.gpus) if self.gpu_stats else 0)
+                      + len(self.temps))
+        self.size = self.slots * 8
+        # Reused for every encode so packing doesn't allocate a new array each time
+        self.values = array.array("d", bytes(self.size))
+
+    """
+    columns - Name of every slot, in order, e.g. for a CSV header
+
+    Return: list: One name per slot
+    """
+    def columns(self):
+        names = ["timestamp", "cpu_usage"] + [f"cpu_{mode}" for mode in CPU_MODES]
+        names += [f"cpu{core}" for core in range(self.cores)]
+        names += ["cpu_temp", "gpu_temp", "memory_used", "memory_total", "uptime_hours", "uptime_minutes"]
+        for card in self.gpus:
+            names += [f"{card}_vram_used", f"{card}_vram_total"]
+        for disk in self.disks:
+            names += [f"{disk}_{field}" for field in DISK_FIELDS]
+        for interface in self.interfaces:
+            names += [f"{interface}_{field}" for field in NET_FIELDS]
+        if self.pressure:
+            names += [f"pressure_{resource}_{kind}" for resource in PRESSURE_RESOURCES for kind in PRESSURE_KINDS]
+        if self.gpu_stats:
+            for card in self.gpus:
+                names += [f"{card}_{field}" for field in GPU_FIELDS]
+        names += [f"{chip}_{label}_temp" for chip, label in self.temps]
+        return names
+
+    """
+    fill - Flatten a snapshot into the slot array
+    @data: Snapshot dictionary
+
+    Return: array: The codec's reused array of slot values, overwritten by the next call
+    """
+    def fill(self, data):
+        values = self.values
+        now = data.get("current_datetime")
+        values[0] = NAN if now is None else now.timestamp()
+        values[1] = number(data.get("cpu_usage"))
+
+        slot = 2
+        modes = data.get("cpu_modes")
+        for mode in CPU_MODES:
+            values[slot] = NAN if modes is None else modes[mode]
+            slot += 1
+
+        cores = data.get("cpu_cores")
+        if cores is not None and len(cores) == self.cores:
+            values[slot:slot + self.cores] = array.array("d", cores)
+        else:
+            values[slot:slot + self.cores] = array.array("d", [NAN]) * self.cores
+        slot += self.cores
+
+        values[slot] = number(data.get("cpu_temp"))
+        values[slot + 1] = number(data.get("gpu_temp"))
+        memory = data.get("memory") or {}
+        values[slot + 2] = number(memory.get("used"))
+        values[slot + 3] = number(memory.get("total"))
+        uptime = data.get("uptime") or {}
+        values[slot + 4] = number(uptime.get("hours"))
+        values[slot + 5] = number(uptime.get("minutes"))
+        slot += 6
+
+        gpus = data.get("gpu_usage") or {}
+        for card in self.gpus:
+            usage = gpus.get(card) or {}
+            values[slot] = number(usage.get("used"))
+            values[slot + 1] = number(usage.get("total"))
+            slot += 2
+
+        slot = self.pack_devices(values, slot, data.get("disk_io"), self.disks, DISK_FIELDS)
+        slot = self.pack_devices(values, slot, data.get("net_io"), self.interfaces, NET_FIELDS)
+        if self.pressure:
+            slot = self.pack_devices(values, slot, data.get("pressure"), PRESSURE_RESOURCES, PRESSURE_KINDS)
+        if self.gpu_stats:
+            slot = self.pack_devices(values, slot, data.get("gpu_usage"), self.gpus, GPU_FIELDS)
+        temps = data.get("temps") or {}
+        for chip, label in self.temps:
+            values[slot] = number((temps.get(chip) or {}).get(label))
+            slot += 1
+        return values
+
+    """
+    pack_into - Write a snapshot into a buffer
+    @buffer: Writable buffer (bytearray, mmap or shared memory)
+    @offset: Byte offset of the record in the buffer
+    @data: Snapshot dictionary
+    """
+    def pack_into(self, buffer, offset, data):
+        buffer[offset:offset + self.size] = memoryview(self.fill(data)).cast("B")
+
+    """
+    pack_devices - Write the values of each disk, interface or pressure resource into the slots
+    @values: Slot array
+    @slot: First slot to write
+    @devices: {name: {field: value}} from the snapshot, or None
+    @names: Names in the order they are stored
+    @fields: Fields stored per device
+
+    Return: int: The slot after the last one written
+    """
+    def pack_devices(self, values, slot, devices, names, fields):
+        devices = devices or {}
+        for name in names:
+            device = devices.get(name) or {}
+            for field in fields:
+                values[slot] = number(device.get(field))
+                slot += 1
+        return slot
+
+    """
+    unpack_devices - Read the values of each disk, interface or pressure resource back out of the slots
+    @values: Slot array
+    @slot: First slot to read
+    @names: Names in the order they are stored
+    @fields: Fields stored per device
+    @devices: Dictionary from a previous decode to update in place, or None
+
+    Return: tuple: ({name: {field: value}} or None if none were present, the next slot)
+    """
+    def unpack_devices(self, values, slot, names, fields, devices=None):
+        if devices is None:
+            devices = {}
+        for name in names:
+            if math.isnan(values[slot]):
+                devices.pop(name, None)
+            else:
+                devices[name] = update_fields(devices.get(name), values, slot, fields)
+            slot += len(fields)
+        return (devices if devices else None), slot
+
+    """
+    pack - Encode a snapshot into a new bytes object
+
+    Return: bytes: The record
+    """
+    def pack(self, data):
+        record = bytearray(self.size)
+        self.pack_into(record, 0, data)
+        return bytes(record)
+
+    """
+    unpack_from - Read a snapshot back out of a buffer
+    @buffer: Buffer holding the record
+    @offset: Byte offset of the record in the buffer
+
+    Return: dict: A new snapshot dictionary with the same keys the collectors produce
+    """
+    def unpack_from(self, buffer, offset=0):
+        values = array.array("d")
+        values.frombytes(buffer[offset:offset + self.size])
+        return self.unpack_into(values, {})
+
+    """
+    unpack_into - Decode slot values into an existing snapshot dictionary
+    @values: Slot array
+    @data: Dictionary to overwrite, a previous result of unpack_into or empty
+
+    The nested dictionaries and the core list already in data are updated rather than
+    replaced, so decoding every frame into the same dictionary only allocates the numbers
+    themselves once the devices stop changing. Anything holding on to a previous result
+    sees it change.
+
+    Return: dict: data
+    """
+    def unpack_into(self, values, data):
+        timestamp = values[0]
+        data["current_datetime"] = None if math.isnan(timestamp) else datetime.datetime.fromtimestamp(timestamp)
+        data["cpu_usage"] = optional(values[1])
+        data["user"] = self.schema.get("user")
+        data["hostname"] = self.schema.get("hostname")
+
+        slot = 2
+        data["cpu_modes"] = None if math.isnan(values[slot]) else update_fields(data.get("cpu_modes"), values, slot, CPU_MODES)
+        slot += len(CPU_MODES)
+
+        cores = None
+        if self.cores and not math.isnan(values[slot]):
+            cores = data.get("cpu_cores")
+            if cores is None or len(cores) != self.cores:
+                cores = [0.0] * self.cores
+            cores[:] = values[slot:slot + self.cores]
+        data["cpu_cores"] = cores
+        slot += self.cores
+
+        data["cpu_temp"] = optional(values[slot])
+        data["gpu_temp"] = optional(values[slot + 1])
+        data["memory"] = None if math.isnan(values[slot + 2]) else update_fields(data.get("memory"), values, slot + 2, ("used", "total"), int)
+        data["uptime"] = None if math.isnan(values[slot + 4]) else update_fields(data.get("uptime"), values, slot + 4, ("hours", "minutes"), int)
+        slot += 6
+
+        gpus = data.get("gpu_usage") or {}
+        for card in self.gpus:
+            if math.isnan(values[slot]):
+                gpus.pop(card, None)
+            else:
+                gpus[card] = update_fields(gpus.get(card), values, slot, ("used", "total"), int)
+            slot += 2
+        data["gpu_usage"] = gpus if gpus else None
+
+        data["disk_io"], slot = self.unpack_devices(values, slot, self.disks, DISK_FIELDS, data.get("disk_io"))
+        data["net_io"], slot = self.unpack_devices(values, slot, self.interfaces, NET_FIELDS, data.get("net_io"))
+        data["pressure"] = None
+        if self.pressure:
+            data["pressure"], slot = self.unpack_devices(values, slot, PRESSURE_RESOURCES, PRESSURE_KINDS, data.get("pressure"))
+        if self.gpu_stats:
+            for card in self.gpus:
+                # Only for GPUs whose VRAM was present, the same as gpu_usage itself
+                if card in gpus:
+                    usage = gpus[card]
+                    for index, field in enumerate(GPU_FIELDS):
+                        usage[field] = optional(values[slot + index], float if field == "power" else int)
+                slot += len(GPU_FIELDS)
+
+        temps = data.get("temps") or {}
+        for chip, label in self.temps:
+            channels = temps.get(chip)
+            if not math.isnan(values[slot]):
+                if channels is None:
+                    channels = temps[chip] = {}
+                channels[label] = values[slot]
+            elif channels is not None:
+                channels.pop(label, None)
+                if not channels:
+                    del temps[chip]
+            slot += 1
+        data["temps"] = temps if temps else None
+        return data
+
+"""
+update_fields - Overwrite the fields of a nested snapshot dictionary from slots
+@target: Dictionary to update, or None to create one
+@values: Slot array
+@slot: Slot of the first field
+@fields: Field names in the order they are stored
+@cast: Type to convert to (float or int)
+
+Return: dict: target, or the new dictionary
+"""
+def update_fields(target, values, slot, fields, cast=float):
+    if target is None:
+        target = {}
+    for index, field in enumerate(fields):
+        target[field] = optional(values[slot + index], cast)
+    return target
+
+"""
+Snapshot - The slots of one snapshot, with a dictionary view decoded in place
+@codec: SnapshotCodec for the schema the slots follow
+
+A SnapshotCodec decoding into a new dictionary allocates one for every disk, interface and
+GPU on every frame, and a new array for the slots. Viewers drawing from a daemon, a
+recording or an agent decode a snapshot every frame for as long as they run, so instead
+each keeps one Snapshot. The slot array and the dictionary view are allocated once, and
+every load overwrites them:
+
+load      Copy a packed record out of a buffer (shared memory, a recording, a frame) into
+          the slots, a single memcpy
+store     Flatten a collector snapshot dictionary into the slots
+pack      The slots as bytes, or written straight into a buffer with pack_into
+dict      The dictionary view, with the same keys the collectors produce, decoded only
+          when the slots changed since the last call
+
+What a frame still allocates is fixed by the schema: the datetime, and a float or int per
+value that changed. benchmarks/run.py measures it as snapshot_load.
+"""
+class Snapshot:
+    __slots__ = ("codec", "values", "raw", "view", "stale")
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.values = array.array("d", bytes(codec.size))
+        # The same memory as bytes, for copying records in and out
+        self.raw = memoryview(self.values).cast("B")
+        self.view = {}
+        # Whether the slots changed since the view was last decoded
+        self.stale = True
+
+    """
+    load - Copy a packed record into the slots
+    @buffer: Buffer holding the record
+    @offset: Byte offset of the record in the buffer
+
+    Return: Snapshot: self
+    """
+    def load(self, buffer, offset=0):
+        # Released straight away, an mmap can't be closed while a view of it exists
+        with memoryview(buffer) as view:
+            self.raw[:] = view[offset:offset + self.codec.size]
+        self.stale = True
+        return self
+
+    """
+    store - Flatten a snapshot dictionary into the slots
+    @data: Snapshot dictionary from the collectors
+
+    Return: Snapshot: self
+    """
+    def store(self, data):
+        self.raw[:] = memoryview(self.codec.fill(data)).cast("B")
+        self.stale = True
+        return self
+
+    """
+    pack - The slots as a packed record
+
+    Return: bytes: A new copy of the record
+    """
+    def pack(self):
+        return self.raw.tobytes()
+
+    """
+    pack_into - Write the slots into a buffer as a packed record
+    @buffer: Writable buffer
+    @offset: Byte offset of the record in the buffer
+    """
+    def pack_into(self, buffer, offset=0):
+        buffer[offset:offset + self.codec.size] = self.raw
+
+    """
+    timestamp - When the snapshot was collected, without decoding it
+
+    Return: float: Epoch seconds, or None if unknown
+    """
+    def timestamp(self):
+        return optional(self.values[0])
+
+    """
+    dict - The dictionary view of the slots
+
+    Return: dict: The same dictionary every call, updated if the slots changed
+    """
+    def dict(self):
+        if self.stale:
+            self.codec.unpack_into(self.values, self.view)
+            self.stale = False
+        return self.view
@@ -0,0 +1,474 @@
+"""
+collectors.py
+
+Hardware backends, probed once at startup.
+
+OVERVIEW:
+CPU and GPU temperatures and VRAM usage come from different places on different hardware.
+Each source is a backend that probes for its hardware once, when the scheduler is built,
+and only registers collectors if the hardware is there. On a machine without a GPU no GPU
+collector is ever scheduled, so the main loop pays nothing for hardware that isn't present,
+and the display shows those metrics as unavailable.
+
+BUILT-IN BACKENDS:
+k10temp       AMD CPU temperature (Tctl) from hwmon
+amdgpu        AMD GPU VRAM, load, power and clocks from DRM (see gpu.py) and junction
+              temperature from hwmon
+coretemp      Intel CPU package temperature from hwmon
+temps         Every temperature of the AMD CPU and GPU chips, for the matrix (see temps.py)
+thermal_zone  CPU temperature from /sys/class/thermal, for ARM boards and laptops whose
+              sensor has no hwmon driver
+nvidia        NVIDIA VRAM, load, power and temperature through NVML, the library the
+              NVIDIA driver ships, opened with ctypes
+
+Several backends can provide the same metric (any of the three CPU temperature sources).
+Backends are probed in the order above and the first one present provides the metric,
+later ones only provide what is still missing.
+
+PLUGINS:
+Other packages can add backends through the "merrin.collectors" entry point group:
+
+[project.entry-points."merrin.collectors"]
+fans = "merrin_fans:FanBackend"
+
+The entry point names a Backend subclass providing some of HARDWARE_KEYS, in the same form
+as the built-in collectors return them. Plugins are probed before the built-in backends, so
+one can take over a metric from them, for hardware merrin doesn't know or a faster way to
+read it. A plugin that fails to load or probe is skipped with a warning.
+
+Entry points are found by reading the entry_points.txt of each installed distribution
+directly. importlib.metadata would do the same, but importing it takes longer than the rest
+of merrin --once put together.
+"""
+
+import os
+import sys
+
+import merrin.config
+import merrin.reader
+from merrin.gpu import GpuTopology
+from merrin.metrics import refresh_interval
+from merrin.temps import TempMatrix
+
+# Snapshot keys that come from backends. Keys no backend provides are set to None, which
+# the display shows as unavailable
+HARDWARE_KEYS = ("cpu_temp", "gpu_usage", "gpu_temp", "temps")
+
+"""
+Backend - Base class for a source of hardware metrics
+@sensors: The scheduler's SensorRegistry, already scanned, for backends that read hwmon
+"""
+class Backend:
+    # Short name, used in warnings
+    name = None
+
+    def __init__(self, sensors):
+        self.sensors = sensors
+
+    """
+    probe - Check once whether the hardware is present
+
+    Return: tuple: Snapshot keys this backend can provide here, empty if none
+    """
+    def probe(self):
+        return ()
+
+    """
+    register - Add collectors for the keys this backend was picked for
+    @scheduler: Scheduler to add them to
+    @keys: Keys from probe() that no earlier backend provides
+    """
+    def register(self, scheduler, keys):
+        pass
+
+    """
+    close - Release anything probe() opened, called when the backend isn't used
+    """
+    def close(self):
+        pass
+
+"""
+HwmonBackend - A backend reading temperatures from one hwmon chip and label
+"""
+class HwmonBackend(Backend):
+    # Snapshot key, chip name and label, set by subclasses
+    key = None
+    chip = None
+    label = None
+
+    def probe(self):
+        return (self.key,) if self.sensors.lookup(self.chip, self.label) is not None else ()
+
+    def register(self, scheduler, keys):
+        scheduler.add(self.key, self.sensors.read, self.chip, self.label)
+
+"""
+AmdCpuBackend - AMD CPU temperature from the k10temp chip
+"""
+class AmdCpuBackend(HwmonBackend):
+    name = "k10temp"
+    key = "cpu_temp"
+    chip = merrin.config.CPU_SENSOR_NAME
+    label = merrin.config.CPU_TEMP_LABEL
+
+"""
+CoretempBackend - Intel CPU package temperature from the coretemp chip
+"""
+class CoretempBackend(HwmonBackend):
+    name = "coretemp"
+    key = "cpu_temp"
+    chip = merrin.config.CORETEMP_SENSOR_NAME
+    label = merrin.config.CORETEMP_LABEL
+
+"""
+AmdGpuBackend - AMD GPU VRAM usage from DRM and junction temperature from hwmon
+"""
+class AmdGpuBackend(Backend):
+    name = "amdgpu"
+
+    def __init__(self, sensors):
+        super().__init__(sensors)
+        self.topology = None
+
+    def probe(self):
+        keys = ()
+        # Finding the cards opens their files, which the collector keeps using afterwards
+        self.topology = GpuTopology()
+        if self.topology.cards:
+            keys += ("gpu_usage",)
+        if self.sensors.lookup(merrin.config.GPU_SENSOR_NAME, merrin.config.GPU_TEMP_LABEL) is not None:
+            keys += ("gpu_temp",)
+        return keys
+
+    def register(self, scheduler, keys):
+        if "gpu_usage" in keys:
+            scheduler.add('gpu_usage', self.topology.collect)
+        else:
+            self.close()
+        if "gpu_temp" in keys:
+            scheduler.add('gpu_temp', self.sensors.read, merrin.config.GPU_SENSOR_NAME, merrin.config.GPU_TEMP_LABEL)
+
+    def close(self):
+        if self.topology is not None:
+            self.topology.close()
+            self.topology = None
+
+"""
+TempMatrixBackend - Every temperature channel of the chips in TEMP_MATRIX_CHIPS
+"""
+class TempMatrixBackend(Backend):
+    name = "temps"
+
+    def __init__(self, sensors):
+        super().__init__(sensors)
+        self.matrix = None
+
+    def probe(self):
+        # Built from the channels the registry found, it opens each one for the collector
+        self.matrix = TempMatrix(self.sensors)
+        return ("temps",) if self.matrix.channels else ()
+
+    def register(self, scheduler, keys):
+        scheduler.add('temps', self.matrix.collect)
+
+    def close(self):
+        if self.matrix is not None:
+            self.matrix.close()
+            self.matrix = None
+
+"""
+ThermalZoneBackend - CPU temperature from the kernel's thermal zones
+
+Each /sys/class/thermal/thermal_zoneN has a type file naming what it measures and a temp
+file in millidegrees. The first zone whose type is in THERMAL_ZONE_TYPES is kept open.
+"""
+class ThermalZoneBackend(Backend):
+    name = "thermal_zone"
+
+    def __init__(self, sensors):
+        super().__init__(sensors)
+        self.zone = None
+
+    def probe(self):
+        try:
+            zones = sorted(os.listdir(merrin.config.THERMAL_ROOT))
+        except OSError:
+            return ()
+        # Zones are tried in order of preference, then by number
+        found = {}
+        for zone in zones:
+            try:
+                with open(os.path.join(merrin.config.THERMAL_ROOT, zone, "type")) as f:
+                    zone_type = f.read().strip()
+            except OSError:
+                continue
+            if zone_type in merrin.config.THERMAL_ZONE_TYPES:
+                found.setdefault(zone_type, zone)
+        for zone_type in merrin.config.THERMAL_ZONE_TYPES:
+            if zone_type in found:
+                try:
+                    self.zone = merrin.reader.PseudoFile(os.path.join(merrin.config.THERMAL_ROOT, found[zone_type], "temp"), 32)
+                except OSError:
+                    continue
+                return ("cpu_temp",)
+        return ()
+
+    def register(self, scheduler, keys):
+        scheduler.add('cpu_temp', self.read)
+
+    """
+    read - Read the zone's temperature
+
+    Return: float: Degrees Celsius to one decimal place, or None if unavailable
+    """
+    @refresh_interval(merrin.config.TEMP_REFRESH_INTERVAL)
+    def read(self):
+        try:
+            self.zone.read()
+        except OSError:
+            return None
+        temp_md = self.zone.int_at(0)
+        return None if temp_md is None else round(temp_md / 1000.0, 1)
+
+    def close(self):
+        if self.zone is not None:
+            self.zone.close()
+
+"""
+NvidiaBackend - NVIDIA VRAM usage and temperature through NVML
+
+The NVIDIA driver exposes neither in sysfs, but ships libnvidia-ml, whose C API answers
+both without starting nvidia-smi. Only the functions we need are bound, through ctypes.
+GPUs are named nvidia0, nvidia1 and so on, and the temperature is that of the hottest one.
+"""
+class NvidiaBackend(Backend):
+    name = "nvidia"
+
+    def __init__(self, sensors):
+        super().__init__(sensors)
+        self.nvml = None
+        self.handles = []
+
+    def probe(self):
+        # Only imported here, most machines don't have the library to open
+        import ctypes
+        try:
+            nvml = ctypes.CDLL(merrin.config.NVML_LIBRARY)
+        except OSError:
+            return ()
+
+        # nvmlMemory_t: total, free and used bytes
+        class Memory(ctypes.Structure):
+            _fields_ = [("total", ctypes.c_ulonglong), ("free", ctypes.c_ulonglong), ("used", ctypes.c_ulonglong)]
+
+        # nvmlUtilization_t: percent of the last sample period the GPU and its memory were busy
+        class Utilization(ctypes.Structure):
+            _fields_ = [("gpu", ctypes.c_uint), ("memory", ctypes.c_uint)]
+
+        # Declared signatures make ctypes convert and check every argument instead of guessing
+        # from the Python value (a plain int would be passed as a 32-bit C int). Every function
+        # returns an nvmlReturn_t, 0 on success
+        uint_p = ctypes.POINTER(ctypes.c_uint)
+        signatures = {
+            "nvmlInit_v2": [],
+            "nvmlShutdown": [],
+            "nvmlDeviceGetCount_v2": [uint_p],
+            "nvmlDeviceGetHandleByIndex_v2": [ctypes.c_uint, ctypes.POINTER(ctypes.c_void_p)],
+            "nvmlDeviceGetMemoryInfo": [ctypes.c_void_p, ctypes.POINTER(Memory)],
+            "nvmlDeviceGetUtilizationRates": [ctypes.c_void_p, ctypes.POINTER(Utilization)],
+            "nvmlDeviceGetPowerUsage": [ctypes.c_void_p, uint_p],
+            "nvmlDeviceGetTemperature": [ctypes.c_void_p, ctypes.c_int, uint_p],
+        }
+        try:
+            for function, argtypes in signatures.items():
+                getattr(nvml, function).argtypes = argtypes
+                getattr(nvml, function).restype = ctypes.c_int
+        except AttributeError:
+            # A library too old to have every function we call
+            return ()
+
+        if nvml.nvmlInit_v2() != 0:
+            return ()
+        self.nvml = nvml
+        count = ctypes.c_uint()
+        if nvml.nvmlDeviceGetCount_v2(ctypes.byref(count)) == 0:
+            for index in range(count.value):
+                handle = ctypes.c_void_p()
+                if nvml.nvmlDeviceGetHandleByIndex_v2(index, ctypes.byref(handle)) == 0:
+                    self.handles.append(handle)
+        if not self.handles:
+            self.close()
+            return ()
+
+        self.memory = Memory()
+        self.utilization = Utilization()
+        self.temperature = ctypes.c_uint()
+        self.power = ctypes.c_uint()
+        self.byref = ctypes.byref
+        return ("gpu_usage", "gpu_temp")
+
+    def register(self, scheduler, keys):
+        if "gpu_usage" in keys:
+            scheduler.add('gpu_usage', self.read_usage)
+        if "gpu_temp" in keys:
+            scheduler.add('gpu_temp', self.read_temp)
+
+    """
+    read_usage - Read VRAM usage of every GPU
+
+    Return: dict: {'nvidiaN': {'used': int, 'total': int, 'busy': int, 'power': float}} with
+    VRAM in MB, busy in percent and power in watts, or None if unavailable
+    """
+    @refresh_interval(merrin.config.GPU_REFRESH_INTERVAL)
+    def read_usage(self):
+        usage = {}
+        nvml = self.nvml
+        for index, handle in enumerate(self.handles):
+            if nvml.nvmlDeviceGetMemoryInfo(handle, self.byref(self.memory)) != 0:
+                continue
+            card = {"used": self.memory.used // (1024 ** 2), "total": self.memory.total // (1024 ** 2), "busy": None, "power": None}
+            if nvml.nvmlDeviceGetUtilizationRates(handle, self.byref(self.utilization)) == 0:
+                card["busy"] = self.utilization.gpu
+            # Milliwatts
+            if nvml.nvmlDeviceGetPowerUsage(handle, self.byref(self.power)) == 0:
+                card["power"] = round(self.power.value / 1000, 1)
+            usage[f"nvidia{index}"] = card
+        return usage if usage else None
+
+    """
+    read_temp - Read the temperature of the hottest GPU
+
+    Return: float: Degrees Celsius, or None if unavailable
+    """
+    @refresh_interval(merrin.config.TEMP_REFRESH_INTERVAL)
+    def read_temp(self):
+        hottest = None
+        for handle in self.handles:
+            # NVML_TEMPERATURE_GPU = 0, the die temperature
+            if self.nvml.nvmlDeviceGetTemperature(handle, 0, self.byref(self.temperature)) == 0:
+                hottest = max(hottest or 0, self.temperature.value)
+        return None if hottest is None else float(hottest)
+
+    def close(self):
+        if self.nvml is not None:
+            self.nvml.nvmlShutdown()
+            self.nvml = None
+            self.handles = []
+
+# Built-in backends, in the order they are probed
+BACKENDS = (AmdCpuBackend, AmdGpuBackend, CoretempBackend, TempMatrixBackend, ThermalZoneBackend, NvidiaBackend)
+
+# Entry points found so far, {group: [(name, "module:attribute")]}
+PLUGINS = {}
+
+"""
+find_plugins - Find the entry points of a group
+@group: Entry point group, e.g. "merrin.collectors"
+
+Reads the entry_points.txt of every distribution installed on sys.path, wheels (*.dist-info)
+and eggs or develop installs (*.egg-info) alike. That file is an INI file with one section
+per group and "name = module:attribute" lines. As with importlib.metadata, a distribution
+installed in more than one directory on sys.path only counts where it is found first. The
+installed distributions are only searched once per group, later calls (another
+build_scheduler, every alert sink) reuse the result.
+
+Return: list: (name, "module:attribute") for every plugin found
+"""
+def find_plugins(group):
+    if group in PLUGINS:
+        return PLUGINS[group]
+    plugins = []
+    searched = set()
+    distributions = set()
+    for path in sys.path:
+        path = os.path.realpath(path or ".")
+        if path in searched:
+            continue
+        searched.add(path)
+        try:
+            entries = sorted(os.listdir(path))
+        except OSError:
+            continue
+        for entry in entries:
+            if not entry.endswith((".dist-info", ".egg-info")):
+                continue
+            # name-version.dist-info, name-version-pyX.Y.egg-info or name.egg-info. The
+            # installers already escaped dashes in the name, case and dots may still differ
+            distribution = entry.rpartition(".")[0].split("-")[0].replace(".", "_").lower()
+            if distribution in distributions:
+                continue
+            try:
+                with open(os.path.join(path, entry, "entry_points.txt")) as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                # No entry points, or an egg-info file rather than a directory
+                lines = []
+            distributions.add(distribution)
+            section = None
+            for line in lines:
+                line = line.strip()
+                if line.startswith("["):
+                    section = line.strip("[]").strip()
+                elif section == group and "=" in line:
+                    name, _, target = line.partition("=")
+                    plugins.append((name.strip(), target.strip()))
+    PLUGINS[group] = plugins
+    return plugins
+
+"""
+load_plugin - Import the object an entry point names
+@target: "module:attribute" from find_plugins
+
+Return: The object. Raises whatever importing the module raises.
+"""
+def load_plugin(target):
+    import importlib
+    module, _, attribute = target.partition(":")
+    plugin = importlib.import_module(module.strip())
+    for part in attribute.strip().split("."):
+        plugin = getattr(plugin, part)
+    return plugin
+
+"""
+load_plugins - Import every plugin backend
+
+Return: list: Backend subclasses, plugins that fail to import are left out with a warning
+"""
+def load_plugins():
+    backends = []
+    for name, target in find_plugins(merrin.config.COLLECTOR_PLUGIN_GROUP):
+        try:
+            backends.append(load_plugin(target))
+        except Exception as err:
+            print(f"merrin: skipping collector plugin {name}: {err}", file=sys.stderr)
+    return backends
+
+"""
+register_backends - Probe every backend and register collectors for the hardware found
+@scheduler: Scheduler to add collectors to
+@sensors: Scanned SensorRegistry shared by the hwmon backends
+
+Return: list: Names of the backends that registered collectors
+"""
+def register_backends(scheduler, sensors):
+    claimed = set()
+    used = []
+    for backend_class in load_plugins() + list(BACKENDS):
+        try:
+            backend = backend_class(sensors)
+            keys = tuple(key for key in backend.probe() if key not in claimed)
+            if not keys:
+                backend.close()
+                continue
+            backend.register(scheduler, keys)
+        except Exception as err:
+            # Built-in backends handle their own errors, this is for plugins
+            print(f"merrin: skipping collector backend {getattr(backend_class, 'name', backend_class)}: {err}", file=sys.stderr)
+            continue
+        claimed.update(keys)
+        used.append(backend.name)
+
+    for key in HARDWARE_KEYS:
+        if key not in claimed:
+            scheduler.values[key] = None
+    return used
@@ -25,28 +25,160 @@ We rely on several pseudo-filesystems that Linux provides to gather system infor
 # Column 2: Metric values
 FIELD_TWO_COL = 17 
 
+# Glyphs for the per-core utilization heatmap, from idle to fully busy
+# The ASCII set is used when the terminal locale can't display block characters
+HEATMAP_CHARS = " ▁▂▃▄▅▆▇█"
+HEATMAP_ASCII_CHARS = " .:-=+*#%@"
+
+# Sparklines of recent history start at this column and fill the rest of the row
+# They are left out when fewer than SPARKLINE_MIN_WIDTH columns are left
+SPARKLINE_COL = 45
+SPARKLINE_MIN_WIDTH = 10
+
+# How much history (in seconds) the sparklines cover
+HISTORY_SECONDS = 60 * 60
+
 # TIMING CONFIGURATION
 # How often to refresh the display (in seconds)
 DEFAULT_UPDATE_INTERVAL = 1
 
-# How long to wait between CPU measurements for usage calculation
+# How often each collector runs (in seconds)
+# None means follow the update interval, 0 means collect only once at startup
+# Uptime is displayed in minutes, so refreshing it more often than this is wasted work
+CPU_REFRESH_INTERVAL = None
+TEMP_REFRESH_INTERVAL = None
+GPU_REFRESH_INTERVAL = None
+MEMORY_REFRESH_INTERVAL = None
+UPTIME_REFRESH_INTERVAL = 30
+DISK_REFRESH_INTERVAL = None
+NET_REFRESH_INTERVAL = None
+PRESSURE_REFRESH_INTERVAL = None
+CGROUP_REFRESH_INTERVAL = None
+
+# Scanning every process is the most expensive thing merrin does on a busy machine,
+# and CPU% over two seconds is steadier to read than over one
+PROCESS_REFRESH_INTERVAL = 2
+
+# How long merrin --once measures CPU usage for (in seconds), unless given with --interval
+# 0 skips the measurement, and the load average stands in for CPU usage
+ONCE_CPU_WINDOW = 0.1
+
+# Upper limits for merrin --burst RATE:DURATION, in samples per second and seconds
+BURST_MAX_RATE = 1000
+BURST_MAX_DURATION = 10 * 60
+
+# ADAPTIVE SAMPLING
+# With --adaptive, the update interval follows how close metrics are to the dashboard's
+# warning thresholds (see adaptive.py)
+# Fastest and slowest intervals (in seconds)
+ADAPTIVE_MIN_INTERVAL = 0.25
+ADAPTIVE_MAX_INTERVAL = 8
+
+# A metric at this fraction of its threshold or above is sampled at the fastest interval
+ADAPTIVE_NEAR_FRACTION = 0.9
+
+# So is one rising fast enough to reach its threshold within this many seconds
+ADAPTIVE_HORIZON = 30
+
+# Sampling slows down while every metric is below this fraction of its threshold, and moved
+# by less than ADAPTIVE_STABLE_FRACTION of it since the previous snapshot
+ADAPTIVE_IDLE_FRACTION = 0.5
+ADAPTIVE_STABLE_FRACTION = 0.05
+
+# ALERTS
+# Rules evaluated over every snapshot by the dashboard and merrin --daemon (see alerts.py)
+# name     Shown in the Alerts row and sent to the --alert sinks
+# metric   cpu_usage, cpu_temp, gpu_temp, memory, vram, disk or pressure, the last four in
+#          percent (of the fullest GPU and the busiest disk)
+# stat     "value" (the latest), "ewma" (moving average), "max" or "rate" (per second)
+# window   Seconds the statistic covers, the EWMA's time constant
+# above    The alert fires once the statistic reaches this...
+# sustain  ...and stays there this many seconds
+# clear    It resolves once the statistic falls below this
+# The thresholds are the dashboard's warning thresholds, cleared a little below them
+ALERT_RULES = (
+    {"name": "cpu_hot", "metric": "cpu_temp", "stat": "ewma", "window": 10, "above": 85, "clear": 80, "sustain": 5},
+    {"name": "cpu_heating", "metric": "cpu_temp", "stat": "rate", "window": 10, "above": 2, "clear": 0.5, "sustain": 5},
+    {"name": "gpu_hot", "metric": "gpu_temp", "stat": "ewma", "window": 10, "above": 95, "clear": 90, "sustain": 5},
+    {"name": "cpu_busy", "metric": "cpu_usage", "stat": "ewma", "window": 30, "above": 90, "clear": 80, "sustain": 60},
+    {"name": "memory_full", "metric": "memory", "stat": "max", "window": 10, "above": 95, "clear": 90},
+    {"name": "vram_full", "metric": "vram", "stat": "max", "window": 10, "above": 95, "clear": 90},
+    {"name": "disk_saturated", "metric": "disk", "stat": "ewma", "window": 30, "above": 90, "clear": 75, "sustain": 60},
+    {"name": "stalled", "metric": "pressure", "stat": "ewma", "window": 10, "above": 20, "clear": 10, "sustain": 10},
+)
+
+# Commands run by exec: sinks are killed after this many seconds
+ALERT_COMMAND_TIMEOUT = 10
+
+# Events waiting for the sinks, beyond this new ones are dropped rather than held in memory
+ALERT_QUEUE_SIZE = 256
+
+# Entry point group other packages register alert sinks under
+ALERT_SINK_PLUGIN_GROUP = "merrin.alert_sinks"
+
+# How long get_cpu_usage() waits between its two CPU measurements
+# The main loop uses CpuSampler instead, which measures across the update interval
 # CPU usage requires two measurements to calculate the difference
 CPU_USAGE_INTERVAL = 1
 
+# PROCESS TABLE
+# How many processes the table shows, and what it is sorted by ("cpu" or "rss")
+PROCESS_LIMIT = 10
+PROCESS_SORT = "cpu"
+
 # PROC FILESYSTEM PATHS
+# Every running process has a directory here named after its PID
+PROC_ROOT = "/proc"
+
 # /proc/meminfo provides detailed memory statistics
 PROC_MEMINFO_PATH = "/proc/meminfo"
 
 # /proc/stat contains system statistics including CPU time counters
-# We only care about the first line, which starts wth CPU and contains timing information
-# in units of USER_HZ (typically 1/100th of a second)
+# We only care about the lines starting with cpu (the aggregate line, then one per core),
+# which contain timing information in units of USER_HZ (typically 1/100th of a second)
 PROC_STAT_PATH = "/proc/stat"
 
+# /proc/loadavg starts with the 1, 5 and 15 minute load averages
+PROC_LOADAVG_PATH = "/proc/loadavg"
+
 # /proc/uptime contains two numbers, system uptime and idle time
 # We only care about the first
 PROC_UPTIME_PATH = "/proc/uptime"
 
+# /proc/diskstats has a line of I/O counters for every block device, partitions included
+PROC_DISKSTATS_PATH = "/proc/diskstats"
+
+# /proc/net/dev has a line of byte and packet counters for every network interface
+PROC_NET_DEV_PATH = "/proc/net/dev"
+
+# /proc/pressure has one file per resource (cpu, memory, io) with its pressure stall averages
+PROC_PRESSURE_ROOT = "/proc/pressure"
+
+# Block devices whose names start with these are virtual and left out of Disk I/O
+DISK_SKIP_PREFIXES = ("loop", "ram", "zram")
+
+# Network interfaces left out of the Network section
+# Loopback traffic never leaves the machine
+NET_SKIP_INTERFACES = ("lo",)
+
 # SYSFS PATHS
+# Every whole disk has an entry here, partitions don't
+SYS_BLOCK_ROOT = "/sys/block"
+
+# Every network interface has a directory here, holding its link speed among other things
+SYS_NET_ROOT = "/sys/class/net"
+
+# Root of the cgroup v2 hierarchy, every subdirectory is a cgroup
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# How many levels of cgroups to track, 2 covers slices and the services or containers in them
+# How many of the busiest cgroups the table shows
+CGROUP_DEPTH = 2
+CGROUP_LIMIT = 8
+
+# How often (in seconds) to rescan the cgroup tree when inotify isn't available to report changes
+CGROUP_RESCAN_INTERVAL = 10
+
 # Root directory for Direct Rendering Manager devices
 # Each GPU appears as a subdirectory (card0, card1)
 DRM_ROOT = "/sys/class/drm"
@@ -56,6 +188,50 @@ DRM_ROOT = "/sys/class/drm"
 # Each hwmon directory contains files like tempX_input and tempX_label
 HWMON_ROOT = "/sys/class/hwmon"
 
+# How often (in seconds) to check HWMON_ROOT for sensor chips being added or removed
+# Between checks, temperatures are read from files kept open since the last scan
+# A channel whose read fails is skipped, and retried by a rescan at most this often
+SENSOR_RESCAN_INTERVAL = 10
+
+# SHARED MEMORY
+# merrin --daemon publishes snapshots to a POSIX shared memory segment with this name
+# On Linux these segments appear as files under /dev/shm
+SHARED_MEMORY_NAME = "merrin"
+SHARED_MEMORY_DIR = "/dev/shm"
+
+# Size of the segment in bytes, enough for the snapshot of a machine with thousands of cores
+SHARED_MEMORY_SIZE = 64 * 1024
+
+# Viewers stop trusting the daemon once this many collection intervals pass without a snapshot
+SHARED_MEMORY_STALE_INTERVALS = 3
+
+# A segment that was never published to is only replaced by a new daemon after this many
+# seconds, so a daemon still running its first collection isn't pushed aside
+SHARED_MEMORY_STARTUP_GRACE = 10
+
+# AGENTS
+# How often (in seconds) merrin --agent tries to reach the aggregator again after losing it
+# Sends that take longer than this are also treated as a lost connection
+AGENT_RECONNECT_INTERVAL = 5
+
+# How long (in seconds) merrin --agent waits for a connection to the aggregator, collection
+# pauses for at most this long on every attempt
+AGENT_CONNECT_TIMEOUT = 0.5
+
+# How often (in seconds) merrin --aggregate redraws its grid
+AGGREGATOR_REFRESH_INTERVAL = 1
+
+# Hosts are shown as stale once this many of their collection intervals pass without a snapshot
+AGGREGATOR_STALE_INTERVALS = 3
+
+# RECORDING
+# How many snapshots a --record file holds before the oldest are overwritten
+# Three days at the default one second interval, a few hundred MB on a typical desktop
+RECORDING_CAPACITY = 3 * 24 * 60 * 60
+
+# How far the left and right arrow keys seek during --replay, in seconds
+REPLAY_SEEK_STEP = 60
+
 # GPU MEMORY PATHS
 # These are relative paths under each card directory in DRM_ROOT
 
@@ -66,6 +242,30 @@ GPU_USED_VRAM_PATH = "device/mem_info_vis_vram_used"
 # Total visible VRAM capacity in bytes
 GPU_TOTAL_VRAM_PATH = "device/mem_info_vis_vram_total"
 
+# GTT is system memory the GPU maps through its page tables, used when VRAM runs out
+# and for buffers shared with the CPU, in bytes
+GPU_USED_GTT_PATH = "device/mem_info_gtt_used"
+GPU_TOTAL_GTT_PATH = "device/mem_info_gtt_total"
+
+# Share of the last sampling period the GPU was busy, in percent
+GPU_BUSY_PATH = "device/gpu_busy_percent"
+
+# Shader (sclk) and memory (mclk) clock levels, one per line, the current one marked with *
+# 0: 500Mhz
+# 1: 2100Mhz *
+GPU_SCLK_PATH = "device/pp_dpm_sclk"
+GPU_MCLK_PATH = "device/pp_dpm_mclk"
+
+# The card's hwmon directory, with its board power in microwatts
+# Older kernels report the average over a short window (power1_average), newer ones for
+# some GPUs only the instantaneous value (power1_input)
+GPU_HWMON_PATH = "device/hwmon"
+GPU_POWER_FILES = ("power1_average", "power1_input")
+
+# How often (in seconds) to check DRM_ROOT for cards being added or removed when hotplug
+# events can't be received
+GPU_RESCAN_INTERVAL = 10
+
 # TEMPERATURE SENSOR CONFIGURATION
 """
 HWMON SENSOR NAMING: 
@@ -96,4 +296,46 @@ GPU_SENSOR_NAME = "amdgpu"
 
 # Which GPU temperature to monitor
 # The junction is the hottest temperature measured on the GPU die
-GPU_TEMP_LABEL = "junction" 
\ No newline at end of file
+GPU_TEMP_LABEL = "junction" 
+
+# Chips whose every labelled temperature is shown in the temperature matrix (see temps.py)
+# k10temp reports Tctl and one Tccd per CPU die, amdgpu the edge, junction and memory
+# Add "coretemp" for a column per core on Intel CPUs
+TEMP_MATRIX_CHIPS = ("k10temp", "amdgpu")
+"""
+OTHER HARDWARE:
+merrin probes for each kind of hardware once at startup (see collectors.py) and only reads
+the sensors it found.
+
+INTEL SENSORS:
+- coretemp: CPU temperature sensor for Intel Core and newer architectures, with one
+            "Package id N" label per CPU package and a "Core N" label per core
+
+THERMAL ZONES:
+Boards without a hwmon driver for their CPU, most ARM ones, still report its temperature
+through the kernel's thermal framework. Each /sys/class/thermal/thermal_zoneN has a type
+file naming the sensor and a temp file in millidegrees Celsius.
+
+NVIDIA:
+The proprietary NVIDIA driver doesn't expose VRAM or temperature in sysfs. It ships the
+NVIDIA Management Library (NVML) instead, which nvidia-smi is built on.
+"""
+
+# Intel CPU sensor identification
+CORETEMP_SENSOR_NAME = "coretemp"
+
+# The package temperature is the hottest point across the die, like AMD's Tctl
+CORETEMP_LABEL = "package id 0"
+
+THERMAL_ROOT = "/sys/class/thermal"
+
+# Thermal zone types that measure the CPU, most preferred first
+# x86_pkg_temp is the Intel package sensor, the others are used by ARM boards (the
+# Raspberry Pi reports cpu-thermal) and acpitz is the firmware's own, often coarse, reading
+THERMAL_ZONE_TYPES = ("x86_pkg_temp", "cpu-thermal", "cpu_thermal", "soc_thermal", "acpitz")
+
+# Shared library of NVML, installed with the driver
+NVML_LIBRARY = "libnvidia-ml.so.1"
+
+# Entry point group other packages register collector backends under
+COLLECTOR_PLUGIN_GROUP = "merrin.collectors"
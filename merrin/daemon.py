@@ -0,0 +1,343 @@
+"""
+daemon.py
+
+Headless collector daemon that shares snapshots with any number of viewers.
+
+OVERVIEW:
+When several people run merrin on the same machine, each process reads the same /proc and
+/sys files on its own. In daemon mode (merrin --daemon) one process runs the collectors and
+publishes every snapshot into a POSIX shared memory segment. Viewers started afterwards find
+the segment, map it read-only and draw from it, so collection costs the same whether one or
+twenty viewers are attached. If no daemon is running, viewers collect in-process as usual.
+
+SEGMENT LAYOUT:
+Offset 0       Header (64 bytes): magic, layout version, sequence number, publish time,
+               collection interval, schema length, record length
+Offset 64      Schema (JSON, see codec.py), up to SCHEMA_CAPACITY bytes
+Offset 4160    Latest snapshot record, packed by SnapshotCodec
+
+SEQLOCK:
+The daemon never waits for viewers and viewers never block the daemon. Instead the header
+holds a sequence number that the daemon makes odd before it starts writing and even again
+once it has finished. A viewer copies what it needs, then checks that the sequence number
+was even and unchanged on both sides of the copy. If not, it caught the daemon mid-write
+and simply tries again.
+"""
+
+import mmap
+import os
+import signal
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import merrin.config
+from merrin.codec import Snapshot, SnapshotCodec, decode_schema, encode_schema, schema_of
+from merrin.metrics import get_user
+from merrin.scheduler import build_scheduler
+
+# Identifies a merrin segment and the version of this layout
+MAGIC = b"MRRN"
+LAYOUT_VERSION = 1
+
+# magic, version, sequence, publish time (epoch seconds), interval, schema length, record length
+HEADER = struct.Struct("<4sIQddII")
+HEADER_SIZE = 64
+SEQUENCE = struct.Struct("<Q")
+SEQUENCE_OFFSET = 8
+
+# Space reserved for the schema and the record
+SCHEMA_CAPACITY = 4096
+SCHEMA_OFFSET = HEADER_SIZE
+RECORD_OFFSET = SCHEMA_OFFSET + SCHEMA_CAPACITY
+
+# How many times a viewer retries a read that raced with the daemon
+SEQLOCK_RETRIES = 100
+
+"""
+SnapshotPublisher - Daemon side of the shared memory segment
+@interval: Collection interval in seconds, published so viewers can tell when it went stale
+
+Raises FileExistsError if another daemon is still publishing to the segment.
+"""
+class SnapshotPublisher:
+    def __init__(self, interval):
+        self.interval = interval
+        self.path = os.path.join(merrin.config.SHARED_MEMORY_DIR, merrin.config.SHARED_MEMORY_NAME)
+        try:
+            self.shm = shared_memory.SharedMemory(merrin.config.SHARED_MEMORY_NAME, create=True, size=merrin.config.SHARED_MEMORY_SIZE)
+        except FileExistsError:
+            # Only a segment left behind by a daemon that was killed is replaced
+            if not segment_stale(self.path):
+                raise FileExistsError(f"another merrin daemon is publishing to {self.path}") from None
+            stale = shared_memory.SharedMemory(merrin.config.SHARED_MEMORY_NAME)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(merrin.config.SHARED_MEMORY_NAME, create=True, size=merrin.config.SHARED_MEMORY_SIZE)
+        # Shared memory is created private to our user, but every user's viewer needs to read it
+        os.chmod(self.path, 0o644)
+        # Identifies our segment, so close() never removes one another daemon created since
+        self.inode = os.stat(self.path).st_ino
+
+        self.sequence = 0
+        self.schema = None
+        self.codec = None
+        self.schema_length = 0
+
+    """
+    publish - Write a snapshot into the segment
+    @data: Snapshot dictionary
+    """
+    def publish(self, data):
+        buf = self.shm.buf
+
+        # Odd sequence: write in progress
+        self.sequence += 1
+        SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, self.sequence)
+
+        # The schema only changes when hardware does (or on the first sample)
+        schema = schema_of(data)
+        if schema != self.schema:
+            raw_schema = encode_schema(schema)
+            codec = SnapshotCodec(schema)
+            if len(raw_schema) > SCHEMA_CAPACITY or RECORD_OFFSET + codec.size > len(buf):
+                raise ValueError("snapshot doesn't fit in the shared memory segment, increase SHARED_MEMORY_SIZE")
+            buf[SCHEMA_OFFSET:SCHEMA_OFFSET + len(raw_schema)] = raw_schema
+            self.schema = schema
+            self.codec = codec
+            self.schema_length = len(raw_schema)
+
+        self.codec.pack_into(buf, RECORD_OFFSET, data)
+        HEADER.pack_into(buf, 0, MAGIC, LAYOUT_VERSION, self.sequence, time.time(), self.interval, self.schema_length, self.codec.size)
+
+        # Even sequence: snapshot complete
+        self.sequence += 1
+        SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, self.sequence)
+
+    """
+    close - Detach from and remove the segment
+
+    The segment may already be gone, removed by hand or replaced by a daemon that found ours
+    stale, in which case only our mapping is released.
+    """
+    def close(self):
+        self.shm.close()
+        try:
+            if os.stat(self.path).st_ino == self.inode:
+                self.shm.unlink()
+                return
+        except FileNotFoundError:
+            pass
+        # Not ours to remove, and Python's resource tracker shouldn't remove it at exit either
+        resource_tracker.unregister("/" + merrin.config.SHARED_MEMORY_NAME, "shared_memory")
+
+"""
+segment_stale - Whether a segment was left behind by a daemon that is no longer publishing
+@path: Path of the segment under SHARED_MEMORY_DIR
+
+A segment that was never published to counts as stale once it is older than the startup
+grace period, so a daemon that is still running its first collection isn't replaced.
+
+Return: bool: True if the segment can be replaced
+"""
+def segment_stale(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return True
+    try:
+        if os.fstat(fd).st_size < HEADER_SIZE:
+            return True
+        header = os.pread(fd, HEADER.size, 0)
+        created = os.fstat(fd).st_mtime
+    finally:
+        os.close(fd)
+
+    magic, version, sequence, published, interval, _, _ = HEADER.unpack(header)
+    if magic != MAGIC or version != LAYOUT_VERSION or sequence == 0:
+        return time.time() - created > merrin.config.SHARED_MEMORY_STARTUP_GRACE
+    return time.time() - published > merrin.config.SHARED_MEMORY_STALE_INTERVALS * interval + 1
+
+"""
+SnapshotReader - Viewer side of the shared memory segment
+
+The segment is opened read-only through /dev/shm rather than through SharedMemory, which
+always maps for writing and would need the daemon's user permissions.
+Raises FileNotFoundError if no daemon is running.
+"""
+class SnapshotReader:
+    def __init__(self):
+        path = os.path.join(merrin.config.SHARED_MEMORY_DIR, merrin.config.SHARED_MEMORY_NAME)
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            self.map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        # Schema bytes of the current snapshot, so it is only rebuilt when the schema changes
+        self.raw_schema = None
+        # Snapshot the records are copied into, see codec.py
+        self.snapshot = None
+
+    """
+    read - Copy a consistent snapshot out of the segment
+
+    While the schema stays the same the record is copied straight into the reader's Snapshot,
+    so reading allocates nothing but the decoded values.
+
+    Return: tuple: (sequence, publish time, interval, snapshot dict), or None if the segment
+    hasn't been written yet or a consistent copy couldn't be taken. The dict is the same one
+    every call, updated in place.
+    """
+    def read(self):
+        for _ in range(SEQLOCK_RETRIES):
+            sequence = SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0]
+            if sequence % 2:
+                # The daemon is mid-write
+                time.sleep(0)
+                continue
+
+            magic, version, _, published, interval, schema_length, record_length = HEADER.unpack_from(self.map, 0)
+            with memoryview(self.map) as view:
+                same_schema = self.snapshot is not None and record_length == self.snapshot.codec.size and view[SCHEMA_OFFSET:SCHEMA_OFFSET + schema_length] == self.raw_schema
+            if same_schema:
+                self.snapshot.load(self.map, RECORD_OFFSET)
+            else:
+                # Only decoded once the copy is known to be consistent
+                raw_schema = self.map[SCHEMA_OFFSET:SCHEMA_OFFSET + schema_length]
+                record = self.map[RECORD_OFFSET:RECORD_OFFSET + record_length]
+
+            if SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0] != sequence:
+                continue
+            if magic != MAGIC or version != LAYOUT_VERSION or sequence == 0:
+                return None
+
+            if not same_schema:
+                self.snapshot = Snapshot(SnapshotCodec(decode_schema(raw_schema))).load(record)
+                self.raw_schema = raw_schema
+            return sequence, published, interval, self.snapshot.dict()
+        return None
+
+    """
+    close - Unmap the segment
+    """
+    def close(self):
+        self.map.close()
+
+"""
+SharedSource - Feeds the display from a daemon, with the same interface as Scheduler
+@reader: Attached SnapshotReader
+@update_interval: How often to check for a new snapshot, in seconds
+@tables: Whether the in-process Scheduler collects the process and cgroup tables
+
+If the daemon stops publishing, the source switches to an in-process Scheduler so the
+display keeps working.
+"""
+class SharedSource:
+    def __init__(self, reader, update_interval, tables=True):
+        self.reader = reader
+        self.update_interval = update_interval
+        self.tables = tables
+        self.values = {}
+        self.sequence = None
+        self.published = time.time()
+        self.interval = update_interval
+        self.deadline = time.monotonic()
+        # In-process scheduler, only created if the daemon goes away
+        self.scheduler = None
+        # Passed on to the in-process scheduler, while attached only drawing is timed
+        self.profiler = None
+
+    """
+    stale - Whether the daemon has stopped publishing
+
+    Return: bool: True if no snapshot arrived within a few collection intervals
+    """
+    def stale(self):
+        return time.time() - self.published > merrin.config.SHARED_MEMORY_STALE_INTERVALS * self.interval + 1
+
+    """
+    run_due - Pick up a new snapshot if it's time to check
+
+    Return: bool: True if the values changed
+    """
+    def run_due(self):
+        if self.scheduler is not None:
+            self.scheduler.profiler = self.profiler
+            return self.scheduler.run_due()
+        now = time.monotonic()
+        if now < self.deadline:
+            return False
+        self.deadline = now + self.update_interval
+
+        snapshot = self.reader.read()
+        if snapshot is not None and snapshot[0] != self.sequence:
+            self.sequence, self.published, self.interval, self.values = snapshot
+            # The header should show who is viewing, not who started the daemon
+            self.values["user"] = get_user()
+            return True
+
+        if self.stale():
+            self.reader.close()
+            self.scheduler = build_scheduler(self.update_interval, self.tables)
+            self.values = self.scheduler.values
+            self.scheduler.profiler = self.profiler
+            return self.scheduler.run_due()
+        return False
+
+    """
+    time_until_due - Seconds until the next check, never negative
+    """
+    def time_until_due(self):
+        if self.scheduler is not None:
+            return self.scheduler.time_until_due()
+        return max(0.0, self.deadline - time.monotonic())
+
+"""
+open_source - Attach to a running daemon, or fall back to collecting in-process
+@update_interval: Seconds between updates
+@tables: False to leave the process and cgroup tables out when collecting in-process
+
+Return: SharedSource or Scheduler: Something with run_due, time_until_due and values
+"""
+def open_source(update_interval, tables=True):
+    try:
+        reader = SnapshotReader()
+    except (FileNotFoundError, PermissionError, ValueError):
+        return build_scheduler(update_interval, tables)
+
+    # A segment left behind by a daemon that was killed is ignored
+    snapshot = reader.read()
+    if snapshot is None or time.time() - snapshot[1] > merrin.config.SHARED_MEMORY_STALE_INTERVALS * snapshot[2] + 1:
+        reader.close()
+        return build_scheduler(update_interval, tables)
+    return SharedSource(reader, update_interval, tables)
+
+"""
+run_daemon - Collect metrics and publish them to shared memory until terminated
+@update_interval: Seconds between updates of the frequently changing metrics
+@recorder: Recorder to also save every snapshot to, or None
+@alerts: AlertEngine to evaluate the alert rules over every snapshot, or None
+"""
+def run_daemon(update_interval, recorder=None, alerts=None):
+    # Turn SIGTERM into a normal exit so the segment is removed
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+
+    try:
+        publisher = SnapshotPublisher(update_interval)
+    except OSError as err:
+        print(f"Can't start the daemon: {err}")
+        sys.exit(1)
+    try:
+        # Viewers only receive what the snapshot codec packs, which doesn't include the tables
+        scheduler = build_scheduler(update_interval, tables=False)
+        while True:
+            if scheduler.run_due():
+                publisher.publish(scheduler.values)
+                if recorder is not None:
+                    recorder.write(scheduler.values)
+                if alerts is not None:
+                    alerts.evaluate(scheduler.values)
+            time.sleep(scheduler.time_until_due())
+    finally:
+        publisher.close()
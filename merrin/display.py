@@ -4,107 +4,524 @@ display.py
 Terminal display rendering using the curses library.
 
 OVERVIEW:
-Responsible for handling all visual output for the system monitor. It takes the collected metrics and 
-renders them in a clean, color-coded format. 
+Responsible for handling all visual output for the system monitor. It takes the collected metrics and
+renders them in a clean, color-coded format.
+
+RETAINED-MODE RENDERING:
+Every frame the metrics are turned into a list of rows, each made of a label and a value.
+Rather than clearing the screen and drawing everything again, the Dashboard remembers what
+each row showed last time. Labels are only drawn when the layout changes (a GPU appears, the
+terminal is resized), and a value is only written when its text or color changed. Over a slow
+SSH connection this keeps each refresh down to the handful of characters that actually moved.
 """
 
 import curses
+import locale
 
 import merrin.config
+from merrin.gpu import format_load
+from merrin.profiler import format_summary
+
+# Color pair numbers, initialized once by the Dashboard
+NORMAL_PAIR = 1
+WARNING_PAIR = 2
+
+# WARNING THRESHOLDS
+# Values at or above these are drawn in the warning color, on the dashboard and in the
+# aggregator's grid (see aggregator.py)
+CPU_USAGE_WARNING = 90      # % busy, of the whole CPU or one core
+CPU_TEMP_WARNING = 85       # Celsius, AMD CPUs throttle around 95
+GPU_TEMP_WARNING = 95       # Celsius at the junction, AMD GPUs throttle at 110
+VRAM_WARNING = 95           # % of VRAM in use
+MEMORY_WARNING = 95         # % of RAM in use
+DISK_UTIL_WARNING = 90      # % of the time a disk was busy
+NET_WARNING = 90            # % of the link speed, in the busier direction
+PRESSURE_WARNING = 20       # % of the last 10 seconds some tasks were stalled
 
 """
-print_metrics - Render all system metrics to the terminal
-@stdscr: The curses standard screen object
-@data: Dictionary containing all collected metrics
+heatmap_chars - Pick the heatmap glyphs the terminal can display
+
+Block characters need a UTF-8 locale, otherwise we fall back to plain ASCII.
+
+Return: str: Glyphs ordered from idle to fully busy
+"""
+def heatmap_chars():
+    if locale.getpreferredencoding(False).lower().replace("-", "") == "utf8":
+        return merrin.config.HEATMAP_CHARS
+    return merrin.config.HEATMAP_ASCII_CHARS
+
+"""
+threshold_color - Choose the color for a value based on its warning threshold
+@value: The measured value
+@threshold: Values at or above this are shown as warnings
+@firing: True while an alert on the metric is firing, which keeps it in the warning color
+until the alert resolves, even if the latest value dipped below the threshold
+
+Return: int: curses attribute for the normal or warning color
+"""
+def threshold_color(value, threshold, firing=False):
+    if firing or value >= threshold:
+        return curses.color_pair(WARNING_PAIR)
+    return curses.color_pair(NORMAL_PAIR)
+
+"""
+heatmap_rows - Format per-core utilization as rows of single-character cells
+@cores: List of per-core usage percentages
+@width: Number of cells that fit on one row
+
+Cells wrap at the edge of the terminal, so large core counts take several rows.
+Consecutive cores sharing a color are merged into one segment to keep the number
+of terminal writes low.
+
+Return: list: One tuple of (text, attribute) segments per row
+"""
+def heatmap_rows(cores, width):
+    chars = heatmap_chars()
+    levels = len(chars) - 1
+    rows = []
+
+    for start in range(0, len(cores), width):
+        segments = []
+        run = ""
+        run_color = None
+        for usage in cores[start:start + width]:
+            # Same threshold as the aggregate utilization
+            color = threshold_color(usage, CPU_USAGE_WARNING)
+            if color != run_color and run:
+                segments.append((run, run_color))
+                run = ""
+            run_color = color
+            run += chars[min(levels, int(usage / 100 * levels + 0.5))]
+        if run:
+            segments.append((run, run_color))
+        rows.append(tuple(segments))
+    return rows
+
+"""
+temp_matrix_rows - Lay out every temperature channel as an aligned matrix
+@temps: The 'temps' entry of a snapshot, {chip: {label: degrees}}
+@history: History of the metrics for each channel's peak, or None to leave peaks out
+@width: Terminal width in columns
+
+Every cell is padded to the widest one, so channels line up in columns across chips.
+A chip with more channels than fit on a row wraps onto continuation rows, indented past
+the chip names.
+
+Return: list: One tuple of (text, attribute) segments per row
+"""
+def temp_matrix_rows(temps, history, width):
+    chips = []
+    for chip, channels in temps.items():
+        # GPU chips are held to the GPU threshold, CPU dies to the CPU one
+        threshold = GPU_TEMP_WARNING if merrin.config.GPU_SENSOR_NAME in chip else CPU_TEMP_WARNING
+        cells = []
+        for label, temp in channels.items():
+            peak = None if history is None else history.peak(f"temp:{chip}:{label}")
+            text = f"{label} {temp:.0f}" if peak is None else f"{label} {temp:.0f}/{peak:.0f}"
+            cells.append((text, threshold_color(temp, threshold)))
+        chips.append((chip, cells))
+
+    name_width = max(len(chip) for chip, _ in chips) + 2
+    cell_width = max(len(text) for _, cells in chips for text, _ in cells) + 2
+    per_row = max(1, (width - merrin.config.FIELD_TWO_COL - 1 - name_width) // cell_width)
+    normal = curses.color_pair(NORMAL_PAIR)
+    rows = []
+    for chip, cells in chips:
+        name = chip
+        for start in range(0, len(cells), per_row):
+            segments = [(name.ljust(name_width), normal)]
+            segments += [(text.ljust(cell_width), color) for text, color in cells[start:start + per_row]]
+            rows.append(tuple(segments))
+            name = ""
+    return rows
+
+"""
+sparkline - Draw a metric's history as a row of block characters
+@buckets: Downsampled (minimum, maximum) pairs from History.buckets
+@low: Value drawn as an empty cell
+@high: Value drawn as a full cell
+@threshold: Buckets peaking at or above this are drawn in the warning color
+
+Each character takes the height of its bucket's maximum, so short spikes stay visible.
+
+Return: tuple: (text, attribute) segments
+"""
+def sparkline(buckets, low, high, threshold):
+    chars = heatmap_chars()
+    levels = len(chars) - 1
+    segments = []
+    run = ""
+    run_color = None
+    for _, peak in buckets:
+        color = threshold_color(peak, threshold)
+        if color != run_color and run:
+            segments.append((run, run_color))
+            run = ""
+        run_color = color
+        level = int((peak - low) / (high - low) * levels + 0.5)
+        run += chars[max(0, min(levels, level))]
+    if run:
+        segments.append((run, run_color))
+    return tuple(segments)
+
+"""
+with_history - Add a sparkline to the end of a row's value
+@segments: The row's value segments
+@history: History of the metrics, or None to leave the row as it is
+@key: Metric key in the history
+@width: Terminal width in columns
+@scale: (low, high, threshold) for the graph
+
+The graph starts at SPARKLINE_COL and fills the rest of the row. It's left out when the
+terminal is too narrow to fit a useful one.
+
+Return: tuple: The segments, with the sparkline appended
+"""
+def with_history(segments, history, key, width, scale):
+    graph_width = width - merrin.config.SPARKLINE_COL - 1
+    if history is None or graph_width < merrin.config.SPARKLINE_MIN_WIDTH:
+        return segments
+    buckets = history.buckets(key, graph_width)
+    if not buckets:
+        return segments
+
+    # Pad the value out to the graph column
+    used = merrin.config.FIELD_TWO_COL + sum(len(text) for text, _ in segments)
+    padding = max(1, merrin.config.SPARKLINE_COL - used)
+    return segments + ((" " * padding, curses.color_pair(NORMAL_PAIR)),) + sparkline(buckets, *scale)
 
-After rendering each metric, we increment current_row to move to the next line. This is necessary
-because the number of GPUs (and thus the number of rows the GPU section will take) varies by system. 
 """
-def print_metrics(stdscr, data):
-    current_row = 0
+format_rate - Describe a sampling rate for the header
+@sampling: The 'sampling' entry of a snapshot, see adaptive.py
 
-    #Initialize color pairs for normal and warning states. -1 means use the terminal's default colors
-    curses.init_pair(1, -1, -1) # Normal: default colors
-    curses.init_pair(2, curses.COLOR_RED, -1) # Warning: red text
+Return: str: e.g. "4 Hz (CPU temp rising)" or "every 8 s (idle)"
+"""
+def format_rate(sampling):
+    interval = sampling['interval']
+    text = f"{1 / interval:g} Hz" if interval < 1 else f"every {interval:g} s"
+    if sampling['reason'] is not None:
+        text += f" ({sampling['reason']})"
+    return text
+
+"""
+format_alert - Describe a firing alert for the Alerts row
+@alert: One entry of the 'alerts' entry of a snapshot, see alerts.py
+
+Return: str: e.g. "cpu_hot (cpu_temp ewma 87.3)"
+"""
+def format_alert(alert):
+    return f"{alert['alert']} ({alert['metric']} {alert['stat']} {alert['value']:.1f})"
+
+"""
+build_rows - Turn a metrics snapshot into display rows
+@data: Dictionary containing all collected metrics
+@width: Terminal width in columns
+@history: History of the metrics for sparklines, or None to leave them out
+@profiler: Profiler to show a panel for, or None to leave it out
+
+Each row is a (label, segments) tuple. The label is drawn in bold in the first column and
+the segments, a tuple of (text, attribute) pairs, start at FIELD_TWO_COL. A row without a
+label (the header) starts at column 0. The number of rows varies by system, since every
+GPU gets its own row.
+
+Return: list: The rows, top to bottom
+"""
+def build_rows(data, width, history=None, profiler=None):
+    normal = curses.color_pair(NORMAL_PAIR)
+    rows = []
+    # Metrics with a firing alert, see alerts.py
+    alerting = {alert['metric'] for alert in data.get('alerts') or ()}
 
     # HEADER
-    # Displays username, hostname, and current timestamp 
+    # Displays username, hostname, and current timestamp
     if data['user'] is not None and data['hostname'] is not None:
-        stdscr.addstr(current_row, 0, f"{data['user']}@{data['hostname']} | {data['current_datetime'].month}/{data['current_datetime'].day}/{data['current_datetime'].year} {data['current_datetime'].hour:02}:{data['current_datetime'].minute:02}:{data['current_datetime'].second:02}", curses.A_BOLD)
-        current_row += 1
+        now = data['current_datetime']
+        header = f"{data['user']}@{data['hostname']} | {now.month}/{now.day}/{now.year} {now.hour:02}:{now.minute:02}:{now.second:02}"
+        # With --adaptive, how often snapshots are being taken right now
+        if data.get('sampling') is not None:
+            header += f" | {format_rate(data['sampling'])}"
+        rows.append((None, ((header, curses.A_BOLD),)))
+
+    # ALERTS
+    # Rules that fired and haven't resolved yet, only shown while there are any
+    if data.get('alerts'):
+        rows.append(("Alerts:", ((", ".join(format_alert(alert) for alert in data['alerts']), curses.color_pair(WARNING_PAIR)),)))
 
     # CPU UTILIZATION
-    stdscr.addstr(current_row, 0, "CPU Utilization:", curses.A_BOLD)
     if data['cpu_usage'] is not None:
         # Choose color based on utilization threshold, >=90% is considered heavy load
-        cpu_color = curses.color_pair(1)
-        if data['cpu_usage'] >= 90:
-            cpu_color = curses.color_pair(2)
-        stdscr.addstr(current_row, merrin.config.FIELD_TWO_COL, f"{data['cpu_usage']}%", cpu_color)
-    else: 
-        stdscr.addstr(current_row, merrin.config.FIELD_TWO_COL, "Unavailable")
-    current_row += 1
-    
+        segments = ((f"{data['cpu_usage']}%", threshold_color(data['cpu_usage'], CPU_USAGE_WARNING, 'cpu_usage' in alerting)),)
+        rows.append(("CPU Utilization:", with_history(segments, history, 'cpu_usage', width, (0, 100, CPU_USAGE_WARNING))))
+    else:
+        rows.append(("CPU Utilization:", (("Unavailable", normal),)))
+
+    # CPU MODE SPLIT
+    # Where the busy time went: user space, kernel, waiting on I/O, interrupts, hypervisor
+    if data.get('cpu_modes') is not None:
+        modes = data['cpu_modes']
+        rows.append(("CPU Modes:", ((f"usr {modes['user']:.1f}% sys {modes['system']:.1f}% io {modes['iowait']:.1f}% irq {modes['irq']:.1f}% st {modes['steal']:.1f}%", normal),)))
+
+    # PER-CORE HEATMAP
+    # One character per core, taller blocks mean busier cores
+    if data.get('cpu_cores'):
+        label = "CPU Cores:"
+        for segments in heatmap_rows(data['cpu_cores'], max(1, width - merrin.config.FIELD_TWO_COL - 1)):
+            rows.append((label, segments))
+            # Continuation rows keep the label column blank
+            label = ""
+
     # CPU TEMPERATURE
-    stdscr.addstr(current_row, 0, "CPU Temperature:", curses.A_BOLD)
     if data['cpu_temp'] is not None:
-        # AMD CPUs throttle around 95 celsius, but we warn the user at 85 
-        ct_color = curses.color_pair(1)
-        if data['cpu_temp'] >= 85:
-            ct_color = curses.color_pair(2)
-        stdscr.addstr(current_row, merrin.config.FIELD_TWO_COL, f"{data['cpu_temp']} C", ct_color)
+        # AMD CPUs throttle around 95 celsius, but we warn the user at 85
+        segments = ((f"{data['cpu_temp']} C", threshold_color(data['cpu_temp'], CPU_TEMP_WARNING, 'cpu_temp' in alerting)),)
+        rows.append(("CPU Temperature:", with_history(segments, history, 'cpu_temp', width, (20, 100, CPU_TEMP_WARNING))))
     else:
-        stdscr.addstr(current_row, merrin.config.FIELD_TWO_COL, "Unavailable")
-    current_row += 1
+        rows.append(("CPU Temperature:", (("Unavailable", normal),)))
 
     # GPU VRAM USAGE
-    stdscr.addstr(current_row, 0, "GPU VRAM Usage:", curses.A_BOLD)
     if data['gpu_usage'] is not None:
+        label = "GPU VRAM Usage:"
         # Some systems have multiple GPUs, each gets its own row
         for card, usage in data['gpu_usage'].items():
-            gpu_color = curses.color_pair(1)
             # We warn at >=95% VRAM usage
-            if (usage['used'] / usage['total']) * 100 >= 95:
-                gpu_color = curses.color_pair(2)
-            stdscr.addstr(current_row, merrin.config.FIELD_TWO_COL, f"{card}: {usage['used']} MB / {usage['total']} MB", gpu_color)
-            current_row += 1
-    else: 
-        stdscr.addstr(current_row, merrin.config.FIELD_TWO_COL, "Unavailable")
-        current_row += 1
-    
+            gpu_color = threshold_color((usage['used'] / usage['total']) * 100, VRAM_WARNING, 'vram' in alerting)
+            segments = ((f"{card}: {usage['used']} MB / {usage['total']} MB", gpu_color),)
+            rows.append((label, with_history(segments, history, f"vram:{card}", width, (0, 100, VRAM_WARNING))))
+            label = ""
+    else:
+        rows.append(("GPU VRAM Usage:", (("Unavailable", normal),)))
+
+    # GPU LOAD
+    # Busy share, board power, shader/memory clocks and GTT, whichever the driver reports
+    if data['gpu_usage'] is not None:
+        label = "GPU Load:"
+        for card, usage in data['gpu_usage'].items():
+            load = format_load(usage)
+            if load is not None:
+                rows.append((label, ((f"{card}: {load}", normal),)))
+                label = ""
+
     # GPU TEMPERATURE
-    stdscr.addstr(current_row, 0, "GPU Temperature:", curses.A_BOLD)
     if data['gpu_temp'] is not None:
-        gt_color = curses.color_pair(1)
         # The junction is the hottest spot on the GPU die
         # AMD GPUs typically throttle at 110 celsius at the junction, but we warn at 95
-        if data['gpu_temp'] >= 95:
-            gt_color = curses.color_pair(2)
-        stdscr.addstr(current_row, merrin.config.FIELD_TWO_COL, f"{data['gpu_temp']} C", gt_color)
+        segments = ((f"{data['gpu_temp']} C", threshold_color(data['gpu_temp'], GPU_TEMP_WARNING, 'gpu_temp' in alerting)),)
+        rows.append(("GPU Temperature:", with_history(segments, history, 'gpu_temp', width, (20, 110, GPU_TEMP_WARNING))))
     else:
-        stdscr.addstr(current_row, merrin.config.FIELD_TWO_COL, "Unavailable")
-    current_row += 1
+        rows.append(("GPU Temperature:", (("Unavailable", normal),)))
+
+    # TEMPERATURE MATRIX
+    # Every channel of the CPU and GPU chips (each CCD of an EPYC, a GPU's edge and memory),
+    # current/peak over the history, see temps.py
+    if data.get('temps') is not None:
+        label = "Temperatures:"
+        for segments in temp_matrix_rows(data['temps'], history, width):
+            rows.append((label, segments))
+            label = ""
 
     # RAM USAGE
-    stdscr.addstr(current_row, 0, "RAM:", curses.A_BOLD)
     if data['memory'] is not None:
-        mem_color = curses.color_pair(1)
         # We warn at >=95% RAM usage
         # Linux uses swap (memory on storage devices) when RAM fills, which is substantially slower
-        if (data['memory']['used'] / data['memory']['total']) * 100 >= 95:
-            mem_color = curses.color_pair(2)
-        stdscr.addstr(current_row, merrin.config.FIELD_TWO_COL, f"{data['memory']['used']} MB / {data['memory']['total']} MB", mem_color)
-    else: 
-        stdscr.addstr(current_row, merrin.config.FIELD_TWO_COL, "Unavailable")
-    current_row += 1
+        mem_color = threshold_color((data['memory']['used'] / data['memory']['total']) * 100, MEMORY_WARNING, 'memory' in alerting)
+        segments = ((f"{data['memory']['used']} MB / {data['memory']['total']} MB", mem_color),)
+        rows.append(("RAM:", with_history(segments, history, 'memory', width, (0, 100, MEMORY_WARNING))))
+    else:
+        rows.append(("RAM:", (("Unavailable", normal),)))
+
+    # DISK I/O
+    # Throughput and operations per second for each disk, a disk busy >=90% of the time is saturated
+    if data.get('disk_io') is not None:
+        label = "Disk I/O:"
+        for device, io in data['disk_io'].items():
+            segments = ((f"{device}: R {io['read']:.1f} W {io['write']:.1f} MB/s {io['iops']:.0f} IOPS {io['util']:.0f}%", threshold_color(io['util'], DISK_UTIL_WARNING)),)
+            rows.append((label, with_history(segments, history, f"disk:{device}", width, (0, 100, DISK_UTIL_WARNING))))
+            label = ""
+
+    # NETWORK
+    # Bandwidth for each interface, we warn when either direction uses >=90% of the link speed
+    if data.get('net_io') is not None:
+        label = "Network:"
+        for interface, io in data['net_io'].items():
+            # Link speeds are in megabits (10^6 bits), our MB are 1024 * 1024 bytes
+            busiest = max(io['rx'], io['tx']) * 8 * 1.048576
+            color = threshold_color(busiest / io['speed'] * 100, NET_WARNING) if io['speed'] else normal
+            rows.append((label, ((f"{interface}: rx {io['rx']:.2f} tx {io['tx']:.2f} MB/s", color),)))
+            label = ""
+
+    # PRESSURE STALL
+    # Share of the last 10 seconds that tasks spent waiting for each resource ("some" / "full")
+    # Anything >=20% means work is being held up, whatever CPU% says
+    if data.get('pressure') is not None:
+        segments = []
+        for resource, name in (("cpu", "cpu"), ("memory", "mem"), ("io", "io")):
+            stall = data['pressure'][resource]
+            segments.append((f"{name} {stall['some']:.1f}/{stall['full']:.1f}% ", threshold_color(stall['some'], PRESSURE_WARNING)))
+        rows.append(("Pressure:", tuple(segments)))
 
     # SYSTEM UPTIME
     # Not inherently dangerous to have a high uptime, but it is good to be aware of
-    stdscr.addstr(current_row, 0, "Uptime:", curses.A_BOLD)
     if data['uptime'] is not None:
-        stdscr.addstr(current_row, merrin.config.FIELD_TWO_COL, f"{data['uptime']['hours']} hours, {data['uptime']['minutes']} minutes")
-    else: 
-        stdscr.addstr(current_row, merrin.config.FIELD_TWO_COL, "Unavailable")
+        rows.append(("Uptime:", ((f"{data['uptime']['hours']} hours, {data['uptime']['minutes']} minutes", normal),)))
+    else:
+        rows.append(("Uptime:", (("Unavailable", normal),)))
+
+    # PROCESSES
+    # The busiest processes, like top. Left out when drawing from a daemon or a recording
+    if data.get('processes') is not None:
+        processes = data['processes']
+        sort = "memory" if processes['sort'] == "rss" else "CPU"
+        rows.append(("Processes:", ((f"{processes['count']} running, top {len(processes['top'])} by {sort}", normal),)))
+        rows.append((None, ((f"{'PID':>8} {'USER':<10} {'CPU%':>6} {'RSS MB':>8}  COMMAND", curses.A_BOLD),)))
+        for process in processes['top']:
+            rows.append((None, ((f"{process['pid']:>8} {process['user'][:10]:<10} {process['cpu']:>6.1f} {process['rss']:>8}  {process['command']}", normal),)))
+
+    # CGROUPS
+    # The busiest slices and containers. Left out when drawing from a daemon or a recording
+    if data.get('cgroups') is not None:
+        cgroups = data['cgroups']
+        rows.append(("Cgroups:", ((f"{cgroups['count']} tracked, top {len(cgroups['top'])} by CPU", normal),)))
+        rows.append((None, ((f"{'CPU%':>8} {'MEM MB':>8} {'IO MB/s':>8}  CGROUP", curses.A_BOLD),)))
+        for group in cgroups['top']:
+            cpu, memory, io = ("-" if value is None else value for value in (group['cpu'], group['memory'], group['io']))
+            rows.append((None, ((f"{cpu:>8} {memory:>8} {io:>8}  {group['path']}", normal),)))
+
+    # PROFILE
+    # merrin's own cost per collector and per frame, toggled with 'p'
+    if profiler is not None:
+        rows.append((None, (("", normal),)))
+        for line in format_summary(profiler):
+            rows.append((None, ((line, normal),)))
+
+    return rows
+
+"""
+Dashboard - Retained-mode renderer that only repaints what changed
+@stdscr: The curses standard screen object
+"""
+class Dashboard:
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+
+        #Initialize color pairs for normal and warning states. -1 means use the terminal's default colors
+        curses.init_pair(NORMAL_PAIR, -1, -1) # Normal: default colors
+        curses.init_pair(WARNING_PAIR, curses.COLOR_RED, -1) # Warning: red text
 
-    # Push all buffered changes to the terminal
-    stdscr.refresh()
+        # Labels currently on screen, one per row, None until the first layout
+        self.labels = None
+        # Segments currently on screen, one entry per row
+        self.values = []
+
+    """
+    invalidate - Forget what is on screen so the next render lays everything out again
+
+    Used after a terminal resize, where the old contents can't be trusted.
+    """
+    def invalidate(self):
+        self.labels = None
+
+    """
+    layout - Clear the screen and draw the labels for a new set of rows
+    @labels: One label per row
+    """
+    def layout(self, labels):
+        self.stdscr.erase()
+        for row, label in enumerate(labels):
+            if label:
+                self.put(row, 0, label, curses.A_BOLD)
+        self.labels = labels
+        self.values = [None] * len(labels)
+
+    """
+    put - Write text at a position, ignoring anything that falls off the screen
+    @row: Screen row
+    @column: Screen column
+    @text: Text to write
+    @attr: curses attribute
+
+    Return: bool: False if the position is outside the terminal
+    """
+    def put(self, row, column, text, attr):
+        height, width = self.stdscr.getmaxyx()
+        if row >= height or column >= width:
+            return False
+        try:
+            self.stdscr.addstr(row, column, text[:width - column], attr)
+        except curses.error:
+            # Writing the bottom-right cell moves the cursor off screen and raises, but the
+            # text is still drawn
+            pass
+        return True
+
+    """
+    render - Draw a metrics snapshot, repainting only rows whose value changed
+    @data: Dictionary containing all collected metrics
+    @history: History of the metrics for sparklines, or None
+    @profiler: Profiler to show a panel for, or None
+    """
+    def render(self, data, history=None, profiler=None):
+        width = self.stdscr.getmaxyx()[1]
+        self.render_rows(build_rows(data, width, history, profiler))
+
+    """
+    render_rows - Draw rows of (label, segments), repainting only rows whose value changed
+    @rows: Rows as build_rows returns them, a label of None makes the value start at column 0
+    """
+    def render_rows(self, rows):
+        height, width = self.stdscr.getmaxyx()
+        labels = [label for label, _ in rows]
+        if labels != self.labels:
+            self.layout(labels)
+
+        changed = False
+        for row, (label, segments) in enumerate(rows):
+            # Rows below the bottom of the terminal aren't drawn
+            if row >= height:
+                break
+            if segments == self.values[row]:
+                continue
+            self.values[row] = segments
+            changed = True
+
+            column = 0 if label is None else merrin.config.FIELD_TWO_COL
+            for text, attr in segments:
+                if not self.put(row, column, text, attr):
+                    break
+                column += len(text)
+            # Blank out whatever is left of a longer previous value
+            if column < width:
+                self.stdscr.move(row, column)
+                self.stdscr.clrtoeol()
+
+        # Push all buffered changes to the terminal
+        if changed:
+            self.stdscr.refresh()
+
+# Dashboard used by print_metrics, created on first use
+dashboard = None
+
+"""
+print_metrics - Render all system metrics to the terminal
+@stdscr: The curses standard screen object
+@data: Dictionary containing all collected metrics
+@history: History of the metrics for sparklines, or None to leave them out
+@profiler: Profiler to show a panel for, or None to leave it out
+
+Keeps a Dashboard for the screen between calls, so only changed values are repainted.
+"""
+def print_metrics(stdscr, data, history=None, profiler=None):
+    global dashboard
+    if dashboard is None or dashboard.stdscr is not stdscr:
+        dashboard = Dashboard(stdscr)
+    dashboard.render(data, history, profiler)
+
+"""
+handle_resize - Re-lay out the display after the terminal size changed
+@stdscr: The curses standard screen object
+
+The next print_metrics call clears the screen and draws every row again at the new size.
+"""
+def handle_resize(stdscr):
+    curses.update_lines_cols()
+    if dashboard is not None and dashboard.stdscr is stdscr:
+        dashboard.invalidate()
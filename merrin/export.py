@@ -0,0 +1,137 @@
+"""
+export.py
+
+Streaming export of snapshots for pipelines.
+
+OVERVIEW:
+merrin --format ndjson or merrin --format csv writes every snapshot to standard output
+instead of drawing it, so merrin can be piped into a log shipper, a file or another
+program. curses is never started.
+
+FORMATS:
+ndjson  One JSON object per line, the same dictionary the display draws from, with the time
+        as an ISO 8601 string. Every metric is included, the process and cgroup tables too.
+csv     A header line, then one row per snapshot. The columns are the slots of the snapshot
+        codec (see codec.py), fixed by the first complete snapshot: cores, GPUs, disks and
+        interfaces that appear later are left out, ones that disappear leave empty fields.
+        The process and cgroup tables don't fit in fixed columns and are left out.
+
+WRITING:
+Lines are built in memory and written to the binary stdout buffer, which is flushed once per
+snapshot so a reader sees each one as soon as it's collected. When the reader falls behind,
+the write blocks until it catches up. Collectors are scheduled on a fixed grid (see
+scheduler.py), so deadlines that pass while blocked are skipped rather than queued up, and
+memory use stays the same however slow the reader is. When the reader goes away (head,
+a closed socket), merrin exits quietly instead of printing a broken pipe traceback.
+"""
+
+import datetime
+import json
+import math
+import os
+import sys
+import time
+
+from merrin.codec import SnapshotCodec, schema_of
+
+"""
+json_default - Convert values json doesn't know how to serialize
+
+Return: str: ISO 8601 time for datetimes
+"""
+def json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"can't serialize {type(value).__name__}")
+
+"""
+format_number - Format a slot value for CSV
+
+Return: str: Whole numbers without a decimal point, empty for unavailable values
+"""
+def format_number(value):
+    if math.isnan(value):
+        return ""
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+"""
+NdjsonWriter - Writes each snapshot as one line of JSON
+@out: Binary stream to write to
+"""
+class NdjsonWriter:
+    def __init__(self, out):
+        self.out = out
+
+    """
+    write - Write a snapshot
+    @data: Snapshot dictionary
+    """
+    def write(self, data):
+        self.out.write(json.dumps(data, default=json_default, separators=(",", ":")).encode() + b"\n")
+
+"""
+CsvWriter - Writes each snapshot as one CSV row, with columns from the snapshot codec
+@out: Binary stream to write to
+@wait: False to take the columns from the first snapshot, however incomplete
+
+Like the recorder, the header waits for the first snapshot with per-core CPU usage (the CPU
+sampler needs two runs), or a few snapshots if CPU metrics aren't available at all.
+"""
+class CsvWriter:
+    def __init__(self, out, wait=True):
+        self.out = out
+        self.wait = wait
+        self.codec = None
+        self.skipped = 0
+
+    """
+    write - Write a snapshot, and the header before the first one
+    @data: Snapshot dictionary
+    """
+    def write(self, data):
+        if self.codec is None:
+            if self.wait and data.get("cpu_cores") is None and self.skipped < 2:
+                self.skipped += 1
+                return
+            self.codec = SnapshotCodec(schema_of(data))
+            self.out.write((",".join(self.codec.columns()) + "\n").encode())
+        self.out.write((",".join(map(format_number, self.codec.fill(data))) + "\n").encode())
+
+"""
+reader_gone - Quiet stdout after the reader closed the pipe
+
+Points stdout at /dev/null so the interpreter's own flush at exit doesn't hit the broken
+pipe again and print a traceback.
+"""
+def reader_gone():
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.close(devnull)
+
+# Writer for each --format
+WRITERS = {"ndjson": NdjsonWriter, "csv": CsvWriter}
+
+"""
+run_export - Collect snapshots and write them to stdout until interrupted
+@source: Where snapshots come from, anything with run_due, time_until_due and values
+@fmt: Output format, a key of WRITERS
+@recorder: Recorder to also save every snapshot to, or None
+
+A replayed recording is exported up to its end, then the export stops.
+"""
+def run_export(source, fmt, recorder=None):
+    out = sys.stdout.buffer
+    writer = WRITERS[fmt](out)
+    done = getattr(source, "done", None)
+    try:
+        while done is None or not done():
+            if source.run_due():
+                writer.write(source.values)
+                out.flush()
+                if recorder is not None:
+                    recorder.write(source.values)
+            time.sleep(source.time_until_due())
+    except BrokenPipeError:
+        reader_gone()
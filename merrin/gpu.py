@@ -0,0 +1,320 @@
+"""
+gpu.py
+
+AMD GPU usage from the DRM subsystem.
+
+OVERVIEW:
+The amdgpu driver reports each card's state as files under its device directory,
+/sys/class/drm/cardN/device:
+
+mem_info_vis_vram_used/_total  Visible VRAM in use and available, in bytes
+mem_info_gtt_used/_total       GTT (system memory mapped for the GPU) in use and available
+gpu_busy_percent               Share of the last sampling period the GPU was busy
+pp_dpm_sclk, pp_dpm_mclk       Shader and memory clock levels, the current one marked with *
+hwmon/hwmonN/power1_average    Board power in microwatts
+
+Only the VRAM files are needed for a card to be shown. The others depend on the GPU and the
+kernel version, and are reported as unavailable when missing.
+
+TOPOLOGY CACHE:
+DRM_ROOT lists far more than GPUs. Every display connector (card0-DP-1) and render node
+(renderD128) has an entry too, so on a machine with 8 GPUs most of the directory isn't a
+card at all. Rather than listing it and trying every entry each frame, the cards are found
+once and the files of each are kept open as PseudoFiles, so a frame is one pread() per file.
+
+HOTPLUG:
+The kernel announces every device being added or removed as a uevent on a netlink socket,
+the same messages udev listens to. The topology subscribes to them and rescans when a DRM
+device comes or goes. The socket is non-blocking, so checking it each frame is a single
+recv() that normally finds nothing. inotify can't be used instead, sysfs never reports the
+entries the kernel creates.
+
+Netlink isn't available everywhere (network namespaces only receive their own devices'
+events, so containers hear nothing). Without it, DRM_ROOT is listed every
+GPU_RESCAN_INTERVAL seconds and the cards are rescanned if it changed. Either way, a card
+whose files stop reading is dropped by a rescan on the next frame.
+"""
+
+import os
+import time
+
+import merrin.config
+import merrin.reader
+from merrin.metrics import refresh_interval
+
+# NETLINK
+# Protocol of the kernel's uevent broadcasts, and its only multicast group
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_GROUP = 1
+# Uevents are a few hundred bytes, the kernel's limit is 2048
+UEVENT_BUFFER_SIZE = 4096
+
+"""
+open_uevents - Subscribe to the kernel's device uevents
+
+Return: socket: Non-blocking netlink socket, or None if uevents can't be received here
+"""
+def open_uevents():
+    # Only imported here, machines without an AMD GPU never need it
+    import socket
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC, NETLINK_KOBJECT_UEVENT)
+    except (OSError, AttributeError):
+        return None
+    try:
+        # Port 0 lets the kernel pick a unique one
+        sock.bind((0, UEVENT_GROUP))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+"""
+open_optional - Open a pseudo-file that not every GPU or kernel has
+
+Return: PseudoFile: The opened file, or None if it doesn't exist
+"""
+def open_optional(path, size=32):
+    try:
+        return merrin.reader.PseudoFile(path, size)
+    except OSError:
+        return None
+
+"""
+read_optional - Read the integer in an optional pseudo-file
+
+Return: int: The value, or None if the file is missing or can't be read
+"""
+def read_optional(pseudo_file):
+    if pseudo_file is None:
+        return None
+    try:
+        pseudo_file.read()
+    except OSError:
+        return None
+    return pseudo_file.int_at(0)
+
+"""
+read_clock - Read the current level of a pp_dpm_sclk or pp_dpm_mclk file
+
+Return: int: Clock in MHz, or None if unavailable
+"""
+def read_clock(pseudo_file):
+    if pseudo_file is None:
+        return None
+    try:
+        pseudo_file.read()
+    except OSError:
+        return None
+    star = pseudo_file.find(b"*")
+    if star == -1:
+        return None
+    # The number after the colon on the marked line
+    colon = pseudo_file.find(b":", pseudo_file.buf.rfind(b"\n", 0, star) + 1)
+    return None if colon == -1 else pseudo_file.int_at(colon + 1)
+
+"""
+Card - The kept-open attribute files of one GPU
+@name: Directory name in DRM_ROOT, e.g. "card0"
+@path: Path of that directory
+
+Raises OSError if the card has no VRAM files, which means it isn't an amdgpu card.
+"""
+class Card:
+    def __init__(self, name, path):
+        self.name = name
+        self.vram_used = merrin.reader.PseudoFile(os.path.join(path, merrin.config.GPU_USED_VRAM_PATH), 32)
+        try:
+            self.vram_total = merrin.reader.PseudoFile(os.path.join(path, merrin.config.GPU_TOTAL_VRAM_PATH), 32)
+        except OSError:
+            self.vram_used.close()
+            raise
+        self.gtt_used = open_optional(os.path.join(path, merrin.config.GPU_USED_GTT_PATH))
+        self.gtt_total = open_optional(os.path.join(path, merrin.config.GPU_TOTAL_GTT_PATH))
+        self.busy = open_optional(os.path.join(path, merrin.config.GPU_BUSY_PATH))
+        # A few hundred bytes with one line per level
+        self.sclk = open_optional(os.path.join(path, merrin.config.GPU_SCLK_PATH), 256)
+        self.mclk = open_optional(os.path.join(path, merrin.config.GPU_MCLK_PATH), 256)
+        self.power = self.find_power(path)
+
+    """
+    find_power - Open the power file in the card's hwmon directory
+
+    Return: PseudoFile: The first of GPU_POWER_FILES found, or None
+    """
+    def find_power(self, path):
+        hwmon_root = os.path.join(path, merrin.config.GPU_HWMON_PATH)
+        try:
+            hwmons = sorted(os.listdir(hwmon_root))
+        except OSError:
+            return None
+        for hwmon in hwmons:
+            for name in merrin.config.GPU_POWER_FILES:
+                power = open_optional(os.path.join(hwmon_root, hwmon, name))
+                if power is not None:
+                    return power
+        return None
+
+    """
+    read - Read every metric of the card
+
+    Return: dict: {'used', 'total', 'gtt_used', 'gtt_total'} in MB, 'busy' in percent,
+    'power' in watts and 'sclk', 'mclk' in MHz, with None for whatever is unavailable.
+    Raises OSError if the VRAM files can't be read, which means the card went away.
+    """
+    def read(self):
+        self.vram_used.read()
+        self.vram_total.read()
+        vram_used = self.vram_used.int_at(0)
+        vram_total = self.vram_total.int_at(0)
+        if vram_used is None or vram_total is None:
+            raise OSError(f"{self.name} reported no VRAM")
+        gtt_used = read_optional(self.gtt_used)
+        gtt_total = read_optional(self.gtt_total)
+        power = read_optional(self.power)
+        return {
+            # Convert from bytes to megabytes
+            "used": vram_used // (1024 ** 2),
+            "total": vram_total // (1024 ** 2),
+            "gtt_used": None if gtt_used is None else gtt_used // (1024 ** 2),
+            "gtt_total": None if gtt_total is None else gtt_total // (1024 ** 2),
+            "busy": read_optional(self.busy),
+            # Microwatts to watts
+            "power": None if power is None else round(power / 1e6, 1),
+            "sclk": read_clock(self.sclk),
+            "mclk": read_clock(self.mclk),
+        }
+
+    """
+    close - Close every kept-open file
+    """
+    def close(self):
+        for pseudo_file in (self.vram_used, self.vram_total, self.gtt_used, self.gtt_total, self.busy, self.sclk, self.mclk, self.power):
+            if pseudo_file is not None:
+                pseudo_file.close()
+
+"""
+GpuTopology - The AMD GPUs in DRM_ROOT, found once and rescanned on hotplug
+"""
+class GpuTopology:
+    def __init__(self):
+        self.cards = []
+        # Entries of DRM_ROOT at the last scan, compared against when there are no uevents
+        self.entries = set()
+        self.last_scan = 0.0
+        # Set when a card's files stopped reading
+        self.stale = False
+        self.uevents = None
+        self.scan()
+        # Nothing to follow on a machine without AMD GPUs, and the backend isn't used there
+        if self.cards:
+            self.uevents = open_uevents()
+
+    """
+    scan - List DRM_ROOT and open the files of every card in it
+    """
+    def scan(self):
+        self.close_cards()
+        self.stale = False
+        self.last_scan = time.monotonic()
+        try:
+            entries = os.listdir(merrin.config.DRM_ROOT)
+        except OSError:
+            entries = []
+        self.entries = set(entries)
+
+        # Connectors (card0-DP-1) and render nodes (renderD128) belong to a card, only
+        # cardN itself has the device files
+        names = [entry for entry in entries if entry.startswith("card") and entry[4:].isdigit()]
+        for name in sorted(names, key=lambda name: int(name[4:])):
+            try:
+                self.cards.append(Card(name, os.path.join(merrin.config.DRM_ROOT, name)))
+            except OSError:
+                continue
+
+    """
+    changed - Check whether cards may have been added or removed since the last scan
+
+    Return: bool: True if a rescan is needed
+    """
+    def changed(self):
+        if self.stale:
+            return True
+        if self.uevents is None:
+            if time.monotonic() - self.last_scan < merrin.config.GPU_RESCAN_INTERVAL:
+                return False
+            self.last_scan = time.monotonic()
+            try:
+                return set(os.listdir(merrin.config.DRM_ROOT)) != self.entries
+            except OSError:
+                return bool(self.entries)
+
+        changed = False
+        while True:
+            try:
+                message = self.uevents.recv(UEVENT_BUFFER_SIZE)
+            except BlockingIOError:
+                return changed
+            except OSError:
+                # The socket's buffer overflowed and events were lost
+                return True
+            # "add@/devices/...\0ACTION=add\0DEVPATH=...\0SUBSYSTEM=drm\0..."
+            # Monitors being plugged in only send "change" events, which don't matter here
+            if message.startswith((b"add@", b"remove@")) and b"\0SUBSYSTEM=drm\0" in message:
+                changed = True
+
+    """
+    collect - Read every card, rescanning first if the topology changed
+
+    Return: dict: {card_name: Card.read()}, or None if there are no GPUs
+    """
+    @refresh_interval(merrin.config.GPU_REFRESH_INTERVAL)
+    def collect(self):
+        if self.changed():
+            self.scan()
+        usage = {}
+        for card in self.cards:
+            try:
+                usage[card.name] = card.read()
+            except OSError:
+                # The card went away, the next frame rescans without it
+                self.stale = True
+        return usage if usage else None
+
+    """
+    close_cards - Close the files of every card
+    """
+    def close_cards(self):
+        for card in self.cards:
+            card.close()
+        self.cards = []
+
+    """
+    close - Close every card and the uevent socket
+    """
+    def close(self):
+        self.close_cards()
+        if self.uevents is not None:
+            self.uevents.close()
+            self.uevents = None
+
+"""
+format_load - Describe a GPU's load, power, clocks and GTT in one line
+@usage: One card's entry of the gpu_usage metric
+
+Return: str: E.g. "87% busy  212.0 W  2100/1000 MHz  GTT 120 / 16000 MB", only with what is
+available, or None if none of it is
+"""
+def format_load(usage):
+    parts = []
+    if usage.get("busy") is not None:
+        parts.append(f"{usage['busy']}% busy")
+    if usage.get("power") is not None:
+        parts.append(f"{usage['power']} W")
+    if usage.get("sclk") is not None or usage.get("mclk") is not None:
+        sclk = "-" if usage.get("sclk") is None else usage["sclk"]
+        mclk = "-" if usage.get("mclk") is None else usage["mclk"]
+        parts.append(f"{sclk}/{mclk} MHz")
+    if usage.get("gtt_used") is not None and usage.get("gtt_total") is not None:
+        parts.append(f"GTT {usage['gtt_used']} / {usage['gtt_total']} MB")
+    return "  ".join(parts) if parts else None
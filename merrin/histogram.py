@@ -0,0 +1,118 @@
+"""
+histogram.py
+
+Fixed-size streaming histogram for percentiles.
+
+OVERVIEW:
+Working out a p99 exactly means keeping every sample and sorting them. Instead, samples are
+counted into buckets whose width grows with the value (log-linear buckets, the same idea as
+HdrHistogram): every power of two is split into 32 equal buckets, so any recorded value is
+known to within about 3%, whether it's 40 nanoseconds or 40 seconds. Recording a sample is a
+bit_length, a shift and an array increment, and memory stays fixed however many samples are
+recorded.
+
+Values must be non-negative integers. Record fractional measurements in a smaller unit (for
+example nanoseconds, or hundredths of a degree).
+"""
+
+import array
+
+# Each power of two is split into 2 ** (SUB_BITS - 1) buckets
+SUB_BITS = 6
+HALF = 1 << (SUB_BITS - 1)
+
+# Enough buckets for any 64-bit value
+BUCKETS = (64 - SUB_BITS + 2) * HALF
+
+"""
+bucket_index - Bucket a value falls into
+@value: Non-negative integer
+
+Values below 2 ** SUB_BITS get a bucket each. Above that, the value is shifted right until
+it fits in SUB_BITS bits, and the shift picks which group of HALF buckets it lands in.
+
+Return: int: Index into the counts array
+"""
+def bucket_index(value):
+    shift = value.bit_length() - SUB_BITS
+    if shift <= 0:
+        return value
+    return shift * HALF + (value >> shift)
+
+"""
+bucket_upper - Largest value that lands in a bucket
+@index: Bucket index
+
+Return: int: Inclusive upper bound of the bucket
+"""
+def bucket_upper(index):
+    if index < 2 * HALF:
+        return index
+    shift = index // HALF - 1
+    return ((index - shift * HALF + 1) << shift) - 1
+
+"""
+Histogram - Streaming log-linear histogram of non-negative integers
+"""
+class Histogram:
+    def __init__(self):
+        self.counts = array.array("Q", bytes(8 * BUCKETS))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    """
+    record - Count a sample
+    @value: Non-negative integer
+    """
+    def record(self, value):
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    """
+    percentile - Value below which a given fraction of samples fall
+    @fraction: Between 0 and 1, e.g. 0.99 for p99
+
+    The answer is the upper bound of the bucket holding that sample, capped at the largest
+    value actually recorded.
+
+    Return: int: The percentile, or None if nothing was recorded
+    """
+    def percentile(self, fraction):
+        if self.count == 0:
+            return None
+        # Rank of the sample we are looking for, counting from 1
+        rank = max(1, int(fraction * self.count + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_upper(index), self.max)
+        return self.max
+
+    """
+    mean - Average of the recorded samples
+
+    Return: float: The mean, or None if nothing was recorded
+    """
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    """
+    reset - Forget every sample
+    """
+    def reset(self):
+        for index in range(BUCKETS):
+            self.counts[index] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
@@ -0,0 +1,247 @@
+"""
+history.py
+
+Recent history of each metric, for drawing sparklines.
+
+OVERVIEW:
+The display only shows the latest value, so a spike that comes and goes between two glances at
+the screen is easy to miss. History keeps the last HISTORY_SECONDS of every graphed metric in a
+ring buffer, and display.py draws a small graph of it next to the value.
+
+RING BUFFERS:
+Each buffer is an array of floats allocated at full size up front. Adding a sample overwrites
+the oldest slot in place, so memory use is fixed no matter how long merrin runs and sampling
+never grows a list or allocates a container.
+
+DOWNSAMPLING:
+An hour of samples at 10 Hz is 36000 values, but a sparkline is only as wide as the space left
+on the terminal row. The samples are split into one bucket per character and each bucket keeps
+its minimum and maximum (min/max bucketing). Unlike averaging, this never hides a spike: a
+single hot sample still sets the height of its character. The min/max of each bucket is taken
+with the builtin min()/max() over array slices, which run in C. Long histories also keep a
+min/max summary of every 64 samples, so downsampling an hour of 10 Hz data reads a few
+hundred summaries instead of every sample.
+"""
+
+import array
+import math
+
+import merrin.config
+
+# Samples summarized by each min/max block of a SampleHistory
+BLOCK_SIZE = 64
+
+"""
+RingBuffer - Fixed-capacity buffer of float samples
+@capacity: Number of samples held before the oldest are overwritten
+"""
+class RingBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.samples = array.array("d", bytes(8 * capacity))
+        # Slot the next sample goes into, and how many slots hold samples
+        self.head = 0
+        self.count = 0
+
+    """
+    append - Add a sample, overwriting the oldest once full
+    @value: The sample
+    """
+    def append(self, value):
+        self.samples[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    """
+    latest - Most recent sample
+
+    Return: float: The sample, or None if the buffer is empty
+    """
+    def latest(self):
+        if self.count == 0:
+            return None
+        return self.samples[self.head - 1]
+
+    """
+    span - Samples between two positions in time order, as array slices
+    @start: Position of the first sample, 0 being the oldest held
+    @end: Position after the last sample
+
+    A range that wraps around the end of the storage comes back as two slices.
+
+    Return: tuple: One or two arrays
+    """
+    def span(self, start, end):
+        oldest = (self.head - self.count) % self.capacity
+        first = (oldest + start) % self.capacity
+        last = first + (end - start)
+        if last <= self.capacity:
+            return (self.samples[first:last],)
+        return (self.samples[first:], self.samples[:last - self.capacity])
+
+    """
+    minimum - Smallest sample between two positions in time order
+    """
+    def minimum(self, start, end):
+        return min(min(part) for part in self.span(start, end) if part)
+
+    """
+    maximum - Largest sample between two positions in time order
+    """
+    def maximum(self, start, end):
+        return max(max(part) for part in self.span(start, end) if part)
+
+"""
+SampleHistory - Samples of one metric, with a coarse min/max summary for fast downsampling
+@capacity: Number of samples held
+
+Alongside the raw samples, every BLOCK_SIZE consecutive samples are summarized by their
+minimum and maximum in two smaller rings. Downsampling a long history then reads the
+summaries (a 64th of the data) and only touches raw samples for the newest, unfinished block.
+"""
+class SampleHistory:
+    def __init__(self, capacity):
+        self.raw = RingBuffer(capacity)
+        blocks = max(1, capacity // BLOCK_SIZE)
+        self.block_min = RingBuffer(blocks)
+        self.block_max = RingBuffer(blocks)
+        # Samples in the block currently being filled
+        self.pending = 0
+
+    """
+    append - Add a sample
+    @value: The sample
+    """
+    def append(self, value):
+        self.raw.append(value)
+        self.pending += 1
+        if self.pending == BLOCK_SIZE:
+            # Summarize the block that was just completed
+            self.block_min.append(self.raw.minimum(self.raw.count - BLOCK_SIZE, self.raw.count))
+            self.block_max.append(self.raw.maximum(self.raw.count - BLOCK_SIZE, self.raw.count))
+            self.pending = 0
+
+    """
+    buckets - Downsample the held samples with min/max bucketing
+    @width: Maximum number of buckets
+
+    When there are fewer samples than width, every sample is its own bucket.
+
+    Return: list: (minimum, maximum) per bucket, oldest first
+    """
+    def buckets(self, width):
+        raw = self.raw
+        count = raw.count
+        if count == 0 or width <= 0:
+            return []
+        width = min(width, count)
+
+        # Short histories are cheap enough to bucket from the raw samples
+        if count <= width * BLOCK_SIZE or self.block_min.count < width:
+            return [(raw.minimum(bucket * count // width, (bucket + 1) * count // width),
+                     raw.maximum(bucket * count // width, (bucket + 1) * count // width))
+                    for bucket in range(width)]
+
+        # Otherwise bucket the block summaries, and fold the unfinished block into the last bucket
+        blocks = self.block_min.count
+        result = []
+        for bucket in range(width):
+            start = bucket * blocks // width
+            end = (bucket + 1) * blocks // width
+            result.append((self.block_min.minimum(start, end), self.block_max.maximum(start, end)))
+        if self.pending:
+            low, high = result[-1]
+            result[-1] = (min(low, raw.minimum(count - self.pending, count)), max(high, raw.maximum(count - self.pending, count)))
+        return result
+
+"""
+History - Ring buffers for every graphed metric
+@update_interval: Seconds between samples, which sets how many samples HISTORY_SECONDS holds
+
+Metrics are keyed by the snapshot key they come from. Percentages of a total (RAM, and VRAM
+per card as "vram:<card>") are graphed instead of the absolute values. Disks are graphed by
+utilization, as "disk:<device>". Every channel of the temperature matrix is kept as
+"temp:<chip>:<label>", for its peak rather than a sparkline.
+"""
+class History:
+    def __init__(self, update_interval):
+        self.capacity = max(1, math.ceil(merrin.config.HISTORY_SECONDS / update_interval))
+        self.buffers = {}
+        # The datetime of the last snapshot recorded, so a redraw without new data isn't recorded twice
+        self.last_sample = None
+
+    """
+    buffer - Ring buffer for a metric, created the first time it is seen
+    """
+    def buffer(self, key):
+        ring = self.buffers.get(key)
+        if ring is None:
+            ring = SampleHistory(self.capacity)
+            self.buffers[key] = ring
+        return ring
+
+    """
+    add - Record one metric value, skipping unavailable ones
+    @repeat: How many samples the value stands for
+    """
+    def add(self, key, value, repeat=1):
+        if value is not None:
+            ring = self.buffer(key)
+            for _ in range(repeat):
+                ring.append(value)
+
+    """
+    record - Add the graphed metrics of a snapshot
+    @data: Snapshot dictionary
+    @repeat: How many update intervals the snapshot stands for, more than one after a longer
+    interval and 0 to leave it out (see adaptive.py)
+    """
+    def record(self, data, repeat=1):
+        if repeat < 1:
+            return
+        sample = data.get('current_datetime')
+        if sample is not None and sample == self.last_sample:
+            return
+        self.last_sample = sample
+
+        self.add('cpu_usage', data.get('cpu_usage'), repeat)
+        self.add('cpu_temp', data.get('cpu_temp'), repeat)
+        self.add('gpu_temp', data.get('gpu_temp'), repeat)
+        memory = data.get('memory')
+        if memory is not None and memory['total']:
+            self.add('memory', memory['used'] / memory['total'] * 100, repeat)
+        for card, usage in (data.get('gpu_usage') or {}).items():
+            if usage['total']:
+                self.add(f"vram:{card}", usage['used'] / usage['total'] * 100, repeat)
+        for device, io in (data.get('disk_io') or {}).items():
+            self.add(f"disk:{device}", io['util'], repeat)
+        for chip, channels in (data.get('temps') or {}).items():
+            for label, temp in channels.items():
+                self.add(f"temp:{chip}:{label}", temp, repeat)
+
+    """
+    buckets - Downsampled history of a metric
+    @key: Metric key
+    @width: Maximum number of buckets
+
+    Return: list: (minimum, maximum) per bucket, empty if the metric has no history
+    """
+    def buckets(self, key, width):
+        ring = self.buffers.get(key)
+        if ring is None:
+            return []
+        return ring.buckets(width)
+
+    """
+    peak - Largest value of a metric over the whole history
+    @key: Metric key
+
+    Read from the block summaries, so it costs a few dozen comparisons however long the
+    history is.
+
+    Return: float: The peak, or None if the metric has no history
+    """
+    def peak(self, key):
+        buckets = self.buckets(key, 1)
+        return buckets[0][1] if buckets else None
@@ -24,10 +24,47 @@ the display layer to show "Unavailable" rather than crashing when
 the files cannot be read.
 """
 
+import array
+import operator
 import os
 import time
 
 import merrin.config
+import merrin.reader
+
+# Number of /proc/stat cpu counters we use (user through steal)
+CPU_STAT_FIELDS = 8
+
+"""
+refresh_interval - Declare how often a collector needs to run
+@seconds: Interval in seconds. None follows the update interval (-u), 0 runs only once.
+
+The scheduler reads the declared interval when the collector is registered, so slow
+changing metrics like uptime aren't gathered on every frame.
+"""
+def refresh_interval(seconds):
+    def declare(collector):
+        collector.refresh_interval = seconds
+        return collector
+    return declare
+
+"""
+get_user - Name of the user running the program
+
+Return: str: Username from the USER environment variable, or None if unset
+"""
+@refresh_interval(0)
+def get_user():
+    return os.environ.get("USER")
+
+"""
+get_hostname - Network name of this machine
+
+Return: str: The hostname reported by uname
+"""
+@refresh_interval(0)
+def get_hostname():
+    return os.uname()[1]
 
 """
 get-uptime - Read system uptime from /proc/uptime
@@ -38,16 +75,18 @@ get-uptime - Read system uptime from /proc/uptime
 
 Return: dict: {'hours': int, 'minutes': int} or None if unavailable
 """
+@refresh_interval(merrin.config.UPTIME_REFRESH_INTERVAL)
 def get_uptime():
     try:
-        with open(merrin.config.PROC_UPTIME_PATH) as f:
-            uptime_str = f.read()
-    except FileNotFoundError:
+        uptime_file = merrin.reader.read_file(merrin.config.PROC_UPTIME_PATH, 64)
+    except OSError:
         return None
     
-    # Extract the first number (total uptime in seconds)
-    uptime_seconds_str = uptime_str.split()[0]
-    uptime_seconds = int(float(uptime_seconds_str))
+    # Extract the whole seconds of the first number (total uptime in seconds)
+    # Parsing stops at the decimal point, so the fraction is dropped like int(float()) would
+    uptime_seconds = uptime_file.int_at(0)
+    if uptime_seconds is None:
+        return None
 
     # Convert to hours and minutes
     hours = int(uptime_seconds / 3600)
@@ -59,30 +98,46 @@ def get_uptime():
     "minutes": minutes,
     }
 
+"""
+get_loadavg - Read the load averages from /proc/loadavg
+
+/proc/loadavg starts with the 1, 5 and 15 minute load averages: the average number of tasks
+running or waiting to run (or waiting on disk). They need no second sample, which makes them
+the fallback when there is no time to measure CPU usage.
+
+Return: tuple: (1 minute, 5 minutes, 15 minutes), or None if unavailable
+"""
+def get_loadavg():
+    try:
+        loadavg = merrin.reader.read_file(merrin.config.PROC_LOADAVG_PATH, 128)
+    except OSError:
+        return None
+    fields = loadavg.buf[:loadavg.length].split()
+    if len(fields) < 3:
+        return None
+    return float(fields[0]), float(fields[1]), float(fields[2])
+
 """
 get_info - Read memory usage statistics from /proc/meminfo
 
+/proc/meminfo has around fifty "Key:   value kB" lines, but we only need two of them.
+Rather than parsing every line, we search the raw buffer for the two keys and parse
+the number after each.
+
 Returns: dict: {'used': int, 'total': int} in MB, or None if unavailable
 """
+@refresh_interval(merrin.config.MEMORY_REFRESH_INTERVAL)
 def get_meminfo():
     try: 
-        with open(merrin.config.PROC_MEMINFO_PATH) as f:
-            lines = f.readlines()
-    except FileNotFoundError:
+        meminfo = merrin.reader.read_file(merrin.config.PROC_MEMINFO_PATH)
+    except OSError:
         return None
     
-    # Parse the file into a dictionary
-    meminfo = {}
-    for line in lines:
-        key, value = line.split(":")
-        # Extract just the numeric value (first element after splitting spaces)
-        meminfo[key.strip()] = int(value.strip().split()[0])
-    
     # Calculate used memory
     # We use MemAvailable here instead of MemFree because the latter doesn't 
     # account for cache/buffers that can be reclaimed
-    total = meminfo.get("MemTotal", 0)
-    available = meminfo.get("MemAvailable", 0)
+    total = meminfo.int_after(b"MemTotal:") or 0
+    available = meminfo.int_after(b"MemAvailable:") or 0
     used = total - available
     used_mb = int(used / 1024)
     total_mb = int(total / 1024)
@@ -90,10 +145,13 @@ def get_meminfo():
     return {"used": used_mb, "total": total_mb}
 
 """
-get_cpu_usage - Calculate cpu utilization percentage by sampling /proc/stat twice
+CpuSampler - Stateful CPU utilization sampler backed by /proc/stat
 
-The first line of proc stat contains many cpu metrics accumulated since boot:
-cpu user nice system idle iowait irq softirq steal guest guest_nice
+The top of /proc/stat contains one line for the whole system followed by one line per
+core, each holding time counters accumulated since boot:
+cpu  user nice system idle iowait irq softirq steal guest guest_nice
+cpu0 user nice system idle iowait irq softirq steal guest guest_nice
+...
 
 CATEGORIES:
 - user: Normal processes in user mode
@@ -106,78 +164,148 @@ CATEGORIES:
 - steal: Time stolen by hypervisor (virtualization)
 
 All of these values are in units of USER_HZ (usually 1/100th of a second).
+guest and guest_nice are already included in user and nice, so they are not summed.
 
 CALCULATING USAGE:
 We total all of these fields to get the total time, then total idle and iowait 
-to get the idle time. Once we have sampled twice and calculated the difference between
-the totals and idle totals, we get the usage percentage through this equation:
+to get the idle time. Usage needs two measurements, so the sampler keeps the counters
+from the previous call and compares them against the current ones:
 usage = 100 * (total_diff - idle_diff) / total_diff
 
+Because the previous snapshot is kept between frames, each call costs a single read
+of /proc/stat and never sleeps. The measurement window is simply the time between
+two calls, which in the main loop is the update interval.
+
+MATRIX LAYOUT:
+All cpu lines are parsed in one batch into a flat array of integers, one row per line
+(row 0 is the aggregate, row N+1 is cpuN). Columns are then taken with strided slices
+(matrix[column::width]), so the per-core math works on whole columns at once instead
+of looping over every core and every field in Python. Parsing 256 cores costs roughly
+one split and one int conversion pass, the same calls a single core needs.
+"""
+class CpuSampler:
+    def __init__(self):
+        # Counters from the previous call, None until the first sample is taken
+        self.prev_matrix = None
+        # Results of the most recent sample
+        # cores: usage percentage for each core, in cpuN order
+        # modes: {mode: array of percentages}, indexed by row like the matrix
+        self.cores = None
+        self.modes = None
+
+    """
+    read_matrix - Read every cpu line of /proc/stat into a flat counter matrix
+
+    Return: tuple: (matrix, width) where matrix is an array of ints and width is the
+    number of counters per row, or None if unavailable
+    """
+    def read_matrix(self):
+        try:
+            # The cpu lines are always first and "intr" always follows them, so the
+            # (very long) rest of the file never needs to fit in the buffer
+            stat = merrin.reader.get_file(merrin.config.PROC_STAT_PATH)
+            stat.read(until=b"\nintr")
+        except OSError:
+            return None
+
+        end = stat.find(b"\nintr")
+        if end == -1:
+            end = stat.length
+        rows = stat.buf.count(b"\ncpu", 0, end) + 1
+        if not stat.buf.startswith(b"cpu"):
+            return None
+
+        # Split every cpu line in one pass, then drop the "cpuN" label of each row
+        fields = stat.view[:end].tobytes().split()
+        width = len(fields) // rows
+        del fields[::width]
+        return array.array("q", map(int, fields)), width - 1
+
+    """
+    sample - Calculate utilization since the previous call
+
+    Updates self.cores and self.modes with the per-core and per-mode breakdown.
+
+    Return: float: Aggregate CPU usage percentage (0-100), or None if unavailable or if
+    this is the first sample (there is nothing to compare against yet)
+    """
+    def sample(self):
+        reading = self.read_matrix()
+        if reading is None:
+            return None
+        matrix, width = reading
+
+        prev = self.prev_matrix
+        self.prev_matrix = matrix
+        # A core being hotplugged changes the shape, so the old baseline is useless
+        if prev is None or len(prev) != len(matrix):
+            return None
+
+        # CALCULATE DELTAS
+        # One subtraction pass over the whole matrix
+        delta = array.array("q", map(operator.sub, matrix, prev))
+        user, nice, system, idle, iowait, irq, softirq, steal = (delta[column::width] for column in range(CPU_STAT_FIELDS))
+
+        # Total time elapsed per row, summed column by column
+        total = list(map(sum, zip(user, nice, system, idle, iowait, irq, softirq, steal)))
+        # Avoid division by zero on rows where no time has elapsed
+        scale = [100 / row_total if row_total else 0.0 for row_total in total]
+
+        # Usage percentage = (active time / total time) * 100
+        # Active time = total time - idle time
+        busy = map(operator.sub, total, map(operator.add, idle, iowait))
+        usage = [round(value, 2) for value in map(operator.mul, busy, scale)]
+
+        self.modes = {
+            "user": array.array("d", map(operator.mul, map(operator.add, user, nice), scale)),
+            "system": array.array("d", map(operator.mul, system, scale)),
+            "iowait": array.array("d", map(operator.mul, iowait, scale)),
+            "irq": array.array("d", map(operator.mul, map(operator.add, irq, softirq), scale)),
+            "steal": array.array("d", map(operator.mul, steal, scale)),
+        }
+        self.cores = usage[1:]
+        return usage[0]
+
+    """
+    mode_split - Aggregate time split between the CPU modes from the latest sample
+
+    Return: dict: {mode: percentage} for user, system, iowait, irq and steal, or None
+    if no sample has been taken yet
+    """
+    def mode_split(self):
+        if self.modes is None:
+            return None
+        return {mode: round(column[0], 2) for mode, column in self.modes.items()}
+
+    """
+    collect - Take a sample and report every CPU metric at once
+
+    Return: dict: {'cpu_usage': float, 'cpu_cores': list, 'cpu_modes': dict}
+    """
+    @refresh_interval(merrin.config.CPU_REFRESH_INTERVAL)
+    def collect(self):
+        usage = self.sample()
+        return {"cpu_usage": usage, "cpu_cores": self.cores, "cpu_modes": self.mode_split()}
+
+"""
+get_cpu_usage - Calculate cpu utilization percentage by sampling /proc/stat twice
+
+This is the blocking, one-shot form of CpuSampler. It waits CPU_USAGE_INTERVAL
+seconds between the two measurements, so it should not be used inside the frame loop.
+
 Return: float: CPU usage percentage (0-100), or None if unavailable
 """
 def get_cpu_usage():
-    # FIRST MEASUREMENT
-    try:
-        with open(merrin.config.PROC_STAT_PATH) as f:
-            lines1 = f.readlines()
-    except FileNotFoundError:
+    sampler = CpuSampler()
+    # The first sample only records a baseline
+    sampler.sample()
+    if sampler.prev_matrix is None:
         return None
-    
-    # Parse the first line after "cpu "
-    # Split by whitespace and convert to float
-    user1 = float(lines1[0].split()[1])
-    nice1 = float(lines1[0].split()[2])
-    system1 = float(lines1[0].split()[3])
-    idle1 = float(lines1[0].split()[4])
-    iowait1 = float(lines1[0].split()[5])
-    irq1 = float(lines1[0].split()[6])
-    softirq1 = float(lines1[0].split()[7])
-    steal1 = float(lines1[0].split()[8])
-
-    # Calcualte totals for first measurement
-    total1 = user1 + nice1 + system1 + idle1 + iowait1 + irq1 + softirq1 + steal1
-    idle_total1 = idle1 + iowait1
 
     # Wait before taking second measurement
     time.sleep(merrin.config.CPU_USAGE_INTERVAL)
 
-    # SECOND MEASUREMENT
-    try:
-        with open(merrin.config.PROC_STAT_PATH) as f:
-            lines2 = f.readlines()
-    except FileNotFoundError:
-        return None
-    
-    # Parse the same values from the second measurement
-    user2 = float(lines2[0].split()[1])
-    nice2 = float(lines2[0].split()[2])
-    system2 = float(lines2[0].split()[3])
-    idle2 = float(lines2[0].split()[4])
-    iowait2 = float(lines2[0].split()[5])
-    irq2 = float(lines2[0].split()[6])
-    softirq2 = float(lines2[0].split()[7])
-    steal2 = float(lines2[0].split()[8])
-
-    # Calculate totals for second measurement
-    total2 = user2 + nice2 + system2 + idle2 + iowait2 + irq2 + softirq2 + steal2
-    idle_total2 = idle2 + iowait2
-
-    # CALCULATE USAGE
-    # Find total time elapsed
-    total_diff = total2 - total1
-
-    # Avoid division by zero
-    if total_diff == 0:
-        return 0.0;
-
-    # Find how much idle time elapsed
-    idle_diff = idle_total2 - idle_total1
-
-    # Usage percentage = (active time / total time) * 100
-    # Active time = total time - idle time
-    usage = round(100 * (total_diff - idle_diff) / total_diff, 2)
-
-    return usage
+    return sampler.sample()
 
 """
 get_gpu_usage - Read GPU VRAM usage for all detected AMD GPUS
@@ -186,39 +314,35 @@ We read from device/mem_info_vis_vram_used and device/mem_info_vis_vram_total,
 these give us the visible VRAM (what is actually available to applications).
 
 Both of these files contain a single integer that is the VRAM size in bytes.
+They are kept open in the shared reader pool, so each call costs one pread() per file.
+
+This is the one-shot form of gpu.GpuTopology, it lists DRM_ROOT and tries every entry on
+each call. Anything that reads GPUs repeatedly should keep a topology instead.
 
 Return: dict: {card_name: {'used': int, 'total': int}} in MB, or None if no GPUs
 """
+@refresh_interval(merrin.config.GPU_REFRESH_INTERVAL)
 def get_gpu_usage():
     gpu_usages = {}
 
+    try:
+        cards = os.listdir(merrin.config.DRM_ROOT)
+    except FileNotFoundError:
+        return None
+
     # Iterate through all entries in the DRM directory
-    for card in os.listdir(merrin.config.DRM_ROOT):
+    for card in cards:
         card_path = os.path.join(merrin.config.DRM_ROOT, card)
 
-        # READ USED VRAM
+        # READ USED AND TOTAL VRAM
+        # Some DRM entries are display connectors without these files. Opening them
+        # fails straight away, so there is no need to check that they exist first.
         try:
-            vram_used_path = os.path.join(card_path, merrin.config.GPU_USED_VRAM_PATH)
-            
-            # Skip if this isn't a GPU card (some DRM entries are display connectors)
-            if not os.path.isfile(vram_used_path):
-                continue
-            with open(vram_used_path) as f:
-                vram_used = int(f.read().strip())
-        except FileNotFoundError:
+            vram_used = merrin.reader.read_file(os.path.join(card_path, merrin.config.GPU_USED_VRAM_PATH), 32).int_at(0)
+            vram_total = merrin.reader.read_file(os.path.join(card_path, merrin.config.GPU_TOTAL_VRAM_PATH), 32).int_at(0)
+        except OSError:
             continue
-
-        # READ TOTAL VRAM
-        try:
-            vram_total_path = os.path.join(card_path, merrin.config.GPU_TOTAL_VRAM_PATH)
-            
-            
-            if not os.path.isfile(vram_total_path):
-                continue
-
-            with open(vram_total_path) as f:
-                vram_total = int(f.read().strip())
-        except FileNotFoundError:
+        if vram_used is None or vram_total is None:
             continue
 
         # Convert from bytes to megabytes
@@ -231,51 +355,412 @@ def get_gpu_usage():
     # Return None if no GPUs were found (empty dict evaluates to False)
     return gpu_usages if gpu_usages else None
 
+"""
+get_pressure - Read pressure stall information from /proc/pressure
+
+Each of /proc/pressure/cpu, memory and io reports how much of the time tasks were stalled
+waiting for that resource:
+some avg10=1.86 avg60=1.92 avg300=1.68 total=18790601
+full avg10=0.00 avg60=0.00 avg300=0.00 total=0
+
+"some" is the share of time at least one task was waiting, "full" the share of time every
+non-idle task was waiting at once, so nothing useful got done. We report the 10 second
+averages. Unlike CPU%, pressure keeps rising once a resource is saturated, which makes it the
+better sign of contention. The kernel only has these files when built with PSI support.
+
+Return: dict: {resource: {'some': percent, 'full': percent}} for cpu, memory and io, or
+None if unavailable
+"""
+@refresh_interval(merrin.config.PRESSURE_REFRESH_INTERVAL)
+def get_pressure():
+    pressure = {}
+    for resource in ("cpu", "memory", "io"):
+        try:
+            psi = merrin.reader.read_file(os.path.join(merrin.config.PROC_PRESSURE_ROOT, resource), 256)
+        except OSError:
+            return None
+        values = {}
+        for kind in ("some", "full"):
+            start = psi.find(kind.encode() + b" avg10=")
+            if start == -1:
+                # Older kernels have no "full" line for cpu
+                values[kind] = 0.0
+                continue
+            start += len(kind) + len(" avg10=")
+            end = psi.find(b" ", start)
+            values[kind] = float(psi.buf[start:end])
+        pressure[resource] = values
+    return pressure
+
+"""
+DiskSampler - Stateful per-device disk throughput sampler backed by /proc/diskstats
+
+Every block device has one line of counters accumulated since boot:
+major minor name reads merged sectors_read ms_reading writes merged sectors_written ms_writing
+in_flight ms_doing_io weighted_ms ...
+
+Like CpuSampler, the counters from the previous call are kept and rates are computed
+from the difference, over the time between calls. Sectors are always 512 bytes here,
+whatever the device's real sector size. Utilization is how much of the elapsed time the
+device had at least one request in flight (ms_doing_io).
+
+FILTERING:
+Partitions would count the same I/O as the disk they belong to, and loop and ram devices
+aren't real hardware, so both are skipped. Whole disks are the ones listed in /sys/block.
+Whether to show a device is decided the first time its name appears and remembered, so
+each call only does a dictionary lookup per line, and devices that appear later (a USB
+drive being plugged in) are picked up without rescanning anything.
+"""
+class DiskSampler:
+    def __init__(self):
+        # {name: bool}, whether each device seen so far is shown
+        self.devices = {}
+        # {name: (reads, sectors read, writes, sectors written, ms doing io)} from the previous call
+        self.prev = {}
+        self.prev_time = None
+
+    """
+    wanted - Decide once whether a device is shown
+    @name: Device name from /proc/diskstats
+    """
+    def wanted(self, name):
+        shown = self.devices.get(name)
+        if shown is None:
+            shown = not name.startswith(merrin.config.DISK_SKIP_PREFIXES)
+            # Partitions have no entry of their own in /sys/block
+            if shown and os.path.isdir(merrin.config.SYS_BLOCK_ROOT):
+                shown = os.path.exists(os.path.join(merrin.config.SYS_BLOCK_ROOT, name))
+            self.devices[name] = shown
+        return shown
+
+    """
+    collect - Read /proc/diskstats and report each disk's rates since the previous call
+
+    Return: dict: {device: {'read': MB/s, 'write': MB/s, 'iops': float, 'util': percent}},
+    or None if unavailable or if this is the first call
+    """
+    @refresh_interval(merrin.config.DISK_REFRESH_INTERVAL)
+    def collect(self):
+        try:
+            diskstats = merrin.reader.read_file(merrin.config.PROC_DISKSTATS_PATH)
+        except OSError:
+            return None
+        now = time.monotonic()
+        elapsed = None if self.prev_time is None else now - self.prev_time
+        self.prev_time = now
+
+        counters = {}
+        rates = {}
+        for line in diskstats.view[:diskstats.length].tobytes().split(b"\n"):
+            fields = line.split()
+            if len(fields) < 14:
+                continue
+            name = fields[2].decode()
+            if not self.wanted(name):
+                continue
+            current = (int(fields[3]), int(fields[5]), int(fields[7]), int(fields[9]), int(fields[12]))
+            counters[name] = current
+
+            previous = self.prev.get(name)
+            # A device seen for the first time has no baseline yet
+            if previous is None or not elapsed:
+                continue
+            reads, sectors_read, writes, sectors_written, io_ms = map(operator.sub, current, previous)
+            rates[name] = {
+                "read": round(sectors_read * 512 / (1024 ** 2) / elapsed, 2),
+                "write": round(sectors_written * 512 / (1024 ** 2) / elapsed, 2),
+                "iops": round((reads + writes) / elapsed, 1),
+                "util": round(min(100.0, io_ms / (elapsed * 10)), 1),
+            }
+
+        # Devices that were removed drop out of the baseline
+        self.prev = counters
+        return rates if rates else None
+
+"""
+NetSampler - Stateful per-interface bandwidth sampler backed by /proc/net/dev
+
+After two header lines, /proc/net/dev has one line per interface:
+name: rx_bytes rx_packets rx_errs rx_drop ... (8 receive counters) tx_bytes tx_packets ...
+
+Rates come from the difference against the previous call, the same way as DiskSampler.
+The link speed of each interface (in Mb/s, from /sys/class/net/<name>/speed) is read the
+first time the interface appears and kept, so bandwidth can be colored against it.
+Virtual interfaces have no link speed.
+"""
+class NetSampler:
+    def __init__(self):
+        # {name: link speed in Mb/s or None}, for every interface seen so far
+        self.speeds = {}
+        # {name: (rx bytes, tx bytes)} from the previous call
+        self.prev = {}
+        self.prev_time = None
+
+    """
+    link_speed - Link speed of an interface, read once
+    @name: Interface name
+
+    Return: int: Speed in Mb/s, or None if the interface doesn't report one
+    """
+    def link_speed(self, name):
+        if name not in self.speeds:
+            speed = None
+            try:
+                with open(os.path.join(merrin.config.SYS_NET_ROOT, name, "speed")) as f:
+                    speed = int(f.read())
+            except (OSError, ValueError):
+                # Virtual interfaces and links that are down refuse the read
+                pass
+            self.speeds[name] = speed if speed is not None and speed > 0 else None
+        return self.speeds[name]
+
+    """
+    collect - Read /proc/net/dev and report each interface's bandwidth since the previous call
+
+    Return: dict: {interface: {'rx': MB/s, 'tx': MB/s, 'speed': Mb/s or None}}, or None if
+    unavailable or if this is the first call
+    """
+    @refresh_interval(merrin.config.NET_REFRESH_INTERVAL)
+    def collect(self):
+        try:
+            netdev = merrin.reader.read_file(merrin.config.PROC_NET_DEV_PATH)
+        except OSError:
+            return None
+        now = time.monotonic()
+        elapsed = None if self.prev_time is None else now - self.prev_time
+        self.prev_time = now
+
+        counters = {}
+        rates = {}
+        # The first two lines are column headers
+        for line in netdev.view[:netdev.length].tobytes().split(b"\n")[2:]:
+            name, _, values = line.partition(b":")
+            fields = values.split()
+            if len(fields) < 16:
+                continue
+            name = name.strip().decode()
+            if name in merrin.config.NET_SKIP_INTERFACES:
+                continue
+            current = (int(fields[0]), int(fields[8]))
+            counters[name] = current
+
+            previous = self.prev.get(name)
+            if previous is None or not elapsed:
+                continue
+            rates[name] = {
+                "rx": round((current[0] - previous[0]) / (1024 ** 2) / elapsed, 2),
+                "tx": round((current[1] - previous[1]) / (1024 ** 2) / elapsed, 2),
+                "speed": self.link_speed(name),
+            }
+
+        self.prev = counters
+        return rates if rates else None
+
+"""
+SensorRegistry - Index of hwmon temperature sensors with kept-open input files
+
+HWMON SENSOR NAMING:
+Each hwmonX directory has a name file identifying the sensor chip, and pairs of
+tempX_label / tempX_input files. Finding a particular reading means listing every
+hwmon directory, reading every name file, then listing the matching directory and
+reading every label until one matches. That's hundreds of syscalls on servers with
+dozens of chips, so we only do it when building the registry.
+
+The registry maps (chip, label) to the tempX_input file and keeps it open as a
+PseudoFile. Reading a sensor is then a single pread() at offset 0, which makes the
+kernel regenerate the value without reopening the file.
+
+The scan also lists every labelled channel of each chip in self.chips, so that collectors
+reading whole chips (see temps.py) don't walk the tree a second time.
+
+RESCANNING:
+The hardware can change underneath us (a GPU driver reloading, a USB sensor being
+unplugged). We rescan when a read fails, and every SENSOR_RESCAN_INTERVAL seconds we
+list HWMON_ROOT to see if chips were added or removed. Each scan increments
+self.generation, so anything built from self.chips can tell when to rebuild.
+"""
+class SensorRegistry:
+    def __init__(self):
+        # {(chip, label): PseudoFile} with chip and label lowercased
+        self.sensors = {}
+        # Cache of get lookups, {(sensor_name, temp_label): (chip, label) or None}
+        self.resolved = {}
+        # [(chip, [(label, input path)])] per hwmon directory in numeric order, labels as
+        # the driver wrote them and channels in tempN order
+        self.chips = []
+        self.generation = 0
+        # hwmon directory names seen during the last scan
+        self.hwmons = set()
+        # Input paths of channels whose last read failed, skipped until the next scan
+        self.unavailable = set()
+        self.last_check = 0.0
+        self.last_scan = 0.0
+        self.scan()
+
+    """
+    scan - Walk HWMON_ROOT and rebuild the sensor index
+    """
+    def scan(self):
+        self.close()
+        self.generation += 1
+        self.last_check = self.last_scan = time.monotonic()
+        try:
+            hwmons = os.listdir(merrin.config.HWMON_ROOT)
+        except FileNotFoundError:
+            return
+        self.hwmons = set(hwmons)
+
+        # hwmon2 before hwmon10, so chips sharing a name are always found in the same order
+        for hwmon in sorted(hwmons, key=lambda hwmon: (len(hwmon), hwmon)):
+            hwmon_path = os.path.join(merrin.config.HWMON_ROOT, hwmon)
+
+            # IDENTIFY SENSOR CHIP
+            try:
+                with open(os.path.join(hwmon_path, "name")) as f:
+                    name = f.read().strip().lower()
+                entries = os.listdir(hwmon_path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            # Look for temperature label files (tempX_label), temp2 before temp10
+            labels = [entry for entry in entries if entry.startswith("temp") and entry.endswith("_label")]
+            channels = []
+            for entry in sorted(labels, key=lambda entry: (len(entry), entry)):
+                try:
+                    with open(os.path.join(hwmon_path, entry)) as f:
+                        text = f.read().strip()
+                    label = text.lower()
+                    # Replace "_label" with "_input" to get the sensor reading
+                    input_path = os.path.join(hwmon_path, entry.replace("_label", "_input"))
+                    # Two chips with the same name (e.g. two GPUs) report under the first one found
+                    if (name, label) not in self.sensors:
+                        self.sensors[(name, label)] = merrin.reader.PseudoFile(input_path, 32)
+                    channels.append((text, input_path))
+                except OSError:
+                    continue
+            self.chips.append((name, channels))
+
+    """
+    close - Close every kept-open sensor file
+    """
+    def close(self):
+        for sensor in self.sensors.values():
+            sensor.close()
+        self.sensors = {}
+        self.resolved = {}
+        self.chips = []
+        self.unavailable = set()
+
+    """
+    check_topology - Rescan if hwmon directories appeared or disappeared, or a channel failed
+
+    Only runs once every SENSOR_RESCAN_INTERVAL seconds, so in between frames pay nothing.
+    """
+    def check_topology(self):
+        now = time.monotonic()
+        if now - self.last_check < merrin.config.SENSOR_RESCAN_INTERVAL:
+            return
+        self.last_check = now
+        try:
+            hwmons = set(os.listdir(merrin.config.HWMON_ROOT))
+        except FileNotFoundError:
+            hwmons = set()
+        if hwmons != self.hwmons or self.unavailable:
+            self.scan()
+
+    """
+    mark_unavailable - Record that a channel's read failed and rescan if one is allowed
+    @path: Input path of the channel
+
+    The channel is skipped until the next scan. A chip that was rebound is picked up by an
+    immediate rescan, but one that keeps failing (a GPU asleep, a driver returning EIO) would
+    otherwise rescan every frame, so there is at most one rescan per SENSOR_RESCAN_INTERVAL
+    and check_topology retries the channel after that.
+
+    Return: bool: True if the registry rescanned
+    """
+    def mark_unavailable(self, path):
+        self.unavailable.add(path)
+        if time.monotonic() - self.last_scan < merrin.config.SENSOR_RESCAN_INTERVAL:
+            return False
+        self.scan()
+        return True
+
+    """
+    lookup - Find the indexed sensor matching a chip name and label
+    @sensor_name: Name of the sensor chip (e.g., "k10temp", "amdgpu")
+    @temp_label: Which temperature to read (e.g., "tctl", "junction")
+
+    The chip name is matched as a substring, the label exactly (both case-insensitive).
+
+    Return: tuple: (chip, label) key into self.sensors, or None if not present
+    """
+    def lookup(self, sensor_name, temp_label):
+        query = (sensor_name, temp_label)
+        if query not in self.resolved:
+            self.resolved[query] = None
+            for chip, label in self.sensors:
+                if sensor_name in chip and label == temp_label.lower():
+                    self.resolved[query] = (chip, label)
+                    break
+        return self.resolved[query]
+
+    """
+    read - Read a temperature through the registry
+    @sensor_name: Name of the sensor chip (e.g., "k10temp", "amdgpu")
+    @temp_label: Which temperature to read (e.g., "tctl", "junction")
+
+    Return: float: Temperature in degrees Celsius, or None if not found
+    """
+    @refresh_interval(merrin.config.TEMP_REFRESH_INTERVAL)
+    def read(self, sensor_name, temp_label):
+        self.check_topology()
+        temp_md = self.read_input(sensor_name, temp_label)
+        if temp_md is None:
+            return None
+        # Convert to degrees and round to one decimal place
+        return round(temp_md / 1000.0, 1)
+
+    """
+    read_input - Read the raw tempX_input value of a sensor
+    @sensor_name: Name of the sensor chip
+    @temp_label: Which temperature to read
+
+    Return: int: Temperature in millidegrees Celsius, or None if not found
+    """
+    def read_input(self, sensor_name, temp_label):
+        for _ in range(2):
+            key = self.lookup(sensor_name, temp_label)
+            if key is None:
+                return None
+            sensor = self.sensors[key]
+            if sensor.path in self.unavailable:
+                return None
+            try:
+                sensor.read()
+                temp_md = sensor.int_at(0)
+            except OSError:
+                temp_md = None
+            if temp_md is not None:
+                return temp_md
+            # The sensor went away or the chip was rebound, retry once if the index was rebuilt
+            if not self.mark_unavailable(sensor.path):
+                return None
+        return None
+
 """
 get_temp - Read temperature from a specific sensor in the hwmon subsystem
 @sensor_name: Name of the sensor chip (e.g., "k10temp", "amdgpu")
 @temp_label: Which temperature to read (e.g., "tctl", "junction")
 
+This is the one-shot form of SensorRegistry, it walks the whole hwmon tree on every
+call. Anything that reads temperatures repeatedly should keep a registry instead.
+
 Return: float: Temperature in degrees Celsius, or None if not found
 """
 def get_temp(sensor_name, temp_label):
-    # Iterate through all hardware monitoring devices
-    for hwmon in os.listdir(merrin.config.HWMON_ROOT):
-        hwmon_path = os.path.join(merrin.config.HWMON_ROOT, hwmon)
-
-        # IDENTIFY SENSOR CHIP
-        try:
-            with open(os.path.join(hwmon_path, "name")) as f:
-                name = f.read().strip()
-        except FileNotFoundError:
-            continue
-
-        # Check if this is the sensor that we are looking for
-        if sensor_name in name.lower():
-            # Iterate through all files in this hwmon directory
-            for entry in os.listdir(hwmon_path):
-                # Look for temperature label files (textX_label)
-                if entry.startswith("temp") and entry.endswith("_label"):
-                    label_path = os.path.join(hwmon_path, entry)
-
-                    try:
-                        with open(label_path) as f:
-                            label = f.read().strip()
-                    except FileNotFoundError:
-                        continue
-
-                    # Check if this is the temperature that we want
-                    if label.lower() == temp_label:
-                        # Replace "_label" with "_input" to get the sensor reading
-                        temp_input = entry.replace("_label", "_input")
-                        temp_input_path = os.path.join(hwmon_path, temp_input)
-
-                        try:
-                            with open(temp_input_path) as f:
-                                # Read temperature in millidegrees
-                                temp_md = int(f.read().strip())
-                                # Convert to degrees and round to one decimal place
-                                return round(temp_md / 1000.0, 1)
-                        except FileNotFoundError:
-                            continue
-    return None
\ No newline at end of file
+    registry = SensorRegistry()
+    try:
+        return registry.read(sensor_name, temp_label)
+    finally:
+        registry.close()
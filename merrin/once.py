@@ -0,0 +1,108 @@
+"""
+once.py
+
+Print a single snapshot and exit.
+
+OVERVIEW:
+merrin --once collects every metric one time, prints it and exits, for scripts, shell prompts
+and cron jobs that call merrin many times a day. For those, how long merrin takes to start
+matters more than anything the dashboard does.
+
+COLD START:
+Most of the time a short-lived Python program takes goes into importing modules, not into
+running them. The modes that --once doesn't use are only imported by the branch that runs
+them (see __main__.py), so --once never loads curses, the daemon's shared memory support,
+the recording codec or ctypes. The process and cgroup tables are left out too: each needs a
+full scan of /proc or /sys/fs/cgroup and, like CPU usage, a second one to show anything.
+
+CPU WINDOW:
+CPU usage is the difference between two readings of /proc/stat, so a single snapshot has to
+wait between them. The wait is ONCE_CPU_WINDOW seconds (0.1 by default, or the -u interval),
+and disk and network rates are measured over the same window. With a window of 0 nothing is
+waited for: CPU usage and the rates are unavailable, and the load average stands in.
+"""
+
+import sys
+import time
+
+from merrin.gpu import format_load
+from merrin.metrics import get_loadavg
+from merrin.scheduler import build_scheduler
+
+"""
+format_text - The snapshot as "Label: value" lines, like the dashboard without colors
+
+Return: list: One line per metric, unavailable ones are left out
+"""
+def format_text(data):
+    lines = []
+    if data['user'] is not None and data['hostname'] is not None:
+        lines.append(f"{data['user']}@{data['hostname']} | {data['current_datetime']:%Y-%m-%d %H:%M:%S}")
+    if data.get('cpu_usage') is not None:
+        lines.append(f"CPU Utilization: {data['cpu_usage']}%")
+    if data.get('cpu_modes') is not None:
+        modes = data['cpu_modes']
+        lines.append(f"CPU Modes: usr {modes['user']:.1f}% sys {modes['system']:.1f}% io {modes['iowait']:.1f}% irq {modes['irq']:.1f}% st {modes['steal']:.1f}%")
+    if data.get('loadavg') is not None:
+        lines.append("Load Average: " + " ".join(f"{load:.2f}" for load in data['loadavg']))
+    if data['cpu_temp'] is not None:
+        lines.append(f"CPU Temperature: {data['cpu_temp']} C")
+    if data['gpu_usage'] is not None:
+        for card, usage in data['gpu_usage'].items():
+            lines.append(f"GPU VRAM Usage: {card}: {usage['used']} MB / {usage['total']} MB")
+            load = format_load(usage)
+            if load is not None:
+                lines.append(f"GPU Load: {card}: {load}")
+    if data['gpu_temp'] is not None:
+        lines.append(f"GPU Temperature: {data['gpu_temp']} C")
+    if data.get('temps') is not None:
+        for chip, channels in data['temps'].items():
+            lines.append(f"Temperatures: {chip}: " + " ".join(f"{label} {temp} C" for label, temp in channels.items()))
+    if data['memory'] is not None:
+        lines.append(f"RAM: {data['memory']['used']} MB / {data['memory']['total']} MB")
+    if data.get('disk_io') is not None:
+        for device, io in data['disk_io'].items():
+            lines.append(f"Disk I/O: {device}: R {io['read']:.1f} W {io['write']:.1f} MB/s {io['iops']:.0f} IOPS {io['util']:.0f}%")
+    if data.get('net_io') is not None:
+        for interface, io in data['net_io'].items():
+            lines.append(f"Network: {interface}: rx {io['rx']:.2f} tx {io['tx']:.2f} MB/s")
+    if data.get('pressure') is not None:
+        stalls = (f"{resource} {data['pressure'][resource]['some']:.1f}/{data['pressure'][resource]['full']:.1f}%" for resource in ("cpu", "memory", "io"))
+        lines.append("Pressure: " + " ".join(stalls))
+    if data['uptime'] is not None:
+        lines.append(f"Uptime: {data['uptime']['hours']} hours, {data['uptime']['minutes']} minutes")
+    return lines
+
+"""
+run_once - Collect one snapshot and print it
+@window: Seconds to measure CPU usage and I/O rates over, 0 to not wait at all
+@fmt: None for text, or an export format ("ndjson" or "csv")
+"""
+def run_once(window, fmt=None):
+    scheduler = build_scheduler(window, tables=False)
+    scheduler.run_due()
+    if window > 0:
+        # Collectors that follow the update interval are now due again, the ones with a
+        # longer refresh interval keep their first value
+        time.sleep(window)
+        scheduler.run_due()
+    values = scheduler.values
+    values['loadavg'] = get_loadavg()
+
+    try:
+        if fmt is None:
+            print("\n".join(format_text(values)), flush=True)
+            return
+
+        from merrin.export import CsvWriter, NdjsonWriter
+        if fmt == "csv":
+            # A single snapshot is all there is, so the header can't wait for a complete one
+            writer = CsvWriter(sys.stdout.buffer, wait=False)
+        else:
+            writer = NdjsonWriter(sys.stdout.buffer)
+        writer.write(values)
+        sys.stdout.buffer.flush()
+    except BrokenPipeError:
+        # The reader (head, a prompt that only wanted one line) went away, exit quietly
+        from merrin.export import reader_gone
+        reader_gone()
@@ -0,0 +1,227 @@
+"""
+processes.py
+
+Top-like process table.
+
+OVERVIEW:
+Lists the busiest processes, sorted by CPU usage or resident memory. Each PID has a directory
+under /proc, and a naive table would read /proc/[pid]/stat, status and cmdline for every
+process on every frame. On a build server with 20000 processes that is 60000 opens a frame,
+enough to make merrin the busiest process on the machine.
+
+INCREMENTAL SCANNING:
+The table keeps an entry per process between scans. A process is identified by its PID
+together with its start time (field 22 of stat, in clock ticks since boot), because PIDs are
+reused once a process exits: a new start time under a known PID means a new process, and
+its cached details are thrown away.
+
+Each scan only reads /proc/[pid]/stat, which holds everything that changes: CPU time (utime
+and stime, in clock ticks) and resident set size (in pages). CPU% comes from how many ticks a
+process used since the previous scan. The files are opened relative to a descriptor kept on
+/proc, so the kernel doesn't walk the path from / for every process.
+
+Fields that never change for a process (command line and owner) are only read for the
+PROCESS_LIMIT processes actually shown, the first time they are shown. The command name
+(comm) comes free with stat. Scans run every PROCESS_REFRESH_INTERVAL seconds rather than
+every frame.
+"""
+
+import heapq
+import os
+import pwd
+import time
+
+import merrin.config
+from merrin.metrics import refresh_interval
+
+# Clock ticks per second for stat's CPU times, and bytes per page for its RSS
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+# Positions in stat after the ")" that ends the command name (field numbers in proc(5) minus 3)
+STAT_UTIME = 11
+STAT_STIME = 12
+STAT_STARTTIME = 19
+STAT_RSS = 21
+
+# Largest stat file we expect, the command name is at most 16 bytes so 1 KB is plenty
+STAT_SIZE = 1024
+
+"""
+Process - What the table knows about one process
+"""
+class Process:
+    __slots__ = ("pid", "starttime", "comm", "ticks", "cpu", "rss", "user", "command")
+
+    def __init__(self, pid, starttime, comm):
+        self.pid = pid
+        self.starttime = starttime
+        self.comm = comm
+        # CPU ticks used as of the last scan
+        self.ticks = None
+        self.cpu = 0.0
+        self.rss = 0
+        # Owner and full command line, read the first time the process is shown
+        self.user = None
+        self.command = None
+
+"""
+ProcessTable - Incrementally maintained table of every process
+@limit: How many processes collect() returns, PROCESS_LIMIT if not given
+@sort: 'cpu' or 'rss', what the table is sorted by, PROCESS_SORT if not given
+"""
+class ProcessTable:
+    def __init__(self, limit=None, sort=None):
+        self.limit = merrin.config.PROCESS_LIMIT if limit is None else limit
+        self.sort = merrin.config.PROCESS_SORT if sort is None else sort
+        # {pid: Process}
+        self.processes = {}
+        # Usernames by uid, so the password database is only consulted once per user
+        self.users = {}
+        self.proc_fd = None
+        self.last_scan = None
+
+    """
+    read_stat - Read the changing fields of a process
+    @pid: Process ID, as the name of its /proc directory
+
+    Return: tuple: (comm, fields after the command name), or None if the process is gone
+    """
+    def read_stat(self, pid):
+        try:
+            fd = os.open(f"{pid}/stat", os.O_RDONLY, dir_fd=self.proc_fd)
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            return None
+        try:
+            raw = os.read(fd, STAT_SIZE)
+        except (ProcessLookupError, OSError):
+            return None
+        finally:
+            os.close(fd)
+        # The command name is in parentheses and may itself contain spaces and parentheses
+        close = raw.rfind(b")")
+        if close < 0:
+            return None
+        # Only split as far as the last field we use, stat has over 50
+        return raw[raw.find(b"(") + 1:close], raw[close + 2:].split(None, STAT_RSS + 1)
+
+    """
+    read_details - Read the owner and command line of a process, once
+    @process: Process to fill in
+    """
+    def read_details(self, process):
+        try:
+            uid = os.stat(str(process.pid), dir_fd=self.proc_fd).st_uid
+            fd = os.open(f"{process.pid}/cmdline", os.O_RDONLY, dir_fd=self.proc_fd)
+            try:
+                raw = os.read(fd, 4096)
+            finally:
+                os.close(fd)
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            process.user = "?"
+            process.command = process.comm.decode(errors="replace")
+            return
+
+        user = self.users.get(uid)
+        if user is None:
+            try:
+                user = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                user = str(uid)
+            self.users[uid] = user
+        process.user = user
+
+        # Arguments are separated by NUL bytes, kernel threads have no command line at all
+        # Newlines and tabs inside arguments would break the table, so all whitespace becomes a space
+        command = b" ".join(raw.replace(b"\0", b" ").split())
+        process.command = command.decode(errors="replace") if command else f"[{process.comm.decode(errors='replace')}]"
+
+    """
+    scan - Bring every process up to date
+
+    Return: int: Number of processes running
+    """
+    def scan(self):
+        if self.proc_fd is None:
+            self.proc_fd = os.open(merrin.config.PROC_ROOT, os.O_RDONLY | os.O_DIRECTORY)
+        now = time.monotonic()
+        elapsed = None if self.last_scan is None else now - self.last_scan
+        self.last_scan = now
+
+        seen = {}
+        previous = self.processes
+        with os.scandir(self.proc_fd) as entries:
+            for entry in entries:
+                if not entry.name.isdigit():
+                    continue
+                stat = self.read_stat(entry.name)
+                if stat is None:
+                    continue
+                comm, fields = stat
+                pid = int(entry.name)
+                starttime = int(fields[STAT_STARTTIME])
+
+                process = previous.get(pid)
+                if process is None or process.starttime != starttime:
+                    # New process, or the PID was reused
+                    process = Process(pid, starttime, comm)
+
+                ticks = int(fields[STAT_UTIME]) + int(fields[STAT_STIME])
+                if process.ticks is not None and elapsed:
+                    process.cpu = (ticks - process.ticks) / (elapsed * CLOCK_TICKS) * 100
+                process.ticks = ticks
+                process.rss = int(fields[STAT_RSS]) * PAGE_SIZE
+                seen[pid] = process
+
+        # Processes that exited are dropped along with their cached details
+        self.processes = seen
+        return len(seen)
+
+    """
+    top - The processes with the highest CPU usage or RSS
+
+    Return: list: Up to limit Process objects, with owner and command line filled in
+    """
+    def top(self):
+        if self.sort == "rss":
+            key = lambda process: process.rss
+        else:
+            key = lambda process: process.cpu
+        # A bounded heap, rather than sorting every process to keep a handful
+        top = heapq.nlargest(self.limit, self.processes.values(), key=key)
+        for process in top:
+            if process.command is None:
+                self.read_details(process)
+        return top
+
+    """
+    collect - Scan and summarize the busiest processes for the display
+
+    Return: dict: {'count', 'sort', 'top': list of {'pid', 'user', 'cpu', 'rss', 'command'}}
+    with rss in MB, or None if /proc can't be read
+    """
+    @refresh_interval(merrin.config.PROCESS_REFRESH_INTERVAL)
+    def collect(self):
+        try:
+            count = self.scan()
+        except OSError:
+            return None
+        return {
+            'count': count,
+            'sort': self.sort,
+            'top': [{
+                'pid': process.pid,
+                'user': process.user,
+                'cpu': round(process.cpu, 1),
+                'rss': process.rss // (1024 * 1024),
+                'command': process.command,
+            } for process in self.top()],
+        }
+
+    """
+    close - Close the descriptor kept on /proc
+    """
+    def close(self):
+        if self.proc_fd is not None:
+            os.close(self.proc_fd)
+            self.proc_fd = None
@@ -0,0 +1,145 @@
+"""
+profiler.py
+
+Self-profiling of the collection loop.
+
+OVERVIEW:
+Shows where merrin's own time goes: how long each collector takes, how long drawing takes,
+and how many files each frame opens. Pressing 'p' in the display toggles a panel with the
+numbers, and merrin --profile N runs N frames without a display and prints a summary table.
+
+OVERHEAD:
+Each stage is timed with two perf_counter_ns calls and recorded into a fixed-size histogram
+(see histogram.py), so profiling adds a few microseconds per collector and no memory growth.
+File opens are counted with an audit hook, which the interpreter calls for every open() and
+os.open(). The hook is only installed once profiling is first turned on, and merrin runs
+without it otherwise.
+"""
+
+import sys
+import time
+
+from merrin.histogram import Histogram
+
+# Name of the pseudo-stage that counts files opened per frame
+FILES_STAGE = "files opened"
+
+"""
+Profiler - Per-stage latency histograms and file open counts
+"""
+class Profiler:
+    def __init__(self):
+        # {stage name: Histogram of nanoseconds}, in the order stages were first seen
+        self.stages = {}
+        self.files_per_frame = Histogram()
+        self.frames = 0
+        # Opens seen since the current frame began, None outside a frame
+        self.opened = None
+        sys.addaudithook(self.audit)
+
+    """
+    audit - Audit hook, counts file opens while a frame is in progress
+    """
+    def audit(self, event, args):
+        if event == "open" and self.opened is not None:
+            self.opened += 1
+
+    """
+    record - Add a timing to a stage
+    @stage: Stage name
+    @nanoseconds: How long it took
+    """
+    def record(self, stage, nanoseconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = Histogram()
+            self.stages[stage] = histogram
+        histogram.record(nanoseconds)
+
+    """
+    time - Run a function and record how long it took
+    @stage: Stage name
+    @function: Function to call
+    @args: Arguments to pass
+
+    Return: Whatever the function returned
+    """
+    def time(self, stage, function, *args):
+        start = time.perf_counter_ns()
+        try:
+            return function(*args)
+        finally:
+            self.record(stage, time.perf_counter_ns() - start)
+
+    """
+    begin_frame - Start counting the files a frame opens
+    """
+    def begin_frame(self):
+        self.opened = 0
+
+    """
+    end_frame - Finish a frame started with begin_frame
+    @counted: False to drop the frame, when it turned out nothing was collected
+    """
+    def end_frame(self, counted=True):
+        if self.opened is not None and counted:
+            self.files_per_frame.record(self.opened)
+            self.frames += 1
+        self.opened = None
+
+    """
+    summary - The profile as table rows
+
+    Latencies are converted to microseconds.
+
+    Return: list: (stage, count, p50, p99, max) per stage, then the files-per-frame row
+    """
+    def summary(self):
+        rows = []
+        for stage, histogram in self.stages.items():
+            rows.append((stage, histogram.count, histogram.percentile(0.5) / 1000, histogram.percentile(0.99) / 1000, histogram.max / 1000))
+        if self.files_per_frame.count:
+            files = self.files_per_frame
+            rows.append((FILES_STAGE, files.count, files.percentile(0.5), files.percentile(0.99), files.max))
+        return rows
+
+"""
+format_summary - Lay the profile out as an aligned text table
+@profiler: The profiler to report on
+
+Return: list: Lines of text, a header followed by one line per stage
+"""
+def format_summary(profiler):
+    lines = [f"{'stage':<24}{'count':>8}{'p50 us':>12}{'p99 us':>12}{'max us':>12}"]
+    for stage, count, p50, p99, peak in profiler.summary():
+        if stage == FILES_STAGE:
+            lines.append(f"{stage:<24}{count:>8}{p50:>12}{p99:>12}{peak:>12}")
+        else:
+            lines.append(f"{stage:<24}{count:>8}{p50:>12.1f}{p99:>12.1f}{peak:>12.1f}")
+    return lines
+
+"""
+run_profile - Run frames without a display and print where the time went
+@frames: Number of frames to run
+@scheduler: Scheduler with the collectors to profile
+
+Frames are driven through run_due on the real intervals, exactly as the display would run
+them, so a frame only includes the collectors due on that tick and the count column shows
+how often each one ran. That takes frames times the update interval, so pass a shorter -u
+for a quick profile. Drawing needs a terminal, so it isn't included here, toggle the panel
+with 'p' in the display to see it.
+"""
+def run_profile(frames, scheduler):
+    profiler = Profiler()
+    scheduler.profiler = profiler
+    print(f"Profiling {frames} frames at {scheduler.update_interval:g} second intervals...", flush=True)
+    while profiler.frames < frames:
+        time.sleep(scheduler.time_until_due())
+        profiler.begin_frame()
+        start = time.perf_counter_ns()
+        ran = scheduler.run_due()
+        if ran:
+            profiler.record("frame", time.perf_counter_ns() - start)
+        profiler.end_frame(ran)
+    for line in format_summary(profiler):
+        print(line)
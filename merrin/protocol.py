@@ -0,0 +1,224 @@
+"""
+protocol.py
+
+Wire format between merrin agents and the aggregator.
+
+OVERVIEW:
+An agent (merrin --agent) sends every snapshot it collects to an aggregator (merrin
+--aggregate) over a TCP connection. Snapshots are flattened into slots by the snapshot codec
+(see codec.py), the same way the daemon and the recorder store them, and most slots don't
+change from one snapshot to the next: memory and VRAM totals, idle disks, temperatures
+that moved by less than the sensor's resolution. So after the first snapshot, only the slots
+that changed are sent.
+
+FRAMES:
+Every frame starts with a 5 byte header, the frame type and the length of what follows:
+
+HELLO  Magic, protocol version, the agent's collection interval and the codec schema (JSON,
+       with the hostname). Sent first, and again whenever the schema changes (a disk or GPU
+       appeared), after which the next frame is a FULL one.
+FULL   Every slot, as 64-bit floats.
+DELTA  A bitmap with one bit per slot, set for the slots that changed, then the new values
+       of just those slots as 64-bit floats, in slot order.
+
+Slots are compared by their bit patterns, so a metric that stays unavailable (NaN, which
+never equals itself) isn't resent every time. The timestamp changes with every snapshot, so
+a DELTA is never empty and doubles as a heartbeat. A host whose 48 core usages all changed
+sends around 500 bytes a snapshot, an idle one a few dozen.
+
+TCP delivers frames in order and intact, so no frame is ever resent. If the connection
+drops, the agent starts over with a HELLO.
+"""
+
+import array
+import struct
+
+from merrin.codec import Snapshot, SnapshotCodec, decode_schema, encode_schema, schema_of
+
+# Frame types
+HELLO = 1
+FULL = 2
+DELTA = 3
+
+# type, length of the payload that follows
+FRAME_HEADER = struct.Struct("<BI")
+# magic, protocol version, collection interval in seconds, followed by the schema
+HELLO_HEADER = struct.Struct("<4sHd")
+MAGIC = b"MRRA"
+PROTOCOL_VERSION = 1
+
+# Larger frames are treated as garbage rather than buffered
+MAX_FRAME_SIZE = 1024 * 1024
+
+"""
+frame - Prefix a payload with its frame header
+
+Return: bytes: The complete frame
+"""
+def frame(kind, payload):
+    return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+"""
+DeltaEncoder - Agent side, turns snapshots into frames
+@interval: Collection interval, sent in the HELLO so the aggregator can tell a host went quiet
+@name: Hostname to report instead of the machine's own, or None
+"""
+class DeltaEncoder:
+    def __init__(self, interval, name=None):
+        self.interval = interval
+        self.name = name
+        self.schema = None
+        self.codec = None
+        # Bit patterns of the slots as last sent, None until a FULL frame has gone out
+        self.previous = None
+
+    """
+    encode - Frame a snapshot
+    @data: Snapshot dictionary
+
+    Return: bytes: A HELLO followed by a FULL frame for the first snapshot and after the
+    schema changed, otherwise a DELTA frame
+    """
+    def encode(self, data):
+        frames = b""
+        schema = schema_of(data)
+        if self.name is not None:
+            schema["hostname"] = self.name
+        if schema != self.schema:
+            self.schema = schema
+            self.codec = SnapshotCodec(schema)
+            self.previous = None
+            frames += frame(HELLO, HELLO_HEADER.pack(MAGIC, PROTOCOL_VERSION, self.interval) + encode_schema(schema))
+
+        values = self.codec.fill(data)
+        # The same bytes read as integers, which compare equal for identical NaNs
+        current = array.array("Q")
+        current.frombytes(memoryview(values).cast("B"))
+        if self.previous is None:
+            frames += frame(FULL, values.tobytes())
+        else:
+            previous = self.previous
+            mask = 0
+            changed = array.array("d")
+            for slot in range(len(current)):
+                if current[slot] != previous[slot]:
+                    mask |= 1 << slot
+                    changed.append(values[slot])
+            frames += frame(DELTA, mask.to_bytes((len(current) + 7) // 8, "little") + changed.tobytes())
+        self.previous = current
+        return frames
+
+    """
+    set_interval - Change the collection interval announced to the aggregator
+    @interval: New interval in seconds
+
+    The aggregator only learns the interval from a HELLO, so the next snapshot starts over
+    with a HELLO and a FULL frame.
+    """
+    def set_interval(self, interval):
+        if interval != self.interval:
+            self.interval = interval
+            self.schema = None
+
+"""
+check_schema - Check that a schema from the network has the shape schema_of gives it
+@schema: Decoded HELLO schema
+
+Valid JSON can still be the wrong shape, which SnapshotCodec doesn't check. The core count is
+bounded by what fits in a frame, so a bad HELLO can't make the codec allocate without limit.
+Raises ValueError if the schema is malformed.
+"""
+def check_schema(schema):
+    if not isinstance(schema, dict):
+        raise ValueError("HELLO schema is not an object")
+    cores = schema.get("cores")
+    if type(cores) is not int or not 0 <= cores <= MAX_FRAME_SIZE // 8:
+        raise ValueError("HELLO schema has no valid core count")
+    if not isinstance(schema.get("gpus"), list):
+        raise ValueError("HELLO schema has no GPU list")
+    if not isinstance(schema.get("hostname"), (str, type(None))):
+        raise ValueError("HELLO schema hostname is not a string")
+
+"""
+DeltaDecoder - Aggregator side, rebuilds snapshots from one agent's frames
+
+Every method raises ValueError on a frame that doesn't follow the protocol, after which the
+connection can't be trusted and should be closed.
+"""
+class DeltaDecoder:
+    def __init__(self):
+        self.codec = None
+        self.interval = None
+        # Latest value of every slot, None until the first FULL frame, see codec.py
+        self.current = None
+
+    """
+    hostname - The hostname the agent reported in its HELLO, None before it
+    """
+    def hostname(self):
+        return None if self.codec is None else self.codec.schema.get("hostname")
+
+    """
+    apply - Update the slots from a frame
+    @kind: Frame type
+    @payload: Frame payload
+    """
+    def apply(self, kind, payload):
+        if kind == HELLO:
+            if len(payload) < HELLO_HEADER.size:
+                raise ValueError("short HELLO")
+            magic, version, interval = HELLO_HEADER.unpack_from(payload)
+            if magic != MAGIC or version != PROTOCOL_VERSION:
+                raise ValueError("not a merrin agent, or a different protocol version")
+            schema = decode_schema(payload[HELLO_HEADER.size:])
+            check_schema(schema)
+            try:
+                self.codec = SnapshotCodec(schema)
+            except (KeyError, TypeError, AttributeError) as err:
+                raise ValueError(f"HELLO schema is malformed: {err!r}") from None
+            self.interval = interval
+            self.current = None
+            return
+        if self.codec is None:
+            raise ValueError("snapshot before HELLO")
+
+        if kind == FULL:
+            if len(payload) != self.codec.size:
+                raise ValueError("FULL frame doesn't match the schema")
+            if self.current is None:
+                self.current = Snapshot(self.codec)
+            self.current.load(payload)
+        elif kind == DELTA:
+            if self.current is None:
+                raise ValueError("DELTA before FULL")
+            slots = self.codec.slots
+            mask_size = (slots + 7) // 8
+            mask = int.from_bytes(payload[:mask_size], "little")
+            changed = array.array("d", payload[mask_size:])
+            if mask >> slots or mask.bit_count() != len(changed) or len(payload) != mask_size + 8 * len(changed):
+                raise ValueError("DELTA frame doesn't match the schema")
+            values = self.current.values
+            index = 0
+            while mask:
+                # Lowest set bit first, so slots come out in the order they were sent
+                low = mask & -mask
+                values[low.bit_length() - 1] = changed[index]
+                index += 1
+                mask ^= low
+            self.current.stale = True
+        else:
+            raise ValueError(f"unknown frame type {kind}")
+
+    """
+    snapshot - The agent's latest snapshot
+
+    Only decoded when the slots changed since the last call, so a display refreshing faster
+    than the agents send doesn't decode the same snapshot twice, and decoded in place into
+    the same dictionary every time.
+
+    Return: dict: Snapshot dictionary, or None before the first FULL frame
+    """
+    def snapshot(self):
+        if self.current is None:
+            return None
+        return self.current.dict()
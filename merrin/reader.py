@@ -0,0 +1,156 @@
+"""
+reader.py
+
+Low-overhead reader for /proc and /sys pseudo-files.
+
+OVERVIEW:
+The collectors in metrics.py read the same handful of files on every frame. Opening,
+reading and closing each one, then decoding it into strings and splitting it into
+lists, costs far more than the kernel spends generating the data. This module keeps
+those files open and re-reads them in place.
+
+PREAD ON PSEUDO-FILES:
+Files under /proc and /sys are generated by the kernel when read from the start.
+Calling pread() at offset 0 on an already open descriptor regenerates the content,
+so one descriptor can be reused for the lifetime of the program.
+
+ZERO-COPY PARSING:
+Each file owns a preallocated bytearray that preadv() fills directly. Parsing works
+on memoryview slices of that buffer, and int() accepts those slices as-is, so reading
+a number never builds an intermediate bytes or str object. Collectors search the
+buffer for the fields they need and skip everything else.
+"""
+
+import os
+import re
+
+# Starting buffer size for a pseudo-file, grown automatically for larger files
+DEFAULT_BUFFER_SIZE = 4096
+
+# An optionally signed integer, allowing for leading whitespace
+INT_PATTERN = re.compile(rb"\s*(-?\d+)")
+
+"""
+PseudoFile - A kept-open pseudo-file with a reusable read buffer
+@path: Path to the file
+@size: Initial buffer size in bytes
+
+Raises FileNotFoundError (or another OSError) if the file can't be opened, the same
+way open() would.
+"""
+class PseudoFile:
+    def __init__(self, path, size=DEFAULT_BUFFER_SIZE):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        # Number of valid bytes in buf from the most recent read
+        self.length = 0
+
+    """
+    read - Re-read the file from the start into the buffer
+    @until: Optional marker; once it appears the rest of the file isn't needed
+
+    If the content fills the whole buffer it may have been truncated, so the buffer is
+    doubled and the read repeated. Growing only happens on the first few reads, after
+    that the buffer is large enough and every read is a single syscall.
+
+    Return: memoryview: The valid part of the buffer
+    """
+    def read(self, until=None):
+        while True:
+            self.length = os.preadv(self.fd, [self.buf], 0)
+            if self.length < len(self.buf):
+                break
+            if until is not None and self.buf.find(until) != -1:
+                break
+            # The memoryview must be released before a bytearray can be resized
+            self.view.release()
+            self.buf.extend(bytes(len(self.buf)))
+            self.view = memoryview(self.buf)
+        return self.view[:self.length]
+
+    """
+    find - Locate a byte string in the most recently read content
+    @needle: Bytes to search for
+    @start: Offset to start searching from
+
+    Return: int: Offset of the first match, or -1 if not found
+    """
+    def find(self, needle, start=0):
+        return self.buf.find(needle, start, self.length)
+
+    """
+    int_at - Parse an integer starting at an offset in the buffer
+    @pos: Offset to parse from, leading whitespace is skipped
+
+    Return: int: The parsed value, or None if there is no number at pos
+    """
+    def int_at(self, pos=0):
+        match = INT_PATTERN.match(self.buf, pos, self.length)
+        if match is None:
+            return None
+        return int(self.view[match.start(1):match.end(1)])
+
+    """
+    int_after - Parse the integer that follows a key, e.g. "MemTotal:" in /proc/meminfo
+    @key: Bytes immediately preceding the number
+
+    Return: int: The parsed value, or None if the key isn't present
+    """
+    def int_after(self, key):
+        pos = self.find(key)
+        if pos == -1:
+            return None
+        return self.int_at(pos + len(key))
+
+    """
+    close - Close the underlying descriptor
+    """
+    def close(self):
+        if self.fd is not None:
+            self.view.release()
+            os.close(self.fd)
+            self.fd = None
+
+"""
+FILES - Shared pool of open pseudo-files, keyed by path
+
+Collectors that aren't stateful objects themselves (get_meminfo, get_uptime) keep
+their files here so they are opened once per program run.
+"""
+FILES = {}
+
+"""
+get_file - Fetch a pseudo-file from the shared pool, opening it if needed
+@path: Path to the file
+@size: Initial buffer size if the file has to be opened
+
+Return: PseudoFile: The pooled file. Raises FileNotFoundError if it doesn't exist.
+"""
+def get_file(path, size=DEFAULT_BUFFER_SIZE):
+    pseudo_file = FILES.get(path)
+    if pseudo_file is None:
+        pseudo_file = PseudoFile(path, size)
+        FILES[path] = pseudo_file
+    return pseudo_file
+
+"""
+read_file - Read a pooled pseudo-file, dropping it from the pool if the read fails
+@path: Path to the file
+@size: Initial buffer size if the file has to be opened
+
+A failed read usually means the device behind a /sys file went away. Closing the
+stale descriptor lets the next call reopen the path if it comes back.
+
+Return: PseudoFile: The file with fresh content. Raises OSError if it can't be read.
+"""
+def read_file(path, size=DEFAULT_BUFFER_SIZE):
+    pseudo_file = get_file(path, size)
+    try:
+        pseudo_file.read()
+    except OSError:
+        del FILES[path]
+        pseudo_file.close()
+        raise
+    return pseudo_file
@@ -0,0 +1,337 @@
+"""
+recording.py
+
+Compact on-disk recording of snapshots, and replaying them through the display.
+
+OVERVIEW:
+merrin --record FILE keeps every snapshot in a binary ring file so that what the display
+showed can be looked at again after an incident. merrin --replay FILE plays a recording back
+through the normal curses display.
+
+FILE LAYOUT:
+Offset 0       Header: magic, format version, record size, capacity, records written,
+               schema length
+Offset 64      Schema (JSON, see codec.py) describing the cores, GPUs and host
+Offset 4096    Ring of `capacity` fixed-size records, packed by SnapshotCodec
+
+The file is created at its full size up front and memory-mapped, so recording for days never
+grows the file or merrin's memory. Once the ring is full the oldest record is overwritten.
+The schema is written once, so each record holds only numbers (a few hundred bytes on a
+typical desktop), rather than a line of text per metric.
+
+SEEKING:
+Records are written in time order and the timestamp is the first value of every record.
+Finding the record for a given time is a binary search over the ring, O(log n) reads of a
+single float, no matter how long the recording is.
+"""
+
+import bisect
+import datetime
+import mmap
+import os
+import struct
+import time
+
+import merrin.config
+from merrin.codec import Snapshot, SnapshotCodec, decode_schema, encode_schema, schema_of
+
+# Identifies a merrin recording and the version of this format
+MAGIC = b"MRRC"
+FORMAT_VERSION = 1
+
+# magic, version, record size, capacity, records written, schema length
+HEADER = struct.Struct("<4sIIQQI")
+SCHEMA_OFFSET = 64
+RECORDS_OFFSET = 4096
+TIMESTAMP = struct.Struct("<d")
+
+"""
+Recording - A memory-mapped recording file
+@path: Path to the file
+@mode: "r" to replay an existing recording, "w" to record into it
+
+Use Recording.create to start a new file. Opening an existing file for writing resumes it.
+Raises ValueError if the file isn't a merrin recording.
+"""
+class Recording:
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.writable = mode == "w"
+        fd = os.open(path, os.O_RDWR if self.writable else os.O_RDONLY)
+        try:
+            self.map = mmap.mmap(fd, 0, access=mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+        if len(self.map) < RECORDS_OFFSET:
+            self.map.close()
+            raise ValueError(f"{path} is not a merrin recording")
+        magic, version, self.record_size, self.capacity, self.written, self.schema_length = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.map.close()
+            raise ValueError(f"{path} is not a merrin recording")
+        self.schema = decode_schema(self.map[SCHEMA_OFFSET:SCHEMA_OFFSET + self.schema_length])
+        self.codec = SnapshotCodec(self.schema)
+
+    """
+    create - Make a new, empty recording file
+    @path: Path to the file, replaced if it exists
+    @schema: Schema of the snapshots that will be recorded
+    @capacity: Number of records the ring holds before overwriting the oldest
+
+    Return: Recording: The recording, open for writing
+    """
+    @classmethod
+    def create(cls, path, schema, capacity):
+        raw_schema = encode_schema(schema)
+        if SCHEMA_OFFSET + len(raw_schema) > RECORDS_OFFSET:
+            raise ValueError("schema too large for the recording header")
+        record_size = SnapshotCodec(schema).size
+
+        with open(path, "wb") as f:
+            header = bytearray(RECORDS_OFFSET)
+            HEADER.pack_into(header, 0, MAGIC, FORMAT_VERSION, record_size, capacity, 0, len(raw_schema))
+            header[SCHEMA_OFFSET:SCHEMA_OFFSET + len(raw_schema)] = raw_schema
+            f.write(header)
+            # Extend to the full size without writing the records, the filesystem keeps it sparse
+            f.truncate(RECORDS_OFFSET + capacity * record_size)
+        return cls(path, "w")
+
+    """
+    __len__ - Number of records currently held
+    """
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    """
+    offset - Byte offset of a record
+    @index: Position in time order, 0 being the oldest record held
+
+    Return: int: Offset into the file
+    """
+    def offset(self, index):
+        oldest = self.written % self.capacity if self.written > self.capacity else 0
+        return RECORDS_OFFSET + ((oldest + index) % self.capacity) * self.record_size
+
+    """
+    append - Add a snapshot, overwriting the oldest once the ring is full
+    @data: Snapshot dictionary
+    """
+    def append(self, data):
+        self.codec.pack_into(self.map, RECORDS_OFFSET + (self.written % self.capacity) * self.record_size, data)
+        self.written += 1
+        # The count is updated last, so a reader never sees a record that isn't written yet
+        HEADER.pack_into(self.map, 0, MAGIC, FORMAT_VERSION, self.record_size, self.capacity, self.written, self.schema_length)
+
+    """
+    timestamp - Time a record was taken
+    @index: Position in time order
+
+    Return: float: Epoch seconds
+    """
+    def timestamp(self, index):
+        return TIMESTAMP.unpack_from(self.map, self.offset(index))[0]
+
+    """
+    read - Decode a record
+    @index: Position in time order
+
+    Return: dict: Snapshot dictionary
+    """
+    def read(self, index):
+        return self.codec.unpack_from(self.map, self.offset(index))
+
+    """
+    find - Binary search for the first record taken at or after a time
+    @timestamp: Epoch seconds
+
+    Return: int: Position in time order, len(self) if every record is older
+    """
+    def find(self, timestamp):
+        return bisect.bisect_left(Timestamps(self), timestamp)
+
+    """
+    close - Unmap the file
+    """
+    def close(self):
+        self.map.close()
+
+"""
+Timestamps - Sequence view of a recording's timestamps, so bisect can search it directly
+"""
+class Timestamps:
+    def __init__(self, recording):
+        self.recording = recording
+
+    def __len__(self):
+        return len(self.recording)
+
+    def __getitem__(self, index):
+        return self.recording.timestamp(index)
+
+"""
+Recorder - Appends snapshots to a recording file, creating it on the first usable snapshot
+@path: Path to the file
+
+The schema fixes how many cores are recorded, and the CPU sampler needs two runs before it
+reports per-core usage. So the file is only created once a snapshot has that breakdown, or
+after a few snapshots if the CPU metrics are unavailable altogether. GPUs that appear after
+recording started aren't recorded, ones that disappear are recorded as unavailable, and the
+same goes for disks and network interfaces.
+
+An existing recording with the same layout is resumed rather than replaced, whoever is
+recording. One with a different layout (another machine, or a disk, interface or sensor
+that came or went since) is moved aside to FILE-YYYYmmdd-HHMMSS and a new recording started,
+so recording never stops because of what it found on disk. Raises ValueError straight away
+if the file exists but isn't a recording, and OSError if it can't be written.
+"""
+class Recorder:
+    def __init__(self, path):
+        self.path = path
+        self.recording = None
+        self.skipped = 0
+        # Path the previous recording was moved to, if its layout didn't match
+        self.moved = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            Recording(path, "w").close()
+
+    """
+    write - Record a snapshot
+    @data: Snapshot dictionary
+    """
+    def write(self, data):
+        if self.recording is None:
+            if data.get("cpu_cores") is None and self.skipped < 2:
+                self.skipped += 1
+                return
+            self.recording = self.open(schema_of(data))
+        self.recording.append(data)
+
+    """
+    open - Resume an existing recording with a matching layout, or create a new one
+    @schema: Schema of the snapshots being recorded
+
+    Return: Recording: Open for writing
+    """
+    def open(self, schema):
+        # Never overwrite a file that isn't an empty file or a recording
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return Recording.create(self.path, schema, merrin.config.RECORDING_CAPACITY)
+        recording = Recording(self.path, "w")
+        if layout(recording.schema) == layout(schema):
+            return recording
+        recording.close()
+
+        root, ext = os.path.splitext(self.path)
+        self.moved = f"{root}-{time.strftime('%Y%m%d-%H%M%S')}{ext}"
+        os.rename(self.path, self.moved)
+        return Recording.create(self.path, schema, merrin.config.RECORDING_CAPACITY)
+
+    """
+    close - Close the recording file
+    """
+    def close(self):
+        if self.recording is not None:
+            self.recording.close()
+
+"""
+layout - The part of a schema that decides how records are packed
+
+The user is only shown in the header, so anyone can resume a recording.
+
+Return: dict: The schema without the user
+"""
+def layout(schema):
+    return {key: value for key, value in schema.items() if key != "user"}
+
+"""
+ReplaySource - Plays a recording back, with the same interface as Scheduler
+@recording: Recording to play
+@speed: Playback speed multiplier, 2 plays twice as fast as it was recorded
+@start: Epoch seconds to start from, or None for the beginning
+
+Keys: space pauses, left and right arrows seek by REPLAY_SEEK_STEP seconds.
+"""
+class ReplaySource:
+    def __init__(self, recording, speed=1.0, start=None):
+        self.recording = recording
+        self.speed = speed
+        self.index = 0 if start is None else min(recording.find(start), max(0, len(recording) - 1))
+        self.values = {}
+        # Every record is decoded into the same Snapshot, see codec.py
+        self.snapshot = Snapshot(recording.codec)
+        self.paused = False
+        # Set after seeking, so the new position is shown even while paused
+        self.seeked = False
+        self.deadline = time.monotonic()
+        # Nothing is collected during replay, so a profiler only times drawing
+        self.profiler = None
+
+    """
+    run_due - Show the next record once its time has come
+
+    Return: bool: True if the values changed
+    """
+    def run_due(self):
+        now = time.monotonic()
+        if self.seeked:
+            self.seeked = False
+        elif self.paused or now < self.deadline or self.index >= len(self.recording):
+            return False
+
+        self.values = self.snapshot.load(self.recording.map, self.recording.offset(self.index)).dict()
+        self.index += 1
+        if self.index < len(self.recording):
+            # Wait as long as the recording did between these two snapshots
+            gap = self.recording.timestamp(self.index) - self.recording.timestamp(self.index - 1)
+            self.deadline = now + max(0.0, gap) / self.speed
+        return True
+
+    """
+    time_until_due - Seconds until the next record is due, never negative
+
+    At the end of the recording (or while paused) the last snapshot stays on screen and we
+    only wake up for key presses.
+    """
+    def time_until_due(self):
+        if self.paused or self.index >= len(self.recording):
+            return 1.0
+        return max(0.0, self.deadline - time.monotonic())
+
+    """
+    done - Whether every record has been shown
+
+    Return: bool: True once playback has reached the end of the recording
+    """
+    def done(self):
+        return self.index >= len(self.recording)
+
+    """
+    handle_key - React to replay controls
+    @key: Key code from getch
+    """
+    def handle_key(self, key):
+        # Only replay has keys to handle, recording alongside --daemon or --serve never loads curses
+        import curses
+        if key == ord(' '):
+            self.paused = not self.paused
+            self.deadline = time.monotonic()
+            return
+        if key not in (curses.KEY_LEFT, curses.KEY_RIGHT) or len(self.recording) == 0:
+            return
+
+        # The record on screen is the one before self.index
+        current = self.recording.timestamp(max(0, self.index - 1))
+        step = merrin.config.REPLAY_SEEK_STEP if key == curses.KEY_RIGHT else -merrin.config.REPLAY_SEEK_STEP
+        self.index = min(self.recording.find(current + step), len(self.recording) - 1)
+        # Show the new position straight away, even while paused
+        self.seeked = True
+
+"""
+parse_start - Turn a --start argument into epoch seconds
+@text: Local time as "YYYY-MM-DD HH:MM[:SS]" (or with a T separator)
+
+Return: float: Epoch seconds. Raises ValueError for other formats.
+"""
+def parse_start(text):
+    return datetime.datetime.fromisoformat(text).timestamp()
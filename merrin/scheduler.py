@@ -0,0 +1,237 @@
+"""
+scheduler.py
+
+Per-metric collection scheduling.
+
+OVERVIEW:
+Metrics change at very different rates. CPU usage and temperatures are worth reading
+every frame, uptime only changes once a minute and the hostname never does. Instead of
+gathering everything on every loop, each collector declares its own interval (see
+metrics.refresh_interval) and the scheduler only runs the ones that are due. The latest
+value of every metric is cached, so the display always has a complete snapshot to draw.
+
+DEADLINE HEAP:
+Pending collectors are kept in a heap ordered by their next deadline, so finding what is
+due is a peek at the top rather than a scan of every collector. Deadlines come from the
+monotonic clock and advance by exactly one interval each run, so time spent collecting
+and drawing doesn't accumulate into drift the way sleeping for the interval does.
+
+TICKS:
+Consumers (the display, the daemon, the recorder, exporters) treat every successful
+run_due as a new snapshot. Collectors therefore only run on ticks of the update interval,
+and every collector starts from the same time rather than from whenever it was registered
+(probing hardware between registrations takes a few milliseconds). Collectors sharing an
+interval fall due on the same tick, so each tick produces one complete snapshot instead of
+several partial ones a few milliseconds apart. A collector with a longer interval of its own
+runs on the first tick at or after its deadline.
+"""
+
+import datetime
+import heapq
+import time
+
+from merrin.collectors import register_backends
+from merrin.metrics import CpuSampler, DiskSampler, NetSampler, SensorRegistry, get_hostname, get_meminfo, get_pressure, get_uptime, get_user
+
+"""
+Task - A registered collector and when it next needs to run
+"""
+class Task:
+    def __init__(self, key, collector, args, interval, own_interval=None):
+        # Key in the snapshot, or None if the collector returns a dict of keys
+        self.key = key
+        self.collector = collector
+        self.args = args
+        # Seconds between runs, 0 for collectors that only run once
+        self.interval = interval
+        # The collector's refresh_interval, None if it follows the scheduler's update interval
+        self.own_interval = own_interval
+        # Stage name when profiling, the snapshot key or the collector's name
+        self.name = key if key is not None else collector.__qualname__
+
+    """
+    run - Call the collector and store its result in a snapshot
+    @values: Snapshot dictionary to update
+    """
+    def run(self, values):
+        result = self.collector(*self.args)
+        if self.key is None:
+            values.update(result)
+        else:
+            values[self.key] = result
+
+"""
+Scheduler - Runs collectors when their deadlines come due
+@update_interval: Seconds between runs for collectors that follow the update interval
+"""
+class Scheduler:
+    def __init__(self, update_interval):
+        self.update_interval = update_interval
+        # Heap of (deadline, sequence, task), the sequence breaks ties between equal deadlines
+        self.heap = []
+        self.sequence = 0
+        # Every collector's first deadline, and the next tick of the update interval
+        self.start = time.monotonic()
+        self.next_tick = self.start
+        # Latest value of every metric
+        self.values = {}
+        # Profiler timing each collector, or None when not profiling (see profiler.py)
+        self.profiler = None
+
+    """
+    add - Register a collector
+    @key: Snapshot key for the result, or None if the collector returns a dict of keys
+    @collector: Function to call
+    @args: Arguments to pass to the collector
+
+    The interval is taken from the collector's refresh_interval declaration. Collectors
+    without one follow the update interval. Every collector first runs on the first tick,
+    so they all start on the same grid.
+    """
+    def add(self, key, collector, *args):
+        own_interval = getattr(collector, "refresh_interval", None)
+        interval = self.update_interval if own_interval is None else own_interval
+        self.push(self.start, Task(key, collector, args, interval, own_interval))
+
+    """
+    set_update_interval - Change the update interval while running
+    @update_interval: New interval in seconds
+
+    Collectors that follow the update interval switch to the new one. Those with an interval
+    of their own keep it, but don't run more often than the update interval either, so a
+    longer one really does mean fewer wakeups. Collectors due later than one new interval
+    from now are brought forward, so a shorter interval takes effect straight away instead of
+    after the rest of the old one.
+    """
+    def set_update_interval(self, update_interval):
+        self.update_interval = update_interval
+        now = time.monotonic()
+        # Collectors following the update interval get the same deadline as the tick
+        self.next_tick = min(self.next_tick, now + update_interval)
+        heap = []
+        for deadline, sequence, task in self.heap:
+            if task.own_interval is None:
+                task.interval = update_interval
+            else:
+                task.interval = max(task.own_interval, update_interval)
+            deadline = min(deadline, self.next_tick if task.own_interval is None else now + task.interval)
+            heap.append((deadline, sequence, task))
+        heapq.heapify(heap)
+        self.heap = heap
+
+    """
+    push - Put a task on the heap with the given deadline
+    """
+    def push(self, deadline, task):
+        heapq.heappush(self.heap, (deadline, self.sequence, task))
+        self.sequence += 1
+
+    """
+    run_task - Run one collector, timing it if profiling is on
+    @task: Task to run
+    """
+    def run_task(self, task):
+        if self.profiler is None:
+            task.run(self.values)
+        else:
+            self.profiler.time(task.name, task.run, self.values)
+
+    """
+    run_due - On a tick, run every collector whose deadline has passed
+    @now: Current monotonic time, read from the clock if not given
+
+    Return: bool: True if this was a tick and any metric was collected, once per snapshot
+    """
+    def run_due(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        if now < self.next_tick:
+            return False
+        # The next tick, on the same grid as the collectors' deadlines
+        # An interval of 0 (merrin --once -u 0) ticks on every call
+        if self.update_interval > 0:
+            self.next_tick += self.update_interval
+            if self.next_tick <= now:
+                self.next_tick += (int((now - self.next_tick) / self.update_interval) + 1) * self.update_interval
+        ran = False
+        while self.heap and self.heap[0][0] <= now:
+            deadline, _, task = heapq.heappop(self.heap)
+            self.run_task(task)
+            ran = True
+            if task.interval > 0:
+                # Stay on the original grid, skipping any deadlines missed while we were busy
+                deadline += task.interval
+                if deadline <= now:
+                    deadline += (int((now - deadline) / task.interval) + 1) * task.interval
+                self.push(deadline, task)
+        return ran
+
+    """
+    next_deadline - When the next collector can run
+
+    Return: float: Monotonic time of the first tick at or after the earliest deadline, or
+    None if nothing is scheduled
+    """
+    def next_deadline(self):
+        return max(self.heap[0][0], self.next_tick) if self.heap else None
+
+    """
+    time_until_due - Seconds until the next collector is due, never negative
+
+    Return: float: Seconds to wait, or None if nothing is scheduled
+    """
+    def time_until_due(self):
+        deadline = self.next_deadline()
+        if deadline is None:
+            return None
+        return max(0.0, deadline - time.monotonic())
+
+"""
+get_datetime - Wall clock time for the display header
+
+Return: datetime: The current local time
+"""
+def get_datetime():
+    return datetime.datetime.now()
+
+"""
+build_scheduler - Create a scheduler with every standard collector registered
+@update_interval: Seconds between runs for collectors that follow the update interval
+@tables: False to leave out the process and cgroup tables, which aren't shared by the daemon
+
+The keys match the snapshot dictionary that display.print_metrics expects.
+
+Return: Scheduler: The configured scheduler
+"""
+def build_scheduler(update_interval, tables=True):
+    scheduler = Scheduler(update_interval)
+
+    # The sampler remembers the previous /proc/stat reading, so CPU usage is measured
+    # over the time between runs rather than by sleeping inside the loop.
+    # The first run has no baseline yet and reports as unavailable.
+    cpu_sampler = CpuSampler()
+    # Walk the hwmon tree once, each run then reads the kept-open sensor files
+    sensors = SensorRegistry()
+
+    scheduler.add(None, cpu_sampler.collect)
+    # Temperatures and VRAM come from whichever backends found their hardware, see collectors.py
+    register_backends(scheduler, sensors)
+    scheduler.add('memory', get_meminfo)
+    # Like the CPU sampler, these compare against the previous run's counters
+    scheduler.add('disk_io', DiskSampler().collect)
+    scheduler.add('net_io', NetSampler().collect)
+    scheduler.add('pressure', get_pressure)
+    scheduler.add('uptime', get_uptime)
+    scheduler.add('user', get_user)
+    scheduler.add('hostname', get_hostname)
+    scheduler.add('current_datetime', get_datetime)
+    if tables:
+        # Imported here so modes without the tables (--once, --daemon) don't load them
+        from merrin.cgroups import CgroupTree
+        from merrin.processes import ProcessTable
+
+        # Keeps an entry per process between scans, see processes.py
+        scheduler.add('processes', ProcessTable().collect)
+        # Walks the cgroup tree once, then follows changes through inotify, see cgroups.py
+        scheduler.add('cgroups', CgroupTree().collect)
+    return scheduler
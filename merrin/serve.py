@@ -0,0 +1,261 @@
+"""
+serve.py
+
+OpenMetrics exporter for Prometheus-compatible scrapers.
+
+OVERVIEW:
+merrin --serve ADDR:PORT collects snapshots as usual and serves the latest one over HTTP at
+/metrics, in the OpenMetrics text format Prometheus, VictoriaMetrics and the OpenTelemetry
+collector all scrape. curses is never started.
+
+CACHED PAYLOAD:
+A scrape never collects anything. The collection loop runs in the main thread on the
+scheduler's intervals, exactly like the display's, and each time a snapshot changes it is
+formatted into the payload once. Requests are answered by a threaded HTTP server that
+writes out whatever payload is cached, so ten scrapers cost the same collection work as
+one, and a scrape takes as long as sending a few kilobytes.
+
+The payload and its ETag are kept together in one tuple that the collection loop replaces
+whole, so a request thread always sees a matching pair without taking a lock. The ETag is a
+checksum of the payload: a scraper that sends it back in If-None-Match gets 304 Not Modified
+until the next snapshot with different values.
+
+METRICS:
+Every metric is a gauge, named merrin_<what>_<unit> in base units (bytes, seconds, celsius)
+as Prometheus convention asks. Disks, interfaces, cores, GPUs and pressure resources are
+labels. Metrics that are unavailable are left out rather than reported as NaN, and the
+process and cgroup tables aren't exported at all: their label values change every scrape,
+which is expensive for a time series database to store.
+"""
+
+import http.server
+import socket
+import sys
+import threading
+import time
+import zlib
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Our MB are 1024 * 1024 bytes
+MB = 1024 * 1024
+
+"""
+escape_label - Escape a label value for the text format
+
+Return: str: The value with backslashes, quotes and newlines escaped
+"""
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+"""
+add_family - Append one gauge and its samples, if any are available
+@lines: Lines of the payload so far
+@name: Metric name, ending in the unit if it has one
+@unit: Unit, or None
+@help_text: Description for the HELP line
+@samples: List of (labels, value), labels as a tuple of (name, value) pairs
+
+Samples with a value of None are left out, and so is the whole family if none are left.
+"""
+def add_family(lines, name, unit, help_text, samples):
+    samples = [(labels, value) for labels, value in samples if value is not None]
+    if not samples:
+        return
+    lines.append(f"# TYPE {name} gauge")
+    if unit is not None:
+        lines.append(f"# UNIT {name} {unit}")
+    lines.append(f"# HELP {name} {help_text}")
+    for labels, value in samples:
+        if labels:
+            label_text = ",".join(f'{label}="{escape_label(label_value)}"' for label, label_value in labels)
+            lines.append(f"{name}{{{label_text}}} {float(value)!r}")
+        else:
+            lines.append(f"{name} {float(value)!r}")
+
+"""
+format_openmetrics - Format a snapshot as an OpenMetrics text payload
+@data: Snapshot dictionary
+
+Return: bytes: The payload, ending with # EOF
+"""
+def format_openmetrics(data):
+    lines = []
+
+    if data.get('current_datetime') is not None:
+        add_family(lines, "merrin_snapshot_timestamp_seconds", "seconds", "When the snapshot was collected.", [((), data['current_datetime'].timestamp())])
+
+    add_family(lines, "merrin_cpu_usage_percent", "percent", "CPU utilization across all cores.", [((), data.get('cpu_usage'))])
+    if data.get('cpu_modes') is not None:
+        add_family(lines, "merrin_cpu_mode_percent", "percent", "Share of CPU time spent in each mode.", [((("mode", mode),), value) for mode, value in data['cpu_modes'].items()])
+    if data.get('cpu_cores') is not None:
+        add_family(lines, "merrin_cpu_core_usage_percent", "percent", "Utilization of each core.", [((("core", core),), value) for core, value in enumerate(data['cpu_cores'])])
+    add_family(lines, "merrin_cpu_temperature_celsius", "celsius", "CPU temperature.", [((), data.get('cpu_temp'))])
+
+    if data.get('gpu_usage') is not None:
+        add_family(lines, "merrin_gpu_vram_used_bytes", "bytes", "VRAM in use on each GPU.", [((("card", card),), usage['used'] * MB) for card, usage in data['gpu_usage'].items()])
+        add_family(lines, "merrin_gpu_vram_total_bytes", "bytes", "VRAM on each GPU.", [((("card", card),), usage['total'] * MB) for card, usage in data['gpu_usage'].items()])
+        cards = data['gpu_usage'].items()
+        add_family(lines, "merrin_gpu_busy_percent", "percent", "Share of time each GPU was busy.", [((("card", card),), usage.get('busy')) for card, usage in cards])
+        add_family(lines, "merrin_gpu_power_watts", "watts", "Board power of each GPU.", [((("card", card),), usage.get('power')) for card, usage in cards])
+        add_family(lines, "merrin_gpu_clock_hertz", "hertz", "Current shader and memory clock of each GPU.", [((("card", card), ("clock", clock)), None if usage.get(clock) is None else usage[clock] * 1e6) for card, usage in cards for clock in ("sclk", "mclk")])
+        add_family(lines, "merrin_gpu_gtt_used_bytes", "bytes", "GTT in use on each GPU.", [((("card", card),), None if usage.get('gtt_used') is None else usage['gtt_used'] * MB) for card, usage in cards])
+        add_family(lines, "merrin_gpu_gtt_total_bytes", "bytes", "GTT available to each GPU.", [((("card", card),), None if usage.get('gtt_total') is None else usage['gtt_total'] * MB) for card, usage in cards])
+    add_family(lines, "merrin_gpu_temperature_celsius", "celsius", "GPU junction temperature.", [((), data.get('gpu_temp'))])
+    if data.get('temps') is not None:
+        add_family(lines, "merrin_sensor_temperature_celsius", "celsius", "Every temperature of the CPU and GPU sensor chips.", [((("chip", chip), ("sensor", label)), temp) for chip, channels in data['temps'].items() for label, temp in channels.items()])
+
+    if data.get('memory') is not None:
+        add_family(lines, "merrin_memory_used_bytes", "bytes", "RAM in use.", [((), data['memory']['used'] * MB)])
+        add_family(lines, "merrin_memory_total_bytes", "bytes", "Total RAM.", [((), data['memory']['total'] * MB)])
+
+    if data.get('disk_io') is not None:
+        disks = data['disk_io'].items()
+        add_family(lines, "merrin_disk_read_bytes_per_second", None, "Bytes read from each disk per second.", [((("device", device),), io['read'] * MB) for device, io in disks])
+        add_family(lines, "merrin_disk_write_bytes_per_second", None, "Bytes written to each disk per second.", [((("device", device),), io['write'] * MB) for device, io in disks])
+        add_family(lines, "merrin_disk_iops", None, "Reads and writes completed by each disk per second.", [((("device", device),), io['iops']) for device, io in disks])
+        add_family(lines, "merrin_disk_utilization_percent", "percent", "Share of time each disk was busy.", [((("device", device),), io['util']) for device, io in disks])
+
+    if data.get('net_io') is not None:
+        interfaces = data['net_io'].items()
+        add_family(lines, "merrin_network_receive_bytes_per_second", None, "Bytes received on each interface per second.", [((("interface", interface),), io['rx'] * MB) for interface, io in interfaces])
+        add_family(lines, "merrin_network_transmit_bytes_per_second", None, "Bytes sent on each interface per second.", [((("interface", interface),), io['tx'] * MB) for interface, io in interfaces])
+
+    if data.get('pressure') is not None:
+        resources = data['pressure'].items()
+        add_family(lines, "merrin_pressure_some_percent", "percent", "Share of the last 10 seconds some tasks were stalled on each resource.", [((("resource", resource),), stall['some']) for resource, stall in resources])
+        add_family(lines, "merrin_pressure_full_percent", "percent", "Share of the last 10 seconds all tasks were stalled on each resource.", [((("resource", resource),), stall['full']) for resource, stall in resources])
+
+    if data.get('uptime') is not None:
+        add_family(lines, "merrin_uptime_seconds", "seconds", "Time since boot, to the minute.", [((), data['uptime']['hours'] * 3600 + data['uptime']['minutes'] * 60)])
+
+    lines.append("# EOF\n")
+    return "\n".join(lines).encode()
+
+"""
+MetricsHandler - Answers scrapes with the exporter's cached payload
+
+The server it belongs to has an exporter attribute pointing at the Exporter.
+"""
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    # Every response has a Content-Length, so scrapers can keep their connection open
+    protocol_version = "HTTP/1.1"
+    # Headers and payload are separate writes, which Nagle's algorithm would hold back until
+    # the scraper's delayed ACK, some 40 ms per scrape on a kept-open connection
+    disable_nagle_algorithm = True
+
+    """
+    respond - Send the cached payload, or 304 if the scraper already has it
+    @body: False to send only the headers, for HEAD
+    """
+    def respond(self, body):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        cached = self.server.exporter.cached
+        if cached is None:
+            # Nothing collected yet, scrapers retry on their next interval
+            self.send_error(503, "No snapshot collected yet")
+            return
+        payload, etag = cached
+
+        # If-None-Match is a list of ETags, possibly marked weak with W/
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            if etag in tags or "*" in tags:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if body:
+            self.wfile.write(payload)
+
+    """
+    do_GET - Called by the server for each GET request
+    """
+    def do_GET(self):
+        self.respond(True)
+
+    """
+    do_HEAD - Called by the server for each HEAD request
+    """
+    def do_HEAD(self):
+        self.respond(False)
+
+    """
+    log_message - Don't log requests, a scraper every few seconds would fill the terminal
+    """
+    def log_message(self, format, *args):
+        pass
+
+"""
+MetricsServer - Threaded HTTP server, one thread per connection
+"""
+class MetricsServer(http.server.ThreadingHTTPServer):
+    # Connection threads don't keep merrin running once the main loop exits
+    daemon_threads = True
+
+"""
+MetricsServer6 - MetricsServer listening on an IPv6 address
+"""
+class MetricsServer6(MetricsServer):
+    address_family = socket.AF_INET6
+
+"""
+Exporter - Keeps the latest snapshot formatted for scrapers
+"""
+class Exporter:
+    def __init__(self):
+        # (payload, ETag), replaced whole by publish so readers never see a mismatched pair
+        self.cached = None
+
+    """
+    publish - Format a new snapshot and make it the one scrapers get
+    @data: Snapshot dictionary
+    """
+    def publish(self, data):
+        payload = format_openmetrics(data)
+        self.cached = (payload, f'"{zlib.crc32(payload):08x}{len(payload):x}"')
+
+"""
+run_server - Serve the latest snapshot over HTTP until interrupted
+@address: (host, port) to listen on
+@source: Where snapshots come from, anything with run_due, time_until_due and values
+@recorder: Recorder to also save every snapshot to, or None
+"""
+def run_server(address, source, recorder=None):
+    host, port = address
+    server_class = MetricsServer6 if ":" in host else MetricsServer
+    try:
+        server = server_class(address, MetricsHandler)
+    except OSError as err:
+        print(f"Can't listen on {host}:{port}: {err}")
+        sys.exit(1)
+    exporter = Exporter()
+    server.exporter = exporter
+    # The server answers from its own threads, the main thread only collects
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # Port 0 picks a free port, show the one we got
+    port = server.server_address[1]
+    print(f"Serving OpenMetrics on http://{f'[{host}]' if ':' in host else host or '0.0.0.0'}:{port}/metrics", flush=True)
+
+    done = getattr(source, "done", None)
+    try:
+        while done is None or not done():
+            if source.run_due():
+                exporter.publish(source.values)
+                if recorder is not None:
+                    recorder.write(source.values)
+            time.sleep(source.time_until_due())
+        # A replayed recording stays available at its last snapshot
+        threading.Event().wait()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,110 @@
+"""
+temps.py
+
+Every temperature channel of the CPU and GPU sensor chips.
+
+OVERVIEW:
+CPU and GPU Temperature show one reading per chip: Tctl for the CPU and the junction for
+the GPU. On an EPYC or Threadripper the CPU is up to twelve separate dies (CCDs), and
+k10temp reports each one as Tccd1..Tccd12. A single hot CCD, the one running a pinned
+workload, hides behind a Tctl that looks fine. GPUs report their edge and memory
+temperatures next to the junction in the same way.
+
+The temperature matrix shows every labelled channel of the chips in TEMP_MATRIX_CHIPS, one
+row per chip:
+
+k10temp   Tctl 71/84  Tccd1 64/80  Tccd2 58/62  ...
+amdgpu0   edge 52/61  junction 60/75  mem 66/70
+amdgpu1   edge 49/55  junction 55/68  mem 62/64
+
+The second number is the hottest the channel got over the sparkline history (see
+history.py). Chips sharing a name are numbered in hwmon order.
+
+CHANNEL TABLE:
+The SensorRegistry already lists every chip's channels when it scans hwmon. The matrix is
+built from that list once: a flat table of (chip, label, PseudoFile), so each frame reads
+the whole matrix in one pass of pread() calls without listing directories or reading
+labels. The table is rebuilt whenever the registry rescans. A channel that can't be read is
+marked unavailable in the registry and skipped until its next rescan, see
+SensorRegistry.mark_unavailable.
+"""
+
+import merrin.config
+import merrin.reader
+from merrin.metrics import refresh_interval
+
+"""
+TempMatrix - Kept-open input files of every channel of the matrix chips
+@sensors: The scheduler's SensorRegistry, already scanned
+"""
+class TempMatrix:
+    def __init__(self, sensors):
+        self.sensors = sensors
+        # [(chip, label, PseudoFile)] in display order
+        self.channels = []
+        # The registry's generation the table was built from
+        self.generation = None
+        self.build()
+
+    """
+    build - Open the input file of every channel of the chips in TEMP_MATRIX_CHIPS
+    """
+    def build(self):
+        self.close()
+        self.generation = self.sensors.generation
+        chips = [(name, channels) for name, channels in self.sensors.chips if name in merrin.config.TEMP_MATRIX_CHIPS and channels]
+        names = [name for name, _ in chips]
+        seen = {}
+        for name, channels in chips:
+            # A single k10temp keeps its name, two GPUs become amdgpu0 and amdgpu1
+            chip = name
+            if names.count(name) > 1:
+                chip = f"{name}{seen.get(name, 0)}"
+                seen[name] = seen.get(name, 0) + 1
+            for label, path in channels:
+                try:
+                    self.channels.append((chip, label, merrin.reader.PseudoFile(path, 32)))
+                except OSError:
+                    continue
+
+    """
+    collect - Read every channel, rebuilding the table first if the registry rescanned
+
+    Return: dict: {chip: {label: degrees Celsius}} in table order, or None if no channel
+    could be read
+    """
+    @refresh_interval(merrin.config.TEMP_REFRESH_INTERVAL)
+    def collect(self):
+        self.sensors.check_topology()
+        if self.sensors.generation != self.generation:
+            self.build()
+
+        matrix = {}
+        unavailable = self.sensors.unavailable
+        for chip, label, pseudo_file in self.channels:
+            if pseudo_file.path in unavailable:
+                continue
+            try:
+                pseudo_file.read()
+                temp_md = pseudo_file.int_at(0)
+            except OSError:
+                temp_md = None
+            if temp_md is None:
+                # A chip went away or was rebound, the registry rescans when it may and the
+                # next frame reads the new table
+                self.sensors.mark_unavailable(pseudo_file.path)
+                unavailable = self.sensors.unavailable
+                continue
+            row = matrix.get(chip)
+            if row is None:
+                row = matrix[chip] = {}
+            row[label] = round(temp_md / 1000.0, 1)
+        return matrix if matrix else None
+
+    """
+    close - Close every kept-open input file
+    """
+    def close(self):
+        for _, _, pseudo_file in self.channels:
+            pseudo_file.close()
+        self.channels = []